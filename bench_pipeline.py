@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+قياس تكلفة سلسلة معالجة نصوص الوسوم لكل وسم مقارنة بالتسلسل السابق
+(remove_links ← apply_replacements ← apply_footer)
+
+الاستخدام:
+    python bench_pipeline.py [عدد_القواعد] [عدد_التكرارات]
+"""
+
+import os
+import sys
+import timeit
+
+# البوت يتطلب رمزاً عند الاستيراد، ولا يتم الاتصال بتلجرام أثناء القياس
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+
+import new_bot
+from bench_replacements import build_rules
+
+
+def legacy_process(text, tag_key):
+    """التسلسل السابق: ثلاث دوال تتحقق كل منها من إعدادها في كل استدعاء."""
+    text = new_bot.remove_links(text)
+    text = new_bot.apply_replacements(text, tag_key)
+    return new_bot.apply_footer(text, tag_key)
+
+
+def main():
+    rule_count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    new_bot.replacements = build_rules(rule_count)
+    new_bot.invalidate_replacement_matchers()
+
+    samples = [
+        "محاضرة الشيخ في تفسير سورة البقرة - الدرس الأول",
+        "نشيد جديد @sponsor_channel_10 حصرياً على قناة الراعي رقم 7 https://t.me/example",
+        "Lecture 12 - Introduction (recorded live) @sponsor_channel_298",
+    ]
+    tag_keys = ["title"] + list(new_bot.ID3_FRAME_BUILDERS)
+
+    # التأكد من تطابق النتائج مع التسلسل السابق قبل تفعيل المراحل الجديدة
+    for tag_key in tag_keys:
+        for text in samples:
+            assert legacy_process(text, tag_key) == new_bot.process_tag_text(text, tag_key)
+
+    calls = iterations * len(samples)
+    print(f"عدد القواعد: {rule_count} | عدد الاستدعاءات لكل وسم: {calls}")
+    print(f"{'الوسم':<14}{'المراحل':<40}{'السابق µs':>12}{'السلسلة µs':>12}")
+
+    for tag_key in tag_keys:
+        new_bot.get_text_pipeline(tag_key)
+        legacy_time = timeit.timeit(
+            lambda: [legacy_process(text, tag_key) for text in samples], number=iterations
+        )
+        pipeline_time = timeit.timeit(
+            lambda: [new_bot.process_tag_text(text, tag_key) for text in samples], number=iterations
+        )
+        stages = ", ".join(name for name, _ in new_bot.get_text_pipeline(tag_key)) or "-"
+        print(f"{tag_key:<14}{stages:<40}"
+              f"{legacy_time / calls * 1e6:>12.2f}{pipeline_time / calls * 1e6:>12.2f}")
+
+    # تكلفة السلسلة الكاملة بعد تفعيل مراحل التنظيف الإضافية
+    new_bot.config["normalize_arabic_enabled"] = True
+    new_bot.config["trim_whitespace_enabled"] = True
+    new_bot.invalidate_text_pipelines()
+    full_time = timeit.timeit(
+        lambda: [new_bot.process_tag_text(text, "title") for text in samples], number=iterations
+    )
+    stages = ", ".join(name for name, _ in new_bot.get_text_pipeline("title"))
+    print(f"\nالعنوان مع جميع المراحل ({stages}): {full_time / calls * 1e6:.2f} µs لكل نص")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+قياس أداء محرك الاستبدال المترجم مقارنة بحلقة str.replace السابقة
+
+الاستخدام:
+    python bench_replacements.py [عدد_القواعد] [عدد_التكرارات]
+"""
+
+import os
+import sys
+import timeit
+
+# البوت يتطلب رمزاً عند الاستيراد، ولا يتم الاتصال بتلجرام أثناء القياس
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+
+import new_bot
+
+
+def legacy_apply_replacements(text, tag_key):
+    """التطبيق السابق: str.replace لكل قاعدة بالترتيب."""
+    result = text
+    for rule_id, rule in new_bot.replacements.items():
+        if tag_key in rule["tags"]:
+            result = result.replace(rule["original"], rule["replacement"])
+    return result
+
+
+def build_rules(count):
+    """إنشاء قواعد تشبه قواعد حذف أسماء القنوات والرعاة."""
+    rules = {}
+    for index in range(count):
+        rules[str(index + 1)] = {
+            "name": f"قاعدة {index + 1}",
+            "original": f"قناة الراعي رقم {index}" if index % 2 else f"@sponsor_channel_{index}",
+            "replacement": "",
+            "tags": ["title", "artist", "album"]
+        }
+    return rules
+
+
+def main():
+    rule_count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    new_bot.replacements = build_rules(rule_count)
+    new_bot.invalidate_replacement_matchers()
+
+    samples = [
+        "محاضرة الشيخ في تفسير سورة البقرة - الدرس الأول",
+        "نشيد جديد @sponsor_channel_10 حصرياً على قناة الراعي رقم 7",
+        "Lecture 12 - Introduction (recorded live) @sponsor_channel_298",
+    ]
+
+    # التأكد من تطابق النتائج قبل القياس
+    for text in samples:
+        assert legacy_apply_replacements(text, "title") == new_bot.apply_replacements(text, "title")
+
+    compile_time = timeit.timeit(
+        lambda: new_bot.compile_replacement_matcher("title"), number=1
+    )
+    legacy_time = timeit.timeit(
+        lambda: [legacy_apply_replacements(text, "title") for text in samples], number=iterations
+    )
+    engine_time = timeit.timeit(
+        lambda: [new_bot.apply_replacements(text, "title") for text in samples], number=iterations
+    )
+
+    calls = iterations * len(samples)
+    print(f"عدد القواعد: {rule_count} | عدد الاستدعاءات: {calls}")
+    print(f"زمن ترجمة المحرك: {compile_time * 1000:.2f} ms")
+    print(f"الحلقة السابقة: {legacy_time / calls * 1e6:.2f} µs لكل نص")
+    print(f"المحرك المترجم: {engine_time / calls * 1e6:.2f} µs لكل نص")
+    print(f"التسريع: {legacy_time / engine_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,20 +6,52 @@
 """
 
 import os
+import sys
+import atexit
+import signal
 import logging
 import telebot
-from telebot import types
+from telebot import types, apihelper
 import tempfile
+import shutil
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
+import io
 import time
 import json
+import queue
+import threading
+import functools
+import bisect
+import hashlib
+import socket
+import uuid
+import sqlite3
+import hmac
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import mutagen
-from mutagen.id3 import ID3
+from mutagen.id3 import ID3, ParseID3v1
+from mutagen.flac import FLAC, Picture
+from mutagen.mp4 import MP4, MP4Cover, MP4FreeForm
+from mutagen.oggopus import OggOpus
+from mutagen.oggvorbis import OggVorbis
+import base64
 import psycopg2
 from psycopg2 import pool
+from psycopg2.extras import execute_values
 from datetime import datetime
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager, nullcontext, ExitStack
+
+# مكتبة Pillow اختيارية: تُستخدم فقط لتصغير صورة الألبوم إذا كانت مثبتة
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 
 # تكوين السجلات (logger) في أول الكود قبل أي استخدام له
 logging.basicConfig(
@@ -30,107 +62,315 @@ logger = logging.getLogger(__name__)
 
 # إعداد قاعدة البيانات
 DATABASE_URL = os.getenv('DATABASE_URL')
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))  # أقل عدد من الاتصالات المفتوحة
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))  # أقصى عدد من الاتصالات المفتوحة
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # أقصى مدة انتظار لاتصال متاح بالثواني
+DB_PING_IDLE_SECONDS = float(os.getenv("DB_PING_IDLE_SECONDS", "30"))  # فحص الاتصال إذا بقي خاملاً أكثر من هذه المدة
+DB_SLOW_CHECKOUT_SECONDS = 1.0  # تسجيل تحذير إذا طال انتظار اتصال متاح
+
 connection_pool = None
 
+# يحد عدد الاتصالات المستعارة في نفس الوقت حتى ينتظر الطلب بدلاً من فشل المجمع فوراً
+db_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+db_pool_lock = threading.Lock()
+db_last_used = {}
+db_pool_stats = {
+    "checkouts": 0,
+    "in_use": 0,
+    "max_in_use": 0,
+    "wait_total": 0.0,
+    "wait_max": 0.0,
+    "timeouts": 0,
+    "reconnects": 0
+}
+
+
+def _checkout_connection():
+    """استعارة اتصال من المجمع والتأكد من أنه ما زال صالحاً بعد فترة الخمول"""
+    conn = connection_pool.getconn()
+    idle = time.monotonic() - db_last_used.get(id(conn), 0)
+
+    if conn.closed or idle > DB_PING_IDLE_SECONDS:
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # الاتصال أُغلق من طرف الخادم (مثل انقطاع الخمول في Neon أو pgbouncer)
+            logger.warning(f"تم استبدال اتصال منتهٍ بقاعدة البيانات: {e}")
+            db_last_used.pop(id(conn), None)
+            connection_pool.putconn(conn, close=True)
+            with db_pool_lock:
+                db_pool_stats["reconnects"] += 1
+            conn = connection_pool.getconn()
+
+    return conn
+
+
+@contextmanager
+def db_connection():
+    """استعارة اتصال من مجمع قاعدة البيانات وإرجاعه دائماً عند الانتهاء"""
+    started = time.monotonic()
+    if not db_pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        with db_pool_lock:
+            db_pool_stats["timeouts"] += 1
+        logger.error(f"انتهت مهلة انتظار اتصال بقاعدة البيانات ({DB_POOL_TIMEOUT} ثانية)")
+        raise pool.PoolError("لا يوجد اتصال متاح في مجمع قاعدة البيانات")
+
+    conn = None
+    try:
+        conn = _checkout_connection()
+        waited = time.monotonic() - started
+        if waited > DB_SLOW_CHECKOUT_SECONDS:
+            logger.warning(f"انتظار طويل لاتصال بقاعدة البيانات: {waited:.2f} ثانية")
+
+        with db_pool_lock:
+            db_pool_stats["checkouts"] += 1
+            db_pool_stats["in_use"] += 1
+            db_pool_stats["max_in_use"] = max(db_pool_stats["max_in_use"], db_pool_stats["in_use"])
+            db_pool_stats["wait_total"] += waited
+            db_pool_stats["wait_max"] = max(db_pool_stats["wait_max"], waited)
+
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            with db_pool_lock:
+                db_pool_stats["in_use"] -= 1
+    finally:
+        if conn is not None:
+            if conn.closed:
+                db_last_used.pop(id(conn), None)
+            else:
+                db_last_used[id(conn)] = time.monotonic()
+            connection_pool.putconn(conn, close=bool(conn.closed))
+        db_pool_slots.release()
+
+
+def get_db_pool_stats():
+    """إحصائيات مجمع الاتصالات: الاستعارات، الاتصالات المستخدمة، ومدة الانتظار"""
+    with db_pool_lock:
+        stats = dict(db_pool_stats)
+    stats["max_size"] = DB_POOL_MAX
+    stats["wait_avg"] = stats["wait_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+    return stats
+
+
 if DATABASE_URL:
     try:
         # تغيير عنوان URL لاستخدام connection pooling
         pooled_url = DATABASE_URL.replace('.us-east-2', '-pooler.us-east-2')
-        connection_pool = pool.SimpleConnectionPool(1, 10, pooled_url)
+        # ThreadedConnectionPool آمن للاستخدام من خيوط معالجات telebot المتعددة
+        connection_pool = pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, pooled_url)
         logger.info("تم الاتصال بقاعدة البيانات بنجاح")
-        
-        # إنشاء الجداول إذا لم تكن موجودة
-        conn = connection_pool.getconn()
-        cur = conn.cursor()
-        
-        # جدول السجلات
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS edit_logs (
-                id SERIAL PRIMARY KEY,
-                file_name TEXT NOT NULL,
-                edit_type TEXT NOT NULL,
-                edit_details JSONB,
-                edited_by INTEGER,
-                edited_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # جدول الإعدادات
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value JSONB,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        conn.commit()
-        cur.close()
-        connection_pool.putconn(conn)
-        
+
     except Exception as e:
         logger.error(f"خطأ في الاتصال بقاعدة البيانات: {e}")
         connection_pool = None
 else:
     logger.warning("لم يتم العثور على رابط قاعدة البيانات")
 
+if connection_pool:
+    try:
+        # إنشاء الجداول إذا لم تكن موجودة
+        with db_connection() as conn:
+            cur = conn.cursor()
+
+            # جدول السجلات
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS edit_logs (
+                    id SERIAL PRIMARY KEY,
+                    file_name TEXT NOT NULL,
+                    edit_type TEXT NOT NULL,
+                    edit_details JSONB,
+                    edited_by BIGINT,
+                    edited_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # معرفات تلجرام الحديثة تتجاوز حدود INTEGER؛ يُعدل العمود مرة واحدة فقط
+            # لأن ALTER يقفل الجدول ويعيد كتابته بالكامل
+            cur.execute("""
+                SELECT data_type FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = 'edit_logs' AND column_name = 'edited_by'
+            """)
+            column = cur.fetchone()
+            if column and column[0] != 'bigint':
+                cur.execute("ALTER TABLE edit_logs ALTER COLUMN edited_by TYPE BIGINT")
+
+            # جدول مهام معالجة الملفات الصوتية (مشترك بين جميع نسخ البوت)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS audio_jobs (
+                    id BIGSERIAL PRIMARY KEY,
+                    payload JSONB NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at DOUBLE PRECISION NOT NULL,
+                    locked_by TEXT,
+                    locked_at DOUBLE PRECISION,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS audio_jobs_pending_idx
+                ON audio_jobs (next_attempt_at) WHERE state NOT IN ('done', 'failed')
+            """)
+
+            # جدول الإعدادات
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value JSONB,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            conn.commit()
+            cur.close()
+
+    except Exception as e:
+        logger.error(f"خطأ في إنشاء جداول قاعدة البيانات: {e}")
+        connection_pool = None
+
 # ... بقية الكود كما هو بدون تغيير ... 
 
+# قائمة انتظار سجلات التعديل التي تُكتب دفعة واحدة من خيط في الخلفية
+edit_log_queue = None
+edit_log_thread = None
+EDIT_LOG_STOP = object()
+
+
 def log_edit(file_name, edit_type, edit_details, user_id):
-    """تسجيل التعديلات في قاعدة البيانات"""
-    if connection_pool:
-        try:
-            conn = connection_pool.getconn()
+    """إضافة سجل تعديل إلى قائمة الانتظار ليُكتب لاحقاً مع غيره في قاعدة البيانات"""
+    if not connection_pool or edit_log_queue is None:
+        return
+
+    entry = (file_name, edit_type, json.dumps(edit_details, ensure_ascii=False), user_id)
+    try:
+        # عند امتلاء القائمة ننتظر قليلاً حتى يفرغها الخيط، ثم نتخلى عن السجل
+        edit_log_queue.put(entry, timeout=EDIT_LOG_PUT_TIMEOUT)
+    except queue.Full:
+        logger.warning(f"قائمة سجلات التعديل ممتلئة، تم تجاهل سجل الملف: {file_name}")
+
+
+def write_edit_logs(entries):
+    """كتابة مجموعة من سجلات التعديل في استعلام INSERT واحد"""
+    try:
+        with db_connection() as conn:
             cur = conn.cursor()
-            cur.execute(
-                "INSERT INTO edit_logs (file_name, edit_type, edit_details, edited_by) VALUES (%s, %s, %s, %s)",
-                (file_name, edit_type, json.dumps(edit_details), user_id)
+            execute_values(
+                cur,
+                "INSERT INTO edit_logs (file_name, edit_type, edit_details, edited_by) VALUES %s",
+                entries,
+                page_size=EDIT_LOG_BATCH_SIZE
             )
             conn.commit()
             cur.close()
-            connection_pool.putconn(conn)
-        except Exception as e:
-            logger.error(f"خطأ في تسجيل التعديل: {e}")
+    except Exception as e:
+        logger.error(f"خطأ في تسجيل {len(entries)} من التعديلات: {e}")
 
-def save_settings_to_db():
-    """حفظ الإعدادات في قاعدة البيانات"""
-    if connection_pool:
+
+def edit_log_writer():
+    """خيط يجمع السجلات ويكتبها عند بلوغ حجم الدفعة أو انتهاء مهلة الانتظار"""
+    batch = []
+    deadline = None
+
+    while True:
+        timeout = max(0, deadline - time.monotonic()) if batch else None
         try:
-            data = {
-                'source_channel': SOURCE_CHANNEL,
-                'target_channel': TARGET_CHANNEL,
-                'current_template_key': current_template_key,
-                'templates': templates,
-                'replacements': replacements,
-                'footers': footers,
-                'config': config,
-                'album_cover_path': album_cover_path
-            }
-            
-            conn = connection_pool.getconn()
+            entry = edit_log_queue.get(timeout=timeout)
+        except queue.Empty:
+            entry = None
+
+        if entry is EDIT_LOG_STOP:
+            if batch:
+                write_edit_logs(batch)
+            break
+
+        if entry is not None:
+            if not batch:
+                deadline = time.monotonic() + EDIT_LOG_FLUSH_INTERVAL
+            batch.append(entry)
+
+        if batch and (len(batch) >= EDIT_LOG_BATCH_SIZE or time.monotonic() >= deadline):
+            write_edit_logs(batch)
+            batch = []
+
+
+def start_edit_log_writer():
+    """تشغيل خيط كتابة سجلات التعديل إذا كانت قاعدة البيانات متاحة"""
+    global edit_log_queue, edit_log_thread
+
+    if not connection_pool or edit_log_thread:
+        return
+
+    edit_log_queue = queue.Queue(maxsize=EDIT_LOG_QUEUE_SIZE)
+    edit_log_thread = threading.Thread(target=edit_log_writer, name="edit-log-writer", daemon=True)
+    edit_log_thread.start()
+    atexit.register(stop_edit_log_writer)
+
+
+def stop_edit_log_writer(timeout=10):
+    """كتابة السجلات المتبقية ثم إيقاف الخيط"""
+    global edit_log_thread
+
+    if not edit_log_thread:
+        return
+
+    edit_log_queue.put(EDIT_LOG_STOP)
+    edit_log_thread.join(timeout)
+    edit_log_thread = None
+
+SETTINGS_KEY_PREFIX = "bot_settings:"
+
+
+def save_settings_to_db(sections):
+    """حفظ أقسام الإعدادات المعدلة فقط في قاعدة البيانات (صف مستقل لكل قسم)"""
+    if not connection_pool:
+        return False
+
+    try:
+        with db_connection() as conn:
             cur = conn.cursor()
-            cur.execute(
-                "INSERT INTO settings (key, value) VALUES ('bot_settings', %s) ON CONFLICT (key) DO UPDATE SET value = %s, updated_at = CURRENT_TIMESTAMP",
-                (json.dumps(data), json.dumps(data))
+            cur.executemany(
+                "INSERT INTO settings (key, value) VALUES (%s, %s) ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP",
+                [(SETTINGS_KEY_PREFIX + name, value) for name, value in sections.items()]
             )
             conn.commit()
             cur.close()
-            connection_pool.putconn(conn)
-            logger.info("تم حفظ الإعدادات في قاعدة البيانات")
-        except Exception as e:
-            logger.error(f"خطأ في حفظ الإعدادات: {e}")
+        logger.info(f"تم حفظ الإعدادات في قاعدة البيانات: {', '.join(sections)}")
+        return True
+    except Exception as e:
+        logger.error(f"خطأ في حفظ الإعدادات: {e}")
+        return False
 
 def load_settings_from_db():
     """تحميل الإعدادات من قاعدة البيانات"""
     if connection_pool:
         try:
-            conn = connection_pool.getconn()
-            cur = conn.cursor()
-            cur.execute("SELECT value FROM settings WHERE key = 'bot_settings'")
-            result = cur.fetchone()
-            cur.close()
-            connection_pool.putconn(conn)
-            
+            with db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT key, value FROM settings WHERE key LIKE %s", (SETTINGS_KEY_PREFIX + '%',))
+                rows = cur.fetchall()
+                if not rows:
+                    # الصيغة القديمة: جميع الإعدادات في صف واحد
+                    cur.execute("SELECT value FROM settings WHERE key = 'bot_settings'")
+                    result = cur.fetchone()
+                cur.close()
+                conn.rollback()
+
+            if rows:
+                data = {key[len(SETTINGS_KEY_PREFIX):]: value for key, value in rows}
+                # الأقسام المحفوظة حالياً في قاعدة البيانات لا تحتاج لإعادة الكتابة
+                for name, value in data.items():
+                    persisted_settings[name] = json.dumps(value, ensure_ascii=False, sort_keys=True)
+                return data
             if result:
                 data = result[0]
                 return data
@@ -161,13 +401,22 @@ ADMIN_ID = 485527614  # معرف المشرف
 SOURCE_CHANNEL = ""  # سيتم تعيينه من خلال لوحة التحكم
 TARGET_CHANNEL = ""  # سيتم تعيينه من خلال لوحة التحكم
 
+# قنوات هدف إضافية يُعاد إليها نشر الملف المعالج (مفصولة بفواصل في ملف .env)
+# تُقرأ من ملف .env فقط ولا تُحفظ مع الإعدادات، حتى يسري أي تعديل عليها بعد إعادة التشغيل
+DEFAULT_EXTRA_TARGET_CHANNELS = [
+    channel.strip() for channel in os.getenv("EXTRA_TARGET_CHANNELS", "").split(",") if channel.strip()
+]
+EXTRA_TARGET_CHANNELS = list(DEFAULT_EXTRA_TARGET_CHANNELS)
+
 # حالات البوت - تفعيل/تعطيل الميزات
 config = {
     "bot_enabled": True,  # تفعيل/تعطيل البوت بالكامل
     "replacement_enabled": True,  # تفعيل/تعطيل الاستبدال
     "footer_enabled": True,  # تفعيل/تعطيل التذييل
     "remove_links_enabled": True,  # تفعيل/تعطيل حذف الروابط
-    "album_cover_enabled": True  # تفعيل/تعطيل صورة الألبوم
+    "album_cover_enabled": True,  # تفعيل/تعطيل صورة الألبوم
+    "normalize_arabic_enabled": False,  # تفعيل/تعطيل حذف التشكيل والتطويل
+    "trim_whitespace_enabled": False  # تفعيل/تعطيل تنظيف المسافات الزائدة
 }
 
 # مسار صورة الألبوم
@@ -257,6 +506,21 @@ available_id3_tags = {
     "description": "الوصف"
 }
 
+# إعدادات كتابة سجلات التعديل دفعة واحدة
+EDIT_LOG_BATCH_SIZE = int(os.getenv("EDIT_LOG_BATCH_SIZE", "200"))  # أقصى عدد سجلات في الدفعة
+EDIT_LOG_FLUSH_INTERVAL = float(os.getenv("EDIT_LOG_FLUSH_INTERVAL", "2"))  # أقصى مدة بقاء السجل في الذاكرة
+EDIT_LOG_QUEUE_SIZE = int(os.getenv("EDIT_LOG_QUEUE_SIZE", "10000"))  # أقصى عدد سجلات منتظرة
+EDIT_LOG_PUT_TIMEOUT = float(os.getenv("EDIT_LOG_PUT_TIMEOUT", "1"))  # مدة الانتظار عند امتلاء القائمة
+
+# حفظ الإعدادات: مدة تجميع التعديلات قبل الكتابة، وآخر نسخة محفوظة من كل قسم
+SETTINGS_SAVE_DEBOUNCE = float(os.getenv("SETTINGS_SAVE_DEBOUNCE", "2"))
+SETTINGS_SAVE_RETRY = float(os.getenv("SETTINGS_SAVE_RETRY", "30"))  # إعادة المحاولة بعد فشل الحفظ في قاعدة البيانات
+persisted_settings = {}
+settings_version = 0  # يزداد مع كل تعديل على الإعدادات
+settings_flush_timer = None
+settings_timer_lock = threading.Lock()
+settings_flush_lock = threading.Lock()
+
 # حالات المحادثة
 STATE_AWAITING_SOURCE_CHANNEL = "awaiting_source"
 STATE_AWAITING_TARGET_CHANNEL = "awaiting_target"
@@ -274,42 +538,733 @@ user_states = {}
 user_channels = {}
 temp_data = {}
 
+# إعدادات التحميل (يمكن تعديلها من ملف .env)
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))  # حجم الجزء الواحد بالبايت
+DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", "10"))  # مهلة الاتصال بالثواني
+DOWNLOAD_READ_TIMEOUT = float(os.getenv("DOWNLOAD_READ_TIMEOUT", "60"))  # مهلة القراءة بين الأجزاء بالثواني
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))  # عدد الاتصالات المحفوظة لكل خادم
+DOWNLOAD_DIR_PREFIX = "audio_job_"
+
+# إعدادات مجلد العمل المؤقت (spool) للملفات قيد المعالجة
+SPOOL_DIR = os.getenv("SPOOL_DIR", os.path.join(tempfile.gettempdir(), "audio_spool"))  # لكل نسخة مجلد فرعي باسم WORKER_ID
+SPOOL_QUOTA_BYTES = int(os.getenv("SPOOL_QUOTA_BYTES", str(2 * 1024 ** 3)))  # أقصى حجم لملفات المهام معاً
+SPOOL_WAIT_TIMEOUT = float(os.getenv("SPOOL_WAIT_TIMEOUT", "600"))  # أقصى انتظار لتوفر مساحة بالثواني
+SPOOL_STALE_MINUTES = float(os.getenv("SPOOL_STALE_MINUTES", "60"))  # عمر الملفات المتروكة قبل حذفها
+SPOOL_REAP_INTERVAL = float(os.getenv("SPOOL_REAP_INTERVAL", "300"))  # الفاصل بين عمليات التنظيف بالثواني
+SPOOL_SHARDS = 16  # عدد المجلدات الفرعية التي تُوزع عليها مجلدات المهام
+
+# أقصى طول لقيمة الوسم بعد المعالجة (0 لتعطيل القص)
+TAG_MAX_LENGTH = int(os.getenv("TAG_MAX_LENGTH", "0"))
+
+# حذف النطاقات المجردة مثل example.com مع الروابط (معطل افتراضياً)
+REMOVE_BARE_DOMAINS = os.getenv("REMOVE_BARE_DOMAINS", "0") == "1"
+
+ALBUM_COVERS_DIR = "album_covers"
+
+# إعدادات معالجة الملفات الصوتية في الخلفية
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", "8"))  # عدد خيوط المعالجة
+AUDIO_QUEUE_SIZE = int(os.getenv("AUDIO_QUEUE_SIZE", "200"))  # الحد الأقصى للمهام المنتظرة
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "4"))  # عمليات التحميل المتزامنة
+TAG_CONCURRENCY = int(os.getenv("TAG_CONCURRENCY", "2"))  # عمليات تعديل الوسوم المتزامنة
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))  # عمليات الرفع المتزامنة
+CHANNEL_CONCURRENCY = int(os.getenv("CHANNEL_CONCURRENCY", "2"))  # الملفات المعالجة معاً من كل قناة مصدر
+CHANNEL_ORDER_TIMEOUT = float(os.getenv("CHANNEL_ORDER_TIMEOUT", "600"))  # أقصى انتظار لدور النشر بالثواني
+
+# إعدادات حفظ المهام واستئنافها بعد التوقف
+WORKER_ID = os.getenv("WORKER_ID", "")  # معرف ثابت ومختلف لكل نسخة من البوت (يُولد ويُحفظ إذا لم يُعرف)
+WORKER_ID_PATH = os.getenv("WORKER_ID_PATH", "worker_id.txt")  # ملف حفظ المعرف المولد (على وحدة تخزين خاصة بكل نسخة تبقى بعد إعادة التشغيل)
+JOBS_SQLITE_PATH = os.getenv("JOBS_SQLITE_PATH", "audio_jobs.sqlite3")  # يُستخدم عند عدم توفر Postgres
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))  # عدد المحاولات قبل اعتبار المهمة فاشلة
+JOB_RETRY_BASE = float(os.getenv("JOB_RETRY_BASE", "30"))  # مهلة أول إعادة محاولة بالثواني (تتضاعف بعدها)
+JOB_RETRY_MAX = float(os.getenv("JOB_RETRY_MAX", "1800"))  # أقصى مهلة بين المحاولات
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "3600"))  # مهلة اعتبار المهمة المحجوزة متروكة
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "60"))  # الفاصل بين تحديثات حجز المهام الجارية
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))  # الفاصل بين عمليات البحث عن مهام مستحقة
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))  # مدة الاحتفاظ بالمهام المنتهية
+
+# إعدادات فهرس الملفات المعالجة مسبقاً
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "5000"))  # 0 لتعطيل الفهرس
+DEDUP_INDEX_PATH = os.getenv("DEDUP_INDEX_PATH", "dedup_index.json")
+DEDUP_SAVE_DEBOUNCE = float(os.getenv("DEDUP_SAVE_DEBOUNCE", "10"))  # تأخير حفظ الفهرس بالثواني
+
+# إعدادات معالجة الألبومات (المجموعات الإعلامية)
+MEDIA_GROUP_WINDOW = float(os.getenv("MEDIA_GROUP_WINDOW", "1.5"))  # مدة انتظار بقية ملفات الألبوم بالثواني
+MEDIA_GROUP_MAX_ITEMS = 10  # حد تلجرام لعدد الملفات في الرسالة المجمعة
+
+# حدود إرسال الرسائل إلى تلجرام (https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this)
+RATE_GLOBAL_PER_SECOND = float(os.getenv("RATE_GLOBAL_PER_SECOND", "30"))  # لجميع المحادثات معاً
+RATE_PRIVATE_PER_SECOND = float(os.getenv("RATE_PRIVATE_PER_SECOND", "1"))  # لكل محادثة خاصة
+RATE_GROUP_PER_MINUTE = float(os.getenv("RATE_GROUP_PER_MINUTE", "20"))  # لكل مجموعة أو قناة
+RATE_PRIVATE_BURST = float(os.getenv("RATE_PRIVATE_BURST", "3"))  # عدد الرسائل المسموح بها دفعة واحدة
+RATE_GROUP_BURST = float(os.getenv("RATE_GROUP_BURST", "5"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "5"))  # إعادة المحاولة بعد خطأ 429
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "3"))  # أقل فاصل بين تعديلات رسالة الحالة بالثواني
+PROGRESS_STATE_TTL = float(os.getenv("PROGRESS_STATE_TTL", "3600"))  # حذف حالة رسالة لم تُحدث منذ هذه المدة بالثواني
+
+# أولوية الطلبات: الرقم الأصغر يُرسل أولاً عند الازدحام
+PRIORITY_PUBLISH = 0  # النشر في القنوات
+PRIORITY_REPLY = 1  # إرسال الملف المعالج للمستخدم
+PRIORITY_STATUS = 2  # رسائل الحالة والإشعارات
+
+# إعدادات صورة الألبوم
+ALBUM_COVER_MAX_SIZE = int(os.getenv("ALBUM_COVER_MAX_SIZE", "800"))  # أقصى طول للضلع بالبكسل (0 لتعطيل التصغير)
+ALBUM_COVER_MAX_BYTES = int(os.getenv("ALBUM_COVER_MAX_BYTES", str(300 * 1024)))  # أقصى حجم قبل إعادة الضغط
+ALBUM_COVER_QUALITY = int(os.getenv("ALBUM_COVER_QUALITY", "85"))  # جودة JPEG عند إعادة الضغط
+
+# مساحة فارغة تُحجز بعد الوسوم عند إعادة كتابة الملف، لتُكتب التعديلات التالية في مكانها
+TAG_PADDING_BYTES = int(os.getenv("TAG_PADDING_BYTES", str(128 * 1024)))
+
+# فحص وسوم ملفات MP3 بتحميل بدايتها ونهايتها فقط (طلبات HTTP Range)
+TAG_PROBE_ENABLED = os.getenv("TAG_PROBE_ENABLED", "1") == "1"
+TAG_PROBE_BYTES = int(os.getenv("TAG_PROBE_BYTES", str(64 * 1024)))  # حجم الجزء الأول المحمل
+ID3_FORMAT_PROBE_BYTES = 1024  # البايتات المقروءة بعد وسم ID3 لتحديد صيغة الصوت الذي يليه
+
+# إعدادات طريقة استلام التحديثات (polling أو webhook)
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # العنوان العام الذي يرسل إليه تلجرام التحديثات
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # يُرسل في ترويسة X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))  # خيوط معالجة التحديثات المستلمة
+WEBHOOK_MAX_BODY = int(os.getenv("WEBHOOK_MAX_BODY", str(1024 * 1024)))  # أقصى حجم لطلب التحديث بالبايت
+ALLOWED_UPDATES = ["message", "channel_post", "callback_query"]
+
+# خادم Bot API (الافتراضي خادم تلجرام السحابي، أو خادم telegram-bot-api محلي)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+TELEGRAM_FILE_URL = os.getenv("TELEGRAM_FILE_URL", TELEGRAM_API_URL).rstrip("/")
+# الخادم المحلي المشغل بخيار --local يعيد مسارات ملفات على القرص بدلاً من روابط
+TELEGRAM_LOCAL_MODE = os.getenv("TELEGRAM_LOCAL_MODE", "0") == "1"
+
+apihelper.API_URL = TELEGRAM_API_URL + "/bot{0}/{1}"
+apihelper.FILE_URL = TELEGRAM_FILE_URL + "/file/bot{0}/{1}"
+
 # إنشاء كائن البوت
 bot = telebot.TeleBot(BOT_TOKEN, parse_mode=None)
 
+# جلسة HTTP دائمة لإعادة استخدام اتصالات TLS بين عمليات التحميل
+http_session = requests.Session()
+http_adapter = HTTPAdapter(
+    pool_connections=HTTP_POOL_SIZE,
+    pool_maxsize=HTTP_POOL_SIZE,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=["GET"])
+)
+http_session.mount("https://", http_adapter)
+http_session.mount("http://", http_adapter)
+
+# ==== جدولة الطلبات الصادرة إلى تلجرام ====
+
+# دلو رموز لكل محادثة ودلو عام، والطلبات المنتظرة مرتبة حسب الأولوية ثم الوصول
+# (الأولوية، رقم الوصول، المحادثة، حدث منح الدور)
+outbound_lock = threading.Lock()
+rate_buckets = {}
+global_bucket = {
+    "tokens": RATE_GLOBAL_PER_SECOND,
+    "rate": RATE_GLOBAL_PER_SECOND,
+    "capacity": RATE_GLOBAL_PER_SECOND,
+    "updated": time.monotonic(),
+    "blocked_until": 0.0
+}
+outbound_waiting = []
+outbound_sequence = 0
+outbound_stats = {"sent": 0, "rate_limited": 0, "max_wait": 0.0}
+
+
+def get_rate_bucket(chat_id):
+    """دلو الرموز الخاص بالمحادثة (المعرفات الموجبة محادثات خاصة، وغيرها مجموعات أو قنوات)."""
+    bucket = rate_buckets.get(chat_id)
+    if bucket is None:
+        if isinstance(chat_id, int) and chat_id > 0:
+            rate, capacity = RATE_PRIVATE_PER_SECOND, RATE_PRIVATE_BURST
+        else:
+            rate, capacity = RATE_GROUP_PER_MINUTE / 60, RATE_GROUP_BURST
+        bucket = {
+            "tokens": capacity,
+            "rate": rate,
+            "capacity": capacity,
+            "updated": time.monotonic(),
+            "blocked_until": 0.0
+        }
+        rate_buckets[chat_id] = bucket
+    return bucket
+
+
+def time_until_token(bucket, now):
+    """الوقت المتبقي حتى يتوفر رمز في الدلو (0 إذا كان متوفراً الآن)."""
+    bucket["tokens"] = min(bucket["capacity"], bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"])
+    bucket["updated"] = now
+    wait = max(0.0, bucket["blocked_until"] - now)
+    if bucket["tokens"] < 1:
+        wait = max(wait, (1 - bucket["tokens"]) / bucket["rate"])
+    return wait
+
+
+def dispatch_send_slots(now):
+    """منح الرموز المتاحة للطلبات المنتظرة بترتيب الأولوية (يُستدعى مع outbound_lock).
+
+    الطلب يُمنح دوره إذا توفر رمز لمحادثته، والطلبات التي لم يتوفر رمز لمحادثتها
+    لا تمنع الطلبات الأقل أولوية لمحادثات أخرى.
+    """
+    for waiting in list(outbound_waiting):
+        if time_until_token(global_bucket, now) > 0:
+            break
+        bucket = get_rate_bucket(waiting[2])
+        if time_until_token(bucket, now) == 0:
+            bucket["tokens"] -= 1
+            global_bucket["tokens"] -= 1
+            outbound_waiting.remove(waiting)
+            waiting[3].set()
+
+
+def acquire_send_slot(chat_id, priority):
+    """انتظار دور الطلب: أعلى أولوية بين الطلبات التي يتوفر رمز لمحادثتها، مع توفر رمز عام.
+
+    كل طلب ينام حتى موعد توفر رمز لمحادثته أو للدلو العام، أو حتى يمنحه طلب آخر دوره.
+    """
+    global outbound_sequence
+
+    started = time.monotonic()
+    granted = threading.Event()
+    with outbound_lock:
+        outbound_sequence += 1
+        ticket = (priority, outbound_sequence, chat_id, granted)
+        bisect.insort(outbound_waiting, ticket)
+
+    try:
+        while True:
+            with outbound_lock:
+                now = time.monotonic()
+                dispatch_send_slots(now)
+                if granted.is_set():
+                    break
+                wait = max(time_until_token(get_rate_bucket(chat_id), now), time_until_token(global_bucket, now))
+            granted.wait(max(wait, 0.001))
+    finally:
+        with outbound_lock:
+            if not granted.is_set():
+                outbound_waiting.remove(ticket)
+
+    with outbound_lock:
+        waited = time.monotonic() - started
+        outbound_stats["sent"] += 1
+        outbound_stats["max_wait"] = max(outbound_stats["max_wait"], waited)
+
+        # حذف دلاء المحادثات الخاملة الممتلئة
+        if len(rate_buckets) > 1000:
+            for key, bucket in list(rate_buckets.items()):
+                if bucket["tokens"] >= bucket["capacity"] and key != chat_id:
+                    del rate_buckets[key]
+
+
+def block_rate_bucket(chat_id, retry_after):
+    """إيقاف الإرسال للمحادثة مؤقتاً بعد رد 429 من تلجرام."""
+    with outbound_lock:
+        bucket = get_rate_bucket(chat_id)
+        bucket["blocked_until"] = max(bucket["blocked_until"], time.monotonic() + retry_after)
+        bucket["tokens"] = 0
+        outbound_stats["rate_limited"] += 1
+
+
+def rewind_files(args, kwargs):
+    """إرجاع مؤشر الملفات المرسلة إلى بدايتها قبل إعادة المحاولة."""
+    for value in list(args) + list(kwargs.values()):
+        for item in (value if isinstance(value, list) else [value]):
+            source = getattr(item, "media", item)
+            if hasattr(source, "seek"):
+                source.seek(0)
+
+
+def send_telegram(chat_id, priority, method, /, *args, **kwargs):
+    """تنفيذ طلب إلى تلجرام ضمن حدود الإرسال، مع إعادة المحاولة بعد المدة التي يحددها خطأ 429."""
+    for attempt in range(OUTBOUND_MAX_RETRIES + 1):
+        acquire_send_slot(chat_id, priority)
+        try:
+            return method(*args, **kwargs)
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code != 429 or attempt == OUTBOUND_MAX_RETRIES:
+                raise
+            retry_after = e.result_json.get("parameters", {}).get("retry_after", 1)
+            logger.warning(f"تجاوز حد الإرسال للمحادثة {chat_id}، إعادة المحاولة بعد {retry_after} ثانية")
+            block_rate_bucket(chat_id, retry_after)
+            rewind_files(args, kwargs)
+
+
+def chat_is_throttled(chat_id):
+    """هل سيضطر طلب جديد لهذه المحادثة إلى الانتظار الآن؟"""
+    with outbound_lock:
+        now = time.monotonic()
+        return (
+            time_until_token(get_rate_bucket(chat_id), now) > 0
+            or time_until_token(global_bucket, now) > 0
+            or any(waiting[2] == chat_id for waiting in outbound_waiting)
+        )
+
+
+def get_outbound_stats():
+    with outbound_lock:
+        return dict(outbound_stats, waiting=len(outbound_waiting))
+
 # وظائف معالجة الملفات والنصوص
 
-def download_file(file_path):
-    """تحميل ملف من خادم تلجرام."""
+def stream_to_file(url, destination, progress=None):
+    """تحميل رابط إلى ملف على القرص على شكل أجزاء دون تحميل المحتوى كاملاً في الذاكرة.
+
+    progress(المحمل، الحجم الكلي) تُستدعى بعد كل جزء إذا عُرف حجم الملف.
+    """
+    written = 0
     try:
-        file_info = bot.get_file(file_path)
-        file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file_info.file_path}"
+        with http_session.get(
+            url,
+            stream=True,
+            timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT)
+        ) as response:
+            response.raise_for_status()
+            total = int(response.headers.get("Content-Length", 0) or 0)
+            with open(destination, 'wb') as file:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if chunk:
+                        file.write(chunk)
+                        written += len(chunk)
+                        if progress and total:
+                            progress(written, total)
+    except Exception:
+        # حذف الملف الجزئي حتى لا يبقى على القرص
+        if os.path.exists(destination):
+            os.remove(destination)
+        raise
+
+    return written
+
+
+def get_file_url(file_path):
+    """رابط تحميل ملف من خادم ملفات تلجرام."""
+    return apihelper.FILE_URL.format(BOT_TOKEN, file_path)
+
+
+def get_local_file_path(file_path):
+    """مسار الملف على القرص إذا كان خادم Bot API المحلي يعمل بخيار --local، وإلا None.
+
+    المسار المطلق غير الموجود يعني أن مجلد بيانات الخادم غير مشترك مع هذه الحاوية،
+    ولا يمكن تحميله عبر HTTP لأن الخادم بخيار --local لا يقدم الملفات، فيُرفع خطأ إعداد واضح.
+    """
+    if not TELEGRAM_LOCAL_MODE or not os.path.isabs(file_path):
+        return None
+
+    if not os.path.isfile(file_path):
+        message = (f"الملف {file_path} غير موجود على القرص: مجلد بيانات خادم Bot API المحلي "
+                   f"(--dir) يجب أن يكون مشتركاً مع البوت بنفس المسار عند تفعيل TELEGRAM_LOCAL_MODE")
+        logger.error(message)
+        raise FileNotFoundError(message)
+    return file_path
+
+
+def fetch_telegram_file(file_path, destination, progress=None):
+    """نسخ ملف تلجرام إلى destination من القرص مباشرة (الخادم المحلي) أو عبر HTTP.
+
+    الملف يُنسخ ولا يُربط لأن الوسوم تُعدل في مكانها، فالربط سيعدل نسخة الخادم نفسها.
+    shutil.copyfile تستخدم النسخ داخل النواة (sendfile) دون المرور بذاكرة البرنامج.
+    """
+    local_path = get_local_file_path(file_path)
+    if local_path is None:
+        return stream_to_file(get_file_url(file_path), destination, progress)
+
+    shutil.copyfile(local_path, destination)
+    size = os.path.getsize(destination)
+    if progress and size:
+        progress(size, size)
+    return size
+
+
+def fetch_range(url, byte_range):
+    """تحميل جزء من الملف بطلب HTTP Range (مثل "0-65535" أو "-128").
+
+    يعيد None إذا تجاهل الخادم الطلب وأرسل الملف كاملاً (رد 200 بدلاً من 206).
+    """
+    with http_session.get(
+        url,
+        headers={"Range": f"bytes={byte_range}"},
+        stream=True,
+        timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT)
+    ) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            return None
+        return response.content
+
+
+def probe_audio_tags(file_info, group=None):
+    """قراءة وسوم ID3v2 و ID3v1 لملف MP3 دون تحميله كاملاً.
+
+    file_info هو ناتج bot.get_file ويُمرر من المستدعي ليُعاد استخدامه في التحميل دون طلب getFile ثانٍ.
+    يعيد (الوسوم، مسار الملف): الوسوم None إذا لم يكن الملف MP3، ومسار الملف موجود فقط
+    إذا لم يدعم الخادم طلبات Range فتم تحميل الملف كاملاً (ويجب حذفه بـ cleanup_download).
+    """
+    # الخادم المحلي: قراءة الوسوم من الملف على القرص مباشرة
+    local_path = get_local_file_path(file_info.file_path)
+    if local_path:
+        if detect_audio_format(local_path) != "mp3":
+            return None, None
+        try:
+            return ID3(local_path), None
+        except mutagen.id3.ID3NoHeaderError:
+            return ID3(), None
+
+    url = get_file_url(file_info.file_path)
+    head = fetch_range(url, f"0-{TAG_PROBE_BYTES - 1}")
+    if head is None:
+        # الخادم لا يدعم Range: تحميل الملف كاملاً وقراءة وسومه منه
+        file_path = download_file(file_info, group=group)
+        if not file_path or detect_audio_format(file_path) != "mp3":
+            return None, file_path
+        try:
+            return ID3(file_path), file_path
+        except mutagen.id3.ID3NoHeaderError:
+            return ID3(), file_path
+
+    tag_size = id3_tag_size(head)
+    if not tag_size:
+        # ملف MP3 بدون وسوم ID3v2، أو صيغة أخرى (منها ADTS AAC) لا تُفحص بهذه الطريقة
+        if not is_mpeg_frame(head):
+            return None, None
+        tags = ID3()
+    else:
+        # تحميل بقية الوسم إذا كان أكبر من الجزء الأول، مع بداية الصوت الذي يليه
+        probe_end = tag_size + ID3_FORMAT_PROBE_BYTES
+        if probe_end > len(head):
+            head += fetch_range(url, f"{len(head)}-{probe_end - 1}") or b""
+
+        # وسم ID3 قد يسبق ملف FLAC أو ADTS: تُقرأ الوسوم فقط إذا تلاه إطار MPEG
+        if detect_format_after_id3(head[tag_size:probe_end]) != "mp3":
+            return None, None
+        tags = ID3()
+        tags.load(io.BytesIO(head[:tag_size]), load_v1=False)
+
+    # وسم ID3v1 في آخر 128 بايت يُستخدم فقط للإطارات غير الموجودة في ID3v2
+    tail = fetch_range(url, "-128")
+    v1_frames = ParseID3v1(tail) if tail and len(tail) == 128 else None
+    for frame in (v1_frames or {}).values():
+        if frame.HashKey not in tags:
+            tags.add(frame)
+
+    return tags, None
+
+
+# ==== إدارة مجلد العمل المؤقت ====
+
+# المساحة المحجوزة لكل مجلد مهمة، ويُحسب الحد الأقصى على مجموعها
+spool_lock = threading.Condition()
+spool_reservations = {}
+# الألبوم الذي ينتمي إليه كل مجلد مهمة (ملفات الألبوم تبقى محجوزة حتى نشره كاملاً)
+spool_groups = {}
+spool_stats = {"waiting": 0, "reaped": 0, "reaped_bytes": 0}
+spool_reaper_thread = None
+SPOOL_REAPER_STOP = threading.Event()
+
+
+def get_spool_root():
+    """مجلد العمل الخاص بهذه النسخة، حتى لا تحذف نسخة أخرى تشارك SPOOL_DIR ملفات مهامها."""
+    return os.path.join(SPOOL_DIR, re.sub(r"[^\w.-]", "_", WORKER_ID))
+
+
+def get_other_reservations(group):
+    """المساحة المحجوزة لغير ملفات الألبوم group (يُستدعى مع spool_lock)."""
+    return [
+        needed for job_dir, needed in spool_reservations.items()
+        if group is None or spool_groups.get(job_dir) != group
+    ]
+
+
+def create_spool_dir(size, group=None):
+    """حجز مساحة لملف بالحجم المعطى وإنشاء مجلد عمل له.
+
+    تنتظر المهمة إذا كان الحجز سيتجاوز SPOOL_QUOTA_BYTES، إلا إذا كان المجلد فارغاً
+    (حتى لا يتوقف ملف أكبر من الحد للأبد). حجوزات ملفات نفس الألبوم (group) لا تُحسب،
+    لأنها لا تُحرر إلا بعد نشر الألبوم كاملاً فتنتظرها بقية ملفاته للأبد.
+    يعيد مسار المجلد، أو يرفع TimeoutError.
+    """
+    # هامش للوسوم والمساحة الفارغة وصورة الألبوم التي تُضاف أثناء المعالجة
+    needed = size + TAG_PADDING_BYTES + ALBUM_COVER_MAX_BYTES
+    deadline = time.monotonic() + SPOOL_WAIT_TIMEOUT
+
+    with spool_lock:
+        spool_stats["waiting"] += 1
+        try:
+            while True:
+                others = get_other_reservations(group)
+                if not others or sum(others) + needed <= SPOOL_QUOTA_BYTES:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("لا توجد مساحة كافية في مجلد العمل")
+                spool_lock.wait(remaining)
+        finally:
+            spool_stats["waiting"] -= 1
+
+        # توزيع مجلدات المهام على مجلدات فرعية حتى لا يكبر مجلد واحد
+        shard_dir = os.path.join(get_spool_root(), f"{int.from_bytes(os.urandom(1), 'big') % SPOOL_SHARDS:02x}")
+        os.makedirs(shard_dir, exist_ok=True)
+        job_dir = tempfile.mkdtemp(prefix=DOWNLOAD_DIR_PREFIX, dir=shard_dir)
+        spool_reservations[job_dir] = needed
+        if group is not None:
+            spool_groups[job_dir] = group
+        return job_dir
+
+
+def release_spool_dir(job_dir):
+    """حذف مجلد العمل وإلغاء حجز مساحته."""
+    shutil.rmtree(job_dir, ignore_errors=True)
+    with spool_lock:
+        spool_groups.pop(job_dir, None)
+        if spool_reservations.pop(job_dir, None) is not None:
+            spool_lock.notify_all()
+
+
+def reap_spool(max_age):
+    """حذف مجلدات المهام المتروكة وصور الألبوم القديمة التي مضى عليها أكثر من max_age ثانية."""
+    cutoff = time.time() - max_age
+    with spool_lock:
+        active = set(spool_reservations)
+
+    candidates = []
+    spool_root = get_spool_root()
+    if os.path.isdir(spool_root):
+        for shard in os.scandir(spool_root):
+            if shard.is_dir():
+                candidates.extend(entry.path for entry in os.scandir(shard.path) if entry.path not in active)
+
+    # صور الألبوم السابقة التي لم تعد مستخدمة
+    if os.path.isdir(ALBUM_COVERS_DIR):
+        current_cover = os.path.abspath(album_cover_path) if album_cover_path else None
+        candidates.extend(
+            entry.path for entry in os.scandir(ALBUM_COVERS_DIR)
+            if os.path.abspath(entry.path) != current_cover
+        )
+
+    for path in candidates:
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+            if os.path.isdir(path):
+                size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                size = os.path.getsize(path)
+                os.remove(path)
+            with spool_lock:
+                spool_stats["reaped"] += 1
+                spool_stats["reaped_bytes"] += size
+            logger.info(f"تم حذف ملف متروك: {path}")
+        except Exception as e:
+            logger.error(f"خطأ في حذف الملف المتروك {path}: {e}")
+
+
+def spool_reaper():
+    """تنظيف مجلد العمل دورياً حتى يستلم إشارة الإيقاف."""
+    while not SPOOL_REAPER_STOP.wait(SPOOL_REAP_INTERVAL):
+        reap_spool(SPOOL_STALE_MINUTES * 60)
+
+
+def start_spool_reaper():
+    """حذف بقايا التشغيل السابق ثم تشغيل خيط التنظيف الدوري."""
+    global spool_reaper_thread
+
+    # لا توجد مهام قيد التنفيذ لهذه النسخة عند بدء التشغيل، فكل ما في مجلدها متروك
+    os.makedirs(get_spool_root(), exist_ok=True)
+    reap_spool(0)
+
+    spool_reaper_thread = threading.Thread(target=spool_reaper, name="spool-reaper", daemon=True)
+    spool_reaper_thread.start()
 
-        # إنشاء دليل مؤقت لتخزين الملف المحمّل
-        with tempfile.TemporaryDirectory() as temp_dir:
-            local_file_path = os.path.join(temp_dir, "audio_file.mp3")
 
-            # تحميل الملف من خادم تلجرام
-            response = requests.get(file_url)
-            with open(local_file_path, 'wb') as file:
-                file.write(response.content)
+def get_spool_stats():
+    with spool_lock:
+        return dict(
+            spool_stats,
+            reserved=sum(spool_reservations.values()),
+            jobs=len(spool_reservations),
+            quota=SPOOL_QUOTA_BYTES
+        )
+
+
+def download_file(file_info, progress=None, group=None):
+    """تحميل ملف من خادم تلجرام (file_info ناتج bot.get_file) إلى مجلد عمل خاص بالمهمة داخل SPOOL_DIR.
+
+    المجلد يبقى موجوداً حتى يتم استدعاء cleanup_download بعد انتهاء المهمة.
+    group هو الألبوم الذي ينتمي إليه الملف، ويُمرر إلى create_spool_dir.
+    """
+    job_dir = None
+    try:
+        # حجز مساحة الملف وإنشاء مجلد عمل نملكه ونتحكم في حذفه، مع الاحتفاظ بامتداد الملف الأصلي
+        job_dir = create_spool_dir(file_info.file_size or 0, group)
+        extension = os.path.splitext(file_info.file_path or "")[1] or ".mp3"
+        local_file_path = os.path.join(job_dir, f"audio_file{extension}")
+
+        # تحميل الملف من خادم تلجرام على شكل أجزاء (أو نسخه من القرص مع الخادم المحلي)
+        size = fetch_telegram_file(file_info.file_path, local_file_path, progress)
 
-            logger.info(f"تم تحميل الملف: {local_file_path}")
-            return local_file_path
+        logger.info(f"تم تحميل الملف: {local_file_path} ({size} بايت)")
+        return local_file_path
     except Exception as e:
         logger.error(f"خطأ في تحميل الملف: {e}")
+        if job_dir:
+            release_spool_dir(job_dir)
         return None
 
 
+def cleanup_download(file_path):
+    """حذف مجلد العمل الخاص بملف تم تحميله بواسطة download_file."""
+    if not file_path:
+        return
+
+    job_dir = os.path.dirname(file_path)
+    if os.path.basename(job_dir).startswith(DOWNLOAD_DIR_PREFIX):
+        release_spool_dir(job_dir)
+    elif os.path.exists(file_path):
+        os.remove(file_path)
+
+
+# محركات الاستبدال المترجمة لكل وسم (تُبنى عند أول استخدام وتُحذف عند تعديل القواعد)
+replacement_matchers = {}
+replacement_matchers_lock = threading.Lock()
+
+
+def _strings_overlap(first, second):
+    """هل يمكن أن يتداخل النصان (احتواء أو تطابق بداية أحدهما مع نهاية الآخر)؟"""
+    if not first or not second:
+        return False
+    if second[0] not in first and first[0] not in second:
+        return False
+    if first in second or second in first:
+        return True
+    for size in range(1, min(len(first), len(second))):
+        if first.endswith(second[:size]) or second.endswith(first[:size]):
+            return True
+    return False
+
+
+def _rules_interact(earlier, later):
+    """هل يمكن أن تؤثر القاعدة السابقة على نتيجة القاعدة اللاحقة عند التطبيق المتتابع؟"""
+    if _strings_overlap(earlier["original"], later["original"]):
+        return True
+    return _strings_overlap(earlier["replacement"], later["original"])
+
+
+def _build_trie_pattern(words):
+    """بناء تعبير نمطي على شكل شجرة بادئات يطابق أي كلمة من الكلمات في مرور واحد."""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def node_pattern(node):
+        branches = [re.escape(char) + node_pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            body = "(?:" + body + ")?"
+        return body
+
+    return re.compile(node_pattern(trie))
+
+
+def _compile_replacement_stage(rules):
+    """ترجمة مجموعة قواعد مستقلة عن بعضها إلى دالة تستبدلها جميعاً في مرور واحد."""
+    if len(rules) == 1:
+        original, replacement = rules[0]["original"], rules[0]["replacement"]
+        return lambda text: text.replace(original, replacement)
+
+    ordered = [(rule["original"], rule["replacement"]) for rule in rules]
+    mapping = dict(ordered)
+    pattern = _build_trie_pattern(mapping)
+
+    # الحذف يجمع النص المحيط وقد يكوّن نصاً أصلياً لقاعدة لاحقة في نفس المرحلة
+    verify_deletions = any(not replacement for _, replacement in ordered[:-1])
+
+    def run_stage(text):
+        deleted = []
+
+        def substitute(match):
+            replacement = mapping[match.group(0)]
+            if not replacement:
+                deleted.append(match)
+            return replacement
+
+        result = pattern.sub(substitute, text)
+        if deleted and verify_deletions:
+            # إعادة التطبيق بالترتيب للحصول على النتيجة نفسها تماماً
+            result = text
+            for original, replacement in ordered:
+                result = result.replace(original, replacement)
+        return result
+
+    return run_stage
+
+
+def compile_replacement_matcher(tag_key):
+    """ترجمة قواعد الاستبدال الخاصة بوسم معين إلى سلسلة مراحل بنفس ترتيب القواعد.
+
+    القواعد المتتالية التي لا يمكن أن تتداخل تُجمع في مرحلة واحدة تُطبق في مرور واحد،
+    وتبدأ مرحلة جديدة فقط عندما يمكن لقاعدة أن تتأثر بنتيجة قاعدة سابقة، لذلك تبقى
+    النتيجة مطابقة لتطبيق str.replace لكل قاعدة بالترتيب.
+    """
+    stages = []
+    current = []
+
+    for rule in list(replacements.values()):
+        if tag_key not in rule["tags"] or rule.get("regex"):
+            continue
+        if not rule["original"]:
+            # قاعدة بنص أصلي فارغ تُطبق وحدها كما كانت
+            if current:
+                stages.append(current)
+            stages.append([rule])
+            current = []
+            continue
+        if any(_rules_interact(earlier, rule) for earlier in current):
+            stages.append(current)
+            current = []
+        current.append(rule)
+
+    if current:
+        stages.append(current)
+
+    return tuple(_compile_replacement_stage(stage) for stage in stages)
+
+
+def get_replacement_matcher(tag_key):
+    """إرجاع محرك الاستبدال المترجم للوسم، وبناؤه إذا لم يكن موجوداً."""
+    matcher = replacement_matchers.get(tag_key)
+    if matcher is None:
+        with replacement_matchers_lock:
+            matcher = replacement_matchers.get(tag_key)
+            if matcher is None:
+                matcher = compile_replacement_matcher(tag_key)
+                replacement_matchers[tag_key] = matcher
+    return matcher
+
+
+def invalidate_replacement_matchers(tags=None):
+    """حذف المحركات المترجمة للوسوم المتأثرة بتعديل القواعد (أو جميعها إذا لم تُحدد)."""
+    with replacement_matchers_lock:
+        if tags is None:
+            replacement_matchers.clear()
+        else:
+            for tag_key in tags:
+                replacement_matchers.pop(tag_key, None)
+    invalidate_text_pipelines(tags)
+
+
 def apply_replacements(text, tag_key):
     """تطبيق قواعد الاستبدال على نص معين."""
     if not config["replacement_enabled"]:
         return text
 
     result = text
-    for rule_id, rule in replacements.items():
-        if tag_key in rule["tags"]:
-            result = result.replace(rule["original"], rule["replacement"])
+    for stage in get_replacement_matcher(tag_key):
+        result = stage(result)
 
     return result
 
@@ -327,368 +1282,740 @@ def apply_footer(text, tag_key):
     return result
 
 
+# قواعد حذف الروابط: (النمط، النصوص التي لا يمكن أن يطابق النمط بدون وجود أحدها)
+# الترتيب مهم: عند تطابق أكثر من قاعدة في نفس الموضع تُستخدم القاعدة الأولى
+LINK_EMOJI = "[\U0001F000-\U0001FAFF\u2600-\u27BF\uFE0F]"
+LINK_RULES = [
+    (r'https?://\S+', ("http",)),  # روابط http:// و https://
+    (r'www\.\S+', ("www.",)),  # روابط www.
+    (r'(?:t|telegram)\.me/\S+', ("t.me/", "telegram.me/")),  # روابط تلجرام بدون بروتوكول
+    (LINK_EMOJI + r'*@\w+' + LINK_EMOJI + '*', ("@",)),  # معرفات تلجرام (@username) مع الرموز التعبيرية المحيطة بها
+]
+
+
+def compile_link_rules():
+    """دمج قواعد حذف الروابط في نمط واحد مع قائمة النصوص اللازمة للفحص السريع."""
+    global link_pattern, link_triggers
+    link_pattern = re.compile("|".join(f"(?:{pattern})" for pattern, _ in LINK_RULES))
+    link_triggers = tuple(sorted({trigger for _, triggers in LINK_RULES for trigger in triggers}))
+
+
+def add_link_rule(pattern, triggers):
+    """إضافة قاعدة جديدة لحذف الروابط دون إضافة مرور إضافي على النص."""
+    LINK_RULES.append((pattern, tuple(triggers)))
+    compile_link_rules()
+
+
+compile_link_rules()
+
+# حذف النطاقات المجردة (example.com) اختياري لأنه قد يحذف نصاً عادياً مثل "radio.tv"
+BARE_DOMAIN_RULE = (
+    r'\b[\w-]+\.(?:com|net|org|io|info|me|tv)\b(?:/\S*)?',
+    (".com", ".net", ".org", ".io", ".info", ".me", ".tv")
+)
+if REMOVE_BARE_DOMAINS:
+    add_link_rule(*BARE_DOMAIN_RULE)
+
+
 def remove_links(text):
     """حذف الروابط والمعرفات من النص."""
     if not config["remove_links_enabled"]:
         return text
+    return strip_links(text)
 
-    # حذف الروابط (http:// و https:// و www.)
-    result = re.sub(r'https?://\S+', '', text)
-    result = re.sub(r'www\.\S+', '', result)
 
-    # حذف معرفات تلجرام (@username)
-    result = re.sub(r'@\w+', '', result)
+def strip_links(text):
+    """حذف الروابط والمعرفات دون التحقق من إعداد التفعيل (تُستخدم في سلسلة المعالجة)."""
+    # فحص سريع: معظم النصوص لا تحتوي على أي رابط أو معرف
+    for trigger in link_triggers:
+        if trigger in text:
+            break
+    else:
+        return text
 
-    return result
+    # حذف جميع الروابط والمعرفات في مرور واحد
+    return link_pattern.sub('', text)
 
 
-def process_audio_tags(file_path, title=None):
-    """معالجة الملف الصوتي بتعديل وسوم ID3 وفقاً للقالب."""
-    # فحص ما إذا كان البوت مفعل بالكامل
-    if not config["bot_enabled"]:
-        # إذا كان البوت معطلاً، إرجاع True دون تنفيذ أي تعديلات
-        logger.info("البوت معطّل، لن يتم إجراء تعديلات على وسوم ID3")
-        return True
+# ==== سلسلة معالجة نصوص الوسوم ====
 
-    try:
-        # محاولة تحميل وسوم ID3 الموجودة أو إنشاء وسوم جديدة
-        try:
-            audio = ID3(file_path)
-        except:
-            # الملف لا يحتوي على وسم ID3، قم بإنشاء واحد
-            audio = ID3()
-
-        # تعيين العنوان من وصف الرسالة أو استخدام اسم الملف
-        if title:
-            # تطبيق الوظائف المختلفة على النص
-            title_text = title
-            title_text = remove_links(title_text)  # حذف الروابط
-            title_text = apply_replacements(title_text, "title")  # تطبيق الاستبدالات
-            title_text = apply_footer(title_text, "title")  # إضافة التذييل
-
-            audio.add(mutagen.id3.TIT2(encoding=3, text=title_text))
-        else:
-            # استخدم اسم الملف بدون الامتداد كعنوان
-            filename = "audio_file.mp3"
-            title_text = filename
-            title_text = remove_links(title_text)
-            title_text = apply_replacements(title_text, "title")
-            title_text = apply_footer(title_text, "title")
+# التشكيل وعلامات المصحف والتطويل (تُحذف عند تفعيل normalize_arabic_enabled)
+ARABIC_MARKS = dict.fromkeys(
+    [*range(0x0610, 0x061B), *range(0x064B, 0x0660), 0x0670, 0x0640,
+     *range(0x06D6, 0x06DD), *range(0x06DF, 0x06E9), *range(0x06EA, 0x06EE)]
+)
+EXTRA_SPACES_PATTERN = re.compile(r'[^\S\n]+')
 
-            audio.add(mutagen.id3.TIT2(encoding=3, text=title_text))
+# خيارات التنظيف التي يمكن تبديلها من لوحة حذف الروابط
+TEXT_CLEANING_OPTIONS = {
+    "normalize_arabic_enabled": "حذف التشكيل والتطويل",
+    "trim_whitespace_enabled": "تنظيف المسافات الزائدة",
+}
 
-        # جلب القالب الحالي
-        current_template = templates[current_template_key]
+# الوسوم التي لا يتم قص قيمتها (الروابط والكلمات)
+TRUNCATE_EXEMPT_TAGS = ("website", "lyrics")
 
-        # تحقق ما إذا كان يجب تطبيق القالب على الوسم أو الاحتفاظ بالقيمة الأصلية
-        # نقرأ القيم الأصلية للوسوم إذا كانت موجودة
-        # الحصول على الوسوم الأصلية بأمان
-        try:
-            original_artist = str(audio["TPE1"].text[0]) if "TPE1" in audio else ""
-        except (KeyError, IndexError, AttributeError):
-            original_artist = ""
+# سلاسل المعالجة المترجمة لكل وسم (تُبنى عند أول استخدام وتُحذف عند تعديل الإعدادات)
+text_pipelines = {}
+text_pipelines_lock = threading.Lock()
 
-        try:
-            original_album_artist = str(audio["TPE2"].text[0]) if "TPE2" in audio else ""
-        except (KeyError, IndexError, AttributeError):
-            original_album_artist = ""
 
-        try:
-            original_album = str(audio["TALB"].text[0]) if "TALB" in audio else ""
-        except (KeyError, IndexError, AttributeError):
-            original_album = ""
+def build_links_stage(tag_key):
+    return strip_links if config["remove_links_enabled"] else None
 
-        try:
-            original_genre = str(audio["TCON"].text[0]) if "TCON" in audio else ""
-        except (KeyError, IndexError, AttributeError):
-            original_genre = ""
 
-        try:
-            original_year = str(audio["TYER"].text[0]) if "TYER" in audio else ""
-        except (KeyError, IndexError, AttributeError):
-            original_year = ""
+def build_replace_stage(tag_key):
+    if not config["replacement_enabled"]:
+        return None
+    stages = get_replacement_matcher(tag_key)
+    if not stages:
+        return None
+    if len(stages) == 1:
+        return stages[0]
 
-        try:
-            original_publisher = str(audio["TPUB"].text[0]) if "TPUB" in audio else ""
-        except (KeyError, IndexError, AttributeError):
-            original_publisher = ""
+    def replace(text):
+        for stage in stages:
+            text = stage(text)
+        return text
+    return replace
 
-        try:
-            original_copyright = str(audio["TCOP"].text[0]) if "TCOP" in audio else ""
-        except (KeyError, IndexError, AttributeError):
-            original_copyright = ""
 
-        # الحصول على التعليق
-        original_comment = ""
-        try:
-            comments = audio.getall("COMM")
-            if comments and len(comments) > 0:
-                for comm in comments:
-                    if hasattr(comm, 'text') and comm.text:
-                        original_comment = str(comm.text[0])
-                        break
-        except (KeyError, IndexError, AttributeError):
-            original_comment = ""
-
-        # الحصول على الملحن
-        try:
-            original_composer = str(audio["TCOM"].text[0]) if "TCOM" in audio else ""
-        except (KeyError, IndexError, AttributeError):
-            original_composer = ""
+def build_regex_replace_stage(tag_key):
+    if not config["replacement_enabled"]:
+        return None
 
-        # الحصول على كلمات الأغنية
-        original_lyrics = ""
-        try:
-            lyrics_frames = audio.getall("USLT")
-            if lyrics_frames and len(lyrics_frames) > 0:
-                for uslt in lyrics_frames:
-                    if hasattr(uslt, 'text') and uslt.text:
-                        original_lyrics = str(uslt.text)
-                        break
-        except (KeyError, IndexError, AttributeError):
-            original_lyrics = ""
-
-        # الحصول على الوصف
-        try:
-            original_description = str(audio["TIT3"].text[0]) if "TIT3" in audio else ""
-        except (KeyError, IndexError, AttributeError):
-            original_description = ""
-
-        # تطبيق وسوم قالب ID3 مع الوظائف المطلوبة
-        # --- الفنان ---
-        if current_template["artist"].strip() == "" or current_template["artist"].strip() == "$artist":
-            # الاحتفاظ بالقيمة الأصلية إذا كان القالب فارغًا أو يحتوي على علامة خاصة
-            artist_text = original_artist
-        else:
-            artist_text = current_template["artist"]
-            artist_text = remove_links(artist_text)
-            artist_text = apply_replacements(artist_text, "artist")
-            artist_text = apply_footer(artist_text, "artist")
-
-        # --- فنان الألبوم ---
-        if current_template["album_artist"].strip() == "" or current_template["album_artist"].strip() == "$album_artist":
-            album_artist_text = original_album_artist
-        else:
-            album_artist_text = current_template["album_artist"]
-            album_artist_text = remove_links(album_artist_text)
-            album_artist_text = apply_replacements(album_artist_text, "album_artist")
-            album_artist_text = apply_footer(album_artist_text, "album_artist")
-
-        # --- الألبوم ---
-        if current_template["album"].strip() == "" or current_template["album"].strip() == "$album":
-            album_text = original_album
-        else:
-            album_text = current_template["album"]
-            album_text = remove_links(album_text)
-            album_text = apply_replacements(album_text, "album")
-            album_text = apply_footer(album_text, "album")
-
-        # --- النوع ---
-        if current_template["genre"].strip() == "" or current_template["genre"].strip() == "$genre":
-            genre_text = original_genre
-        else:
-            genre_text = current_template["genre"]
-            genre_text = remove_links(genre_text)
-            genre_text = apply_replacements(genre_text, "genre")
-            genre_text = apply_footer(genre_text, "genre")
-
-        # --- السنة ---
-        if current_template["year"].strip() == "" or current_template["year"].strip() == "$year":
-            year_text = original_year
-        else:
-            year_text = current_template["year"]
-            year_text = remove_links(year_text)
-            year_text = apply_replacements(year_text, "year")
-            year_text = apply_footer(year_text, "year")
-
-        # --- الناشر ---
-        if current_template["publisher"].strip() == "" or current_template["publisher"].strip() == "$publisher":
-            publisher_text = original_publisher
-        else:
-            publisher_text = current_template["publisher"]
-            publisher_text = remove_links(publisher_text)
-            publisher_text = apply_replacements(publisher_text, "publisher")
-            publisher_text = apply_footer(publisher_text, "publisher")
-
-        # --- حقوق النشر ---
-        if current_template["copyright"].strip() == "" or current_template["copyright"].strip() == "$copyright":
-            copyright_text = original_copyright
-        else:
-            copyright_text = current_template["copyright"]
-            copyright_text = remove_links(copyright_text)
-            copyright_text = apply_replacements(copyright_text, "copyright")
-            copyright_text = apply_footer(copyright_text, "copyright")
-
-        # --- الوسوم الجديدة ---
-        # --- التعليق ---
-        if "comment" in current_template:
-            if current_template["comment"].strip() == "" or current_template["comment"].strip() == "$comment":
-                # الاحتفاظ بالقيمة الأصلية
-                if original_comment:
-                    audio.add(mutagen.id3.COMM(encoding=3, lang='ara', desc='', text=original_comment))
-            else:
-                comment_text = current_template["comment"]
-                comment_text = remove_links(comment_text)
-                comment_text = apply_replacements(comment_text, "comment")
-                comment_text = apply_footer(comment_text, "comment")
-                audio.add(mutagen.id3.COMM(encoding=3, lang='ara', desc='', text=comment_text))
-
-        # --- رابط الموقع ---
-        if "website" in current_template:
-            if current_template["website"].strip() == "" or current_template["website"].strip() == "$website":
-                # نحتفظ بالروابط الأصلية إذا وجدت
-                for woar in audio.getall("WOAR"):
-                    audio.add(woar)  # نترك الرابط الأصلي
-            else:
-                website_text = current_template["website"]
-                website_text = remove_links(website_text)
-                website_text = apply_replacements(website_text, "website")
-                website_text = apply_footer(website_text, "website")
-                audio.add(mutagen.id3.WOAR(url=website_text))
-
-        # --- الملحن ---
-        if "composer" in current_template:
-            if current_template["composer"].strip() == "" or current_template["composer"].strip() == "$composer":
-                # الاحتفاظ بالقيمة الأصلية
-                if original_composer:
-                    audio.add(mutagen.id3.TCOM(encoding=3, text=original_composer))
-            else:
-                composer_text = current_template["composer"]
-                composer_text = remove_links(composer_text)
-                composer_text = apply_replacements(composer_text, "composer")
-                composer_text = apply_footer(composer_text, "composer")
-                audio.add(mutagen.id3.TCOM(encoding=3, text=composer_text))
-
-        # --- كلمات الأغنية ---
-        if "lyrics" in current_template:
-            if current_template["lyrics"].strip() == "" or current_template["lyrics"].strip() == "$lyrics":
-                # الاحتفاظ بالقيمة الأصلية
-                if original_lyrics:
-                    audio.add(mutagen.id3.USLT(encoding=3, lang='ara', desc='', text=original_lyrics))
-            else:
-                lyrics_text = current_template["lyrics"]
-                lyrics_text = remove_links(lyrics_text)
-                lyrics_text = apply_replacements(lyrics_text, "lyrics")
-                lyrics_text = apply_footer(lyrics_text, "lyrics")
-                audio.add(mutagen.id3.USLT(encoding=3, lang='ara', desc='', text=lyrics_text))
-
-        # --- الوصف ---
-        if "description" in current_template:
-            if current_template["description"].strip() == "" or current_template["description"].strip() == "$description":
-                # الاحتفاظ بالقيمة الأصلية
-                if original_description:
-                    audio.add(mutagen.id3.TIT3(encoding=3, text=original_description))
-            else:
-                description_text = current_template["description"]
-                description_text = remove_links(description_text)
-                description_text = apply_replacements(description_text, "description")
-                description_text = apply_footer(description_text, "description")
-                audio.add(mutagen.id3.TIT3(encoding=3, text=description_text))
-
-        # إضافة الوسوم إلى الملف
-        audio.add(mutagen.id3.TPE1(encoding=3, text=artist_text))
-        audio.add(mutagen.id3.TPE2(encoding=3, text=album_artist_text))
-        audio.add(mutagen.id3.TALB(encoding=3, text=album_text))
-        audio.add(mutagen.id3.TCON(encoding=3, text=genre_text))
-        audio.add(mutagen.id3.TYER(encoding=3, text=year_text))
-        audio.add(mutagen.id3.TPUB(encoding=3, text=publisher_text))
-        audio.add(mutagen.id3.TCOP(encoding=3, text=copyright_text))
-
-        # إضافة صورة الألبوم إذا كانت متاحة وتم تفعيل الميزة
-        if config["album_cover_enabled"] and album_cover_path:
+    rules = []
+    for rule in list(replacements.values()):
+        if tag_key in rule["tags"] and rule.get("regex"):
+            # قاعدة غير صالحة (النمط أو مراجع المجموعات في النص البديل) تُتجاهل وحدها دون بقية القواعد
             try:
-                with open(album_cover_path, 'rb') as cover_file:
-                    cover_data = cover_file.read()
-                    # حذف أي صور موجودة أولاً
-                    for key in list(audio.keys()):
-                        if key.startswith('APIC'):
-                            audio.delall(key)
-                    # إضافة الصورة الجديدة
-                    audio.add(mutagen.id3.APIC(
-                        encoding=3,
-                        mime='image/jpeg',
-                        type=3,  # نوع 3 هو "Cover (front)"
-                        desc='Cover',
-                        data=cover_data
-                    ))
-                    logger.info("تم إضافة صورة الألبوم بنجاح")
-            except Exception as cover_error:
-                logger.error(f"خطأ في إضافة صورة الألبوم: {cover_error}")
-
-        # حفظ التغييرات
-        audio.save(file_path)
-        logger.info(f"تم تعديل وسوم ID3 بنجاح للملف {file_path}")
-        return True
-    except Exception as e:
-        logger.error(f"خطأ في معالجة وسوم الملف الصوتي: {e}")
-        return False
+                pattern = re.compile(rule["original"])
+                pattern.sub(rule["replacement"], "")
+                rules.append((pattern, rule["replacement"]))
+            except (re.error, IndexError) as e:
+                logger.error(f"تعبير نمطي غير صالح في قاعدة الاستبدال {rule['name']}: {e}")
+    if not rules:
+        return None
 
-# وظائف إنشاء لوحات المفاتيح
+    def regex_replace(text):
+        for pattern, replacement in rules:
+            text = pattern.sub(replacement, text)
+        return text
+    return regex_replace
 
-def create_control_panel_keyboard():
-    """إنشاء لوحة مفاتيح تفاعلية للوحة التحكم الرئيسية"""
-    markup = types.InlineKeyboardMarkup(row_width=2)
 
-    # أزرار إدارة القنوات
-    btn_set_source = types.InlineKeyboardButton("تعيين قناة المصدر 📥", callback_data="set_source")
-    btn_set_target = types.InlineKeyboardButton("تعيين قناة الهدف 📤", callback_data="set_target")
-    btn_view_channels = types.InlineKeyboardButton("عرض القنوات الحالية 📋", callback_data="view_channels")
+def build_normalize_stage(tag_key):
+    if not config["normalize_arabic_enabled"]:
+        return None
+    return lambda text: text.translate(ARABIC_MARKS)
 
-    # أزرار إدارة القوالب
-    btn_templates = types.InlineKeyboardButton("إدارة القوالب 🎛", callback_data="manage_templates")
 
-    # أزرار إدارة الاستبدالات
-    btn_replacements = types.InlineKeyboardButton("إدارة الاستبدالات 🔄", callback_data="manage_replacements")
+def build_trim_stage(tag_key):
+    if not config["trim_whitespace_enabled"]:
+        return None
+    return lambda text: EXTRA_SPACES_PATTERN.sub(' ', text).strip()
 
-    # أزرار إدارة التذييل
-    btn_footers = types.InlineKeyboardButton("إدارة التذييل 📝", callback_data="manage_footers")
 
-    # أزرار إدارة حذف الروابط
-    btn_links = types.InlineKeyboardButton("إدارة حذف الروابط 🔗", callback_data="manage_links")
+def build_footer_stage(tag_key):
+    if not config["footer_enabled"]:
+        return None
+    suffix = "".join(footer["text"] for footer in list(footers.values()) if tag_key in footer["tags"])
+    if not suffix:
+        return None
+    return lambda text: text + suffix
 
-    # أزرار إدارة صورة الألبوم
-    btn_album_cover = types.InlineKeyboardButton("إدارة صورة الألبوم 🖼️", callback_data="manage_album_cover")
 
-    # زر تفعيل/تعطيل البوت بالكامل
-    toggle_text = "تعطيل البوت ❌" if config["bot_enabled"] else "تفعيل البوت ✅"
-    btn_toggle_bot = types.InlineKeyboardButton(toggle_text, callback_data="toggle_bot")
+def build_truncate_stage(tag_key):
+    if not TAG_MAX_LENGTH or tag_key in TRUNCATE_EXEMPT_TAGS:
+        return None
+    return lambda text: text if len(text) <= TAG_MAX_LENGTH else text[:TAG_MAX_LENGTH].rstrip()
+
+
+# مراحل معالجة النص بالترتيب: (الاسم، دالة تعيد المرحلة للوسم أو None إذا لم يكن لها أثر)
+# لإضافة خطوة تنظيف جديدة تكفي إضافة دالة بناء هنا دون تعديل أماكن الاستخدام
+TEXT_STAGES = [
+    ("links", build_links_stage),
+    ("replace", build_replace_stage),
+    ("regex_replace", build_regex_replace_stage),
+    ("normalize_arabic", build_normalize_stage),
+    ("trim", build_trim_stage),
+    ("footer", build_footer_stage),
+    ("truncate", build_truncate_stage),
+]
+
+
+def compile_text_pipeline(tag_key):
+    """ترجمة مراحل المعالجة المفعلة لوسم معين إلى سلسلة دوال.
+
+    المراحل المعطلة أو التي ليس لها قواعد لهذا الوسم لا تدخل في السلسلة، لذلك
+    لا يمر النص إلا على المراحل التي قد تغيره.
+    """
+    return tuple(
+        (name, stage) for name, builder in TEXT_STAGES
+        for stage in (builder(tag_key),) if stage is not None
+    )
 
-    markup.add(btn_set_source, btn_set_target)
-    markup.add(btn_view_channels)
-    markup.add(btn_templates, btn_replacements)
-    markup.add(btn_footers, btn_links)
-    markup.add(btn_album_cover)
-    markup.add(btn_toggle_bot)
 
-    return markup
+def get_text_pipeline(tag_key):
+    """إرجاع سلسلة المعالجة المترجمة للوسم، وبناؤها إذا لم تكن موجودة."""
+    pipeline = text_pipelines.get(tag_key)
+    if pipeline is None:
+        with text_pipelines_lock:
+            pipeline = text_pipelines.get(tag_key)
+            if pipeline is None:
+                pipeline = compile_text_pipeline(tag_key)
+                text_pipelines[tag_key] = pipeline
+    return pipeline
 
 
-def create_templates_keyboard():
-    """إنشاء لوحة مفاتيح تفاعلية لإدارة القوالب"""
-    markup = types.InlineKeyboardMarkup(row_width=2)
+def invalidate_text_pipelines(tags=None):
+    """حذف سلاسل المعالجة المترجمة للوسوم المحددة (أو جميعها إذا لم تُحدد)."""
+    with text_pipelines_lock:
+        if tags is None:
+            text_pipelines.clear()
+        else:
+            for tag_key in tags:
+                text_pipelines.pop(tag_key, None)
 
-    btn_list_templates = types.InlineKeyboardButton("قائمة القوالب 📋", callback_data="list_templates")
-    btn_current_template = types.InlineKeyboardButton("القالب الحالي 📌", callback_data="current_template")
-    btn_switch_template = types.InlineKeyboardButton("تبديل القالب 🔄", callback_data="switch_template")
-    btn_add_template = types.InlineKeyboardButton("إضافة قالب جديد ➕", callback_data="add_template")
-    btn_edit_template = types.InlineKeyboardButton("تعديل قالب ✏️", callback_data="edit_template")
-    btn_delete_template = types.InlineKeyboardButton("حذف قالب 🗑️", callback_data="delete_template")
-    btn_back = types.InlineKeyboardButton("العودة للوحة التحكم ↩️", callback_data="back_to_main")
 
-    markup.add(btn_list_templates, btn_current_template)
-    markup.add(btn_switch_template)
-    markup.add(btn_add_template, btn_edit_template)
-    markup.add(btn_delete_template)
+def process_tag_text(text, tag_key):
+    """تطبيق سلسلة المعالجة الخاصة بالوسم على النص."""
+    for _, stage in get_text_pipeline(tag_key):
+        text = stage(text)
+    return text
+
+
+# ذاكرة مؤقتة لصور الألبوم: المسار ← (وقت التعديل، البيانات، النوع، إطار APIC جاهز)
+cover_cache = {}
+cover_cache_lock = threading.Lock()
+
+
+def detect_image_mime(data):
+    """تحديد نوع الصورة من البايتات الأولى في الملف."""
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data.startswith(b'GIF8'):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+
+def prepare_cover_data(data):
+    """تصغير الصورة وإعادة ضغطها إذا تجاوزت الحجم المسموح (عند توفر Pillow)."""
+    mime = detect_image_mime(data)
+    if Image is None or not ALBUM_COVER_MAX_SIZE:
+        return data, mime
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= ALBUM_COVER_MAX_SIZE and len(data) <= ALBUM_COVER_MAX_BYTES:
+                return data, mime
+
+            image.thumbnail((ALBUM_COVER_MAX_SIZE, ALBUM_COVER_MAX_SIZE))
+            output = io.BytesIO()
+            image.convert('RGB').save(output, format='JPEG', quality=ALBUM_COVER_QUALITY, optimize=True)
+    except Exception as e:
+        logger.error(f"خطأ في تصغير صورة الألبوم، سيتم استخدام الصورة الأصلية: {e}")
+        return data, mime
+
+    resized = output.getvalue()
+    logger.info(f"تم تصغير صورة الألبوم من {len(data)} إلى {len(resized)} بايت")
+    return resized, 'image/jpeg'
+
+
+def get_album_cover(path):
+    """إرجاع صورة الألبوم من الذاكرة المؤقتة، وقراءتها من القرص فقط إذا تغيرت."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError as e:
+        logger.error(f"تعذر الوصول إلى صورة الألبوم: {e}")
+        return None
+
+    entry = cover_cache.get(path)
+    if entry and entry["mtime"] == mtime:
+        return entry
+
+    with cover_cache_lock:
+        entry = cover_cache.get(path)
+        if entry and entry["mtime"] == mtime:
+            return entry
+
+        with open(path, 'rb') as cover_file:
+            data, mime = prepare_cover_data(cover_file.read())
+
+        # الصورة بصيغة FLAC/Vorbis (نوع 3 هو "Cover (front)")
+        picture = Picture()
+        picture.type = 3
+        picture.mime = mime
+        picture.desc = 'Cover'
+        picture.data = data
+
+        entry = {
+            "mtime": mtime,
+            "data": data,
+            "mime": mime,
+            "frame": mutagen.id3.APIC(
+                encoding=3,
+                mime=mime,
+                type=3,  # نوع 3 هو "Cover (front)"
+                desc='Cover',
+                data=data
+            ),
+            "picture": picture,
+            "vorbis_picture": base64.b64encode(picture.write()).decode('ascii'),
+            "mp4_cover": MP4Cover(
+                data,
+                imageformat=MP4Cover.FORMAT_PNG if mime == "image/png" else MP4Cover.FORMAT_JPEG
+            )
+        }
+        cover_cache[path] = entry
+        return entry
+
+
+def invalidate_cover_cache(path=None):
+    """حذف صورة (أو جميع الصور) من الذاكرة المؤقتة."""
+    with cover_cache_lock:
+        if path is None:
+            cover_cache.clear()
+        else:
+            cover_cache.pop(path, None)
+
+
+# دوال إنشاء إطارات ID3 لكل وسم من وسوم القالب
+ID3_FRAME_BUILDERS = {
+    "artist": lambda text: mutagen.id3.TPE1(encoding=3, text=text),
+    "album_artist": lambda text: mutagen.id3.TPE2(encoding=3, text=text),
+    "album": lambda text: mutagen.id3.TALB(encoding=3, text=text),
+    "genre": lambda text: mutagen.id3.TCON(encoding=3, text=text),
+    "year": lambda text: mutagen.id3.TYER(encoding=3, text=text),
+    "publisher": lambda text: mutagen.id3.TPUB(encoding=3, text=text),
+    "copyright": lambda text: mutagen.id3.TCOP(encoding=3, text=text),
+    "comment": lambda text: mutagen.id3.COMM(encoding=3, lang='ara', desc='', text=text),
+    "website": lambda text: mutagen.id3.WOAR(url=text),
+    "composer": lambda text: mutagen.id3.TCOM(encoding=3, text=text),
+    "lyrics": lambda text: mutagen.id3.USLT(encoding=3, lang='ara', desc='', text=text),
+    "description": lambda text: mutagen.id3.TIT3(encoding=3, text=text),
+}
+
+# خطة القالب المترجمة: الوسوم التي تحتفظ بقيمتها الأصلية، والقيم الجاهزة لبقية الوسوم
+TemplatePlan = namedtuple("TemplatePlan", ["kept", "literals"])
+
+
+def compile_template_plan():
+    """ترجمة القالب الحالي إلى خطة ثابتة تُطبق كما هي على كل ملف.
+
+    الحقل الفارغ أو الذي يحتوي على $اسم_الحقل (أو غير الموجود في القالب) يحتفظ
+    بالقيمة الأصلية، وبقية الحقول تُحسب قيمتها النهائية مرة واحدة هنا.
+    """
+    template = templates.get(current_template_key, {})
+    kept = []
+    literals = []
+
+    for tag_key in ID3_FRAME_BUILDERS:
+        value = template.get(tag_key)
+        if value is None or value.strip() in ("", f"${tag_key}"):
+            kept.append(tag_key)
+            continue
+
+        literals.append((tag_key, process_tag_text(value, tag_key)))
+
+    return TemplatePlan(kept=frozenset(kept), literals=tuple(literals))
+
+
+def compute_settings_fingerprint():
+    """بصمة لكل الإعدادات التي تؤثر على الملف الناتج (القالب، القواعد، التذييلات، الصورة)."""
+    cover_mtime = None
+    if album_cover_path and os.path.exists(album_cover_path):
+        cover_mtime = os.path.getmtime(album_cover_path)
+
+    state = json.dumps({
+        'template': templates.get(current_template_key),
+        'replacements': replacements,
+        'footers': footers,
+        'config': config,
+        'link_pattern': link_pattern.pattern,
+        'tag_max_length': TAG_MAX_LENGTH,
+        'album_cover': [album_cover_path, cover_mtime]
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(state.encode('utf-8')).hexdigest()[:16]
+
+
+def rebuild_template_plan():
+    """إعادة بناء خطة القالب وبصمة الإعدادات بعد أي تعديل على الإعدادات."""
+    global template_plan, settings_fingerprint
+    invalidate_text_pipelines()
+    template_plan = compile_template_plan()
+    settings_fingerprint = compute_settings_fingerprint()
+
+
+# عدد مرات كتابة الوسوم في مكانها مقابل إعادة كتابة الملف بالكامل
+tag_write_stats = {"in_place": 0, "rewrite": 0, "unchanged": 0}
+tag_write_lock = threading.Lock()
+
+
+def tag_padding(info):
+    """تحديد المساحة الفارغة بعد الوسوم عند الحفظ (تُمرر لـ mutagen كـ padding).
+
+    إذا اتسعت المساحة الحالية للوسوم الجديدة تُترك كما هي فيُكتب رأس الملف فقط،
+    وإلا يُعاد كتابة الملف مرة واحدة مع حجز TAG_PADDING_BYTES للتعديلات التالية.
+    """
+    with tag_write_lock:
+        if info.padding >= 0:
+            tag_write_stats["in_place"] += 1
+            return info.padding
+        tag_write_stats["rewrite"] += 1
+        return TAG_PADDING_BYTES
+
+
+# أسماء حقول القالب في تعليقات Vorbis (FLAC و Ogg)
+VORBIS_FIELDS = {
+    "title": "TITLE",
+    "artist": "ARTIST",
+    "album_artist": "ALBUMARTIST",
+    "album": "ALBUM",
+    "genre": "GENRE",
+    "year": "DATE",
+    "publisher": "ORGANIZATION",
+    "copyright": "COPYRIGHT",
+    "comment": "COMMENT",
+    "website": "CONTACT",
+    "composer": "COMPOSER",
+    "lyrics": "LYRICS",
+    "description": "DESCRIPTION",
+}
+
+# أسماء حقول القالب في وسوم MP4 (الحقول التي ليس لها وسم قياسي تُكتب كوسوم iTunes حرة)
+MP4_FIELDS = {
+    "title": "\xa9nam",
+    "artist": "\xa9ART",
+    "album_artist": "aART",
+    "album": "\xa9alb",
+    "genre": "\xa9gen",
+    "year": "\xa9day",
+    "publisher": "----:com.apple.iTunes:LABEL",
+    "copyright": "cprt",
+    "comment": "\xa9cmt",
+    "website": "----:com.apple.iTunes:URL",
+    "composer": "\xa9wrt",
+    "lyrics": "\xa9lyr",
+    "description": "desc",
+}
+
+
+def is_adts_frame(data):
+    """هل تبدأ البيانات بإطار ADTS (AAC)؟ له نفس بايتات التزامن لكن طبقته 00."""
+    return len(data) >= 2 and data[0] == 0xFF and (data[1] & 0xF0) == 0xF0 and (data[1] & 0x06) == 0
+
+
+def is_mpeg_frame(data):
+    """هل تبدأ البيانات بإطار MPEG صوتي؟ (الطبقة 00 محجوزة في MPEG وتعني ADTS AAC)"""
+    return len(data) >= 2 and data[0] == 0xFF and (data[1] & 0xE0) == 0xE0 and (data[1] & 0x06) != 0
+
+
+def id3_tag_size(header):
+    """الحجم الكامل لوسم ID3v2 في بداية البيانات (مع الترويسة)، أو 0 إذا لم يوجد."""
+    if header[:3] != b"ID3" or len(header) < 10:
+        return 0
+    return 10 + ((header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9])
+
+
+def detect_format_after_id3(data):
+    """صيغة الصوت الذي يلي وسم ID3، بعد تجاوز أي حشو أصفار خارج الوسم."""
+    data = data.lstrip(b"\x00")
+    if data[:4] == b"fLaC":
+        return "flac"
+    if is_mpeg_frame(data):
+        return "mp3"
+    return None
+
+
+def detect_audio_format(file_path):
+    """تحديد صيغة الملف الصوتي من البايتات الأولى بدلاً من امتداده."""
+    with open(file_path, 'rb') as f:
+        header = f.read(64)
+
+        # وسم ID3 في بداية الملف: الصيغة الفعلية بعده (FLAC أو MPEG، و ADTS أو غيره غير مدعوم)
+        tag_size = id3_tag_size(header)
+        if tag_size:
+            f.seek(tag_size)
+            return detect_format_after_id3(f.read(ID3_FORMAT_PROBE_BYTES))
+
+    if header[:4] == b"fLaC":
+        return "flac"
+    if header[:4] == b"OggS":
+        if b"OpusHead" in header:
+            return "opus"
+        if b"\x01vorbis" in header:
+            return "vorbis"
+        return None
+    if header[4:8] == b"ftyp":
+        return "mp4"
+    # إطار MPEG بدون وسوم
+    if is_mpeg_frame(header):
+        return "mp3"
+    return None
+
+
+def fill_id3_tags(audio, values, track_number, cover):
+    """إضافة إطارات ID3 للقيم المطلوبة إلى كائن الوسوم."""
+    for tag_key, text in values:
+        if tag_key == "title":
+            audio.add(mutagen.id3.TIT2(encoding=3, text=text))
+        else:
+            audio.add(ID3_FRAME_BUILDERS[tag_key](text))
+
+    # ترقيم ملفات الألبوم بترتيب إرسالها
+    if track_number:
+        audio.add(mutagen.id3.TRCK(encoding=3, text=track_number))
+
+    if cover:
+        # حذف أي صور موجودة أولاً ثم إضافة الصورة الجاهزة
+        audio.delall('APIC')
+        audio.add(cover["frame"])
+
+
+def write_id3_tags(file_path, values, track_number, cover):
+    """كتابة الوسوم كإطارات ID3 (ملفات MP3)."""
+    try:
+        audio = ID3(file_path)
+    except mutagen.id3.ID3NoHeaderError:
+        # الملف لا يحتوي على وسم ID3، قم بإنشاء واحد
+        audio = ID3()
+
+    fill_id3_tags(audio, values, track_number, cover)
+
+    # حفظ التغييرات في مكانها إن أمكن
+    audio.save(file_path, padding=tag_padding)
+
+
+def write_vorbis_tags(audio, values, track_number, cover):
+    """كتابة الوسوم كتعليقات Vorbis (FLAC و Ogg Opus و Ogg Vorbis)."""
+    if audio.tags is None:
+        audio.add_tags()
+
+    for tag_key, text in values:
+        audio[VORBIS_FIELDS[tag_key]] = [text]
+
+    if track_number:
+        number, _, total = track_number.partition("/")
+        audio["TRACKNUMBER"] = [number]
+        audio["TRACKTOTAL"] = [total]
+
+    if cover:
+        if isinstance(audio, FLAC):
+            audio.clear_pictures()
+            audio.add_picture(cover["picture"])
+        else:
+            # ملفات Ogg تحمل الصورة داخل تعليق METADATA_BLOCK_PICTURE
+            audio["METADATA_BLOCK_PICTURE"] = [cover["vorbis_picture"]]
+
+    audio.save(padding=tag_padding)
+
+
+def write_mp4_tags(file_path, values, track_number, cover):
+    """كتابة الوسوم كوسوم MP4 (ملفات M4A)."""
+    audio = MP4(file_path)
+    if audio.tags is None:
+        audio.add_tags()
+
+    for tag_key, text in values:
+        atom = MP4_FIELDS[tag_key]
+        if atom.startswith("----"):
+            audio[atom] = [MP4FreeForm(text.encode('utf-8'))]
+        else:
+            audio[atom] = [text]
+
+    if track_number:
+        number, _, total = track_number.partition("/")
+        audio["trkn"] = [(int(number), int(total or 0))]
+
+    if cover:
+        audio["covr"] = [cover["mp4_cover"]]
+
+    audio.save(padding=tag_padding)
+
+
+# كاتب الوسوم المناسب لكل صيغة
+TAG_WRITERS = {
+    "mp3": write_id3_tags,
+    "flac": lambda path, *args: write_vorbis_tags(FLAC(path), *args),
+    "opus": lambda path, *args: write_vorbis_tags(OggOpus(path), *args),
+    "vorbis": lambda path, *args: write_vorbis_tags(OggVorbis(path), *args),
+    "mp4": write_mp4_tags,
+}
+
+
+def prepare_tag_values(title):
+    """القيم التي ستُكتب في وسوم الملف: العنوان بعد معالجته ثم خطة القالب، وصورة الألبوم."""
+    # تعيين العنوان من وصف الرسالة أو استخدام اسم الملف
+    title_text = title if title else "audio_file.mp3"
+    title_text = process_tag_text(title_text, "title")  # حذف الروابط والاستبدالات والتذييل
+
+    # العنوان ثم خطة القالب المترجمة؛ الوسوم المحتفظ بها تبقى كما هي في الملف
+    values = [("title", title_text)] + list(template_plan.literals)
+
+    # إضافة صورة الألبوم إذا كانت متاحة وتم تفعيل الميزة
+    cover = None
+    if config["album_cover_enabled"] and album_cover_path:
+        try:
+            cover = get_album_cover(album_cover_path)
+        except Exception as cover_error:
+            logger.error(f"خطأ في إضافة صورة الألبوم: {cover_error}")
+
+    return values, cover
+
+
+def id3_tags_match(tags, title, track_number=None):
+    """هل تحتوي وسوم ID3 الحالية على كل ما سيكتبه القالب؟ (عندها لا داعي لمعالجة الملف)"""
+    values, cover = prepare_tag_values(title)
+    expected = ID3()
+    fill_id3_tags(expected, values, track_number, cover)
+    # الوسوم المقروءة تُحول إلى ID3v2.4 (مثل TYER ← TDRC) فتُحول القيم المتوقعة بالمثل
+    expected.update_to_v24()
+
+    for key, frame in expected.items():
+        current = tags.get(key)
+        if current is None:
+            return False
+        if key.startswith("APIC"):
+            if current.data != frame.data:
+                return False
+        elif str(current) != str(frame):
+            return False
+    return True
+
+
+def process_audio_tags(file_path, title=None, track_number=None):
+    """معالجة الملف الصوتي بتعديل وسومه وفقاً للقالب حسب صيغته (MP3، FLAC، Ogg، M4A).
+
+    track_number (بصيغة "3/12") يُكتب كرقم المسار لملفات الألبومات.
+    """
+    # فحص ما إذا كان البوت مفعل بالكامل
+    if not config["bot_enabled"]:
+        # إذا كان البوت معطلاً، إرجاع True دون تنفيذ أي تعديلات
+        logger.info("البوت معطّل، لن يتم إجراء تعديلات على وسوم الملف")
+        return True
+
+    try:
+        audio_format = detect_audio_format(file_path)
+        writer = TAG_WRITERS.get(audio_format)
+        if writer is None:
+            # إرسال الملف كما هو بدلاً من إفساده بوسوم لا تناسب صيغته
+            logger.warning(f"صيغة الملف غير مدعومة، لن يتم تعديل وسومه: {file_path}")
+            return True
+
+        values, cover = prepare_tag_values(title)
+        writer(file_path, values, track_number, cover)
+        logger.info(f"تم تعديل وسوم الملف ({audio_format}) بنجاح: {file_path}")
+        return True
+    except Exception as e:
+        logger.error(f"خطأ في معالجة وسوم الملف الصوتي: {e}")
+        return False
+
+# بناء خطة القالب الافتراضية عند التشغيل
+rebuild_template_plan()
+
+# وظائف إنشاء لوحات المفاتيح
+
+# لوحات المفاتيح الجاهزة بصيغة JSON: (اسم اللوحة، قيم الإعدادات، إصدار الإعدادات) ← اللوحة
+keyboard_cache = {}
+
+
+def cached_keyboard(flags):
+    """حفظ لوحة المفاتيح بعد بنائها مرة واحدة لكل مجموعة من قيم الإعدادات التي تعتمد عليها.
+
+    flags دالة تعيد قيم الإعدادات التي تغير نصوص أزرار اللوحة، وتُحذف جميع اللوحات
+    المحفوظة عند استدعاء save_data.
+    """
+    def decorator(builder):
+        @functools.wraps(builder)
+        def wrapper():
+            key = (builder.__name__, flags(), settings_version)
+            markup = keyboard_cache.get(key)
+            if markup is None:
+                markup = builder().to_json()
+                keyboard_cache[key] = markup
+            return markup
+        return wrapper
+    return decorator
+
+
+def invalidate_keyboard_cache():
+    """حذف جميع لوحات المفاتيح المحفوظة بعد تعديل الإعدادات"""
+    global settings_version
+    settings_version += 1
+    keyboard_cache.clear()
+
+
+@cached_keyboard(lambda: (config["bot_enabled"],))
+def create_control_panel_keyboard():
+    """إنشاء لوحة مفاتيح تفاعلية للوحة التحكم الرئيسية"""
+    markup = types.InlineKeyboardMarkup(row_width=2)
+
+    # أزرار إدارة القنوات
+    btn_set_source = types.InlineKeyboardButton("تعيين قناة المصدر 📥", callback_data="set_source")
+    btn_set_target = types.InlineKeyboardButton("تعيين قناة الهدف 📤", callback_data="set_target")
+    btn_view_channels = types.InlineKeyboardButton("عرض القنوات الحالية 📋", callback_data="view_channels")
+
+    # أزرار إدارة القوالب
+    btn_templates = types.InlineKeyboardButton("إدارة القوالب 🎛", callback_data="manage_templates")
+
+    # أزرار إدارة الاستبدالات
+    btn_replacements = types.InlineKeyboardButton("إدارة الاستبدالات 🔄", callback_data="manage_replacements")
+
+    # أزرار إدارة التذييل
+    btn_footers = types.InlineKeyboardButton("إدارة التذييل 📝", callback_data="manage_footers")
+
+    # أزرار إدارة حذف الروابط
+    btn_links = types.InlineKeyboardButton("إدارة حذف الروابط 🔗", callback_data="manage_links")
+
+    # أزرار إدارة صورة الألبوم
+    btn_album_cover = types.InlineKeyboardButton("إدارة صورة الألبوم 🖼️", callback_data="manage_album_cover")
+
+    # زر تفعيل/تعطيل البوت بالكامل
+    toggle_text = "تعطيل البوت ❌" if config["bot_enabled"] else "تفعيل البوت ✅"
+    btn_toggle_bot = types.InlineKeyboardButton(toggle_text, callback_data="toggle_bot")
+
+    markup.add(btn_set_source, btn_set_target)
+    markup.add(btn_view_channels)
+    markup.add(btn_templates, btn_replacements)
+    markup.add(btn_footers, btn_links)
+    markup.add(btn_album_cover)
+    markup.add(btn_toggle_bot)
+
+    return markup
+
+
+@cached_keyboard(lambda: ())
+def create_templates_keyboard():
+    """إنشاء لوحة مفاتيح تفاعلية لإدارة القوالب"""
+    markup = types.InlineKeyboardMarkup(row_width=2)
+
+    btn_list_templates = types.InlineKeyboardButton("قائمة القوالب 📋", callback_data="list_templates")
+    btn_current_template = types.InlineKeyboardButton("القالب الحالي 📌", callback_data="current_template")
+    btn_switch_template = types.InlineKeyboardButton("تبديل القالب 🔄", callback_data="switch_template")
+    btn_add_template = types.InlineKeyboardButton("إضافة قالب جديد ➕", callback_data="add_template")
+    btn_edit_template = types.InlineKeyboardButton("تعديل قالب ✏️", callback_data="edit_template")
+    btn_delete_template = types.InlineKeyboardButton("حذف قالب 🗑️", callback_data="delete_template")
+    btn_back = types.InlineKeyboardButton("العودة للوحة التحكم ↩️", callback_data="back_to_main")
+
+    markup.add(btn_list_templates, btn_current_template)
+    markup.add(btn_switch_template)
+    markup.add(btn_add_template, btn_edit_template)
+    markup.add(btn_delete_template)
     markup.add(btn_back)
 
     return markup
 
 
+@cached_keyboard(lambda: (config["replacement_enabled"],))
 def create_replacements_keyboard():
     """إنشاء لوحة مفاتيح تفاعلية لإدارة الاستبدالات"""
     markup = types.InlineKeyboardMarkup(row_width=2)
 
     btn_add_replacement = types.InlineKeyboardButton("إضافة استبدال ➕", callback_data="add_replacement")
+    btn_add_regex = types.InlineKeyboardButton("إضافة تعبير نمطي ➕", callback_data="add_regex_replacement")
     btn_list_replacements = types.InlineKeyboardButton("قائمة الاستبدالات 📋", callback_data="list_replacements")
     btn_delete_replacement = types.InlineKeyboardButton("حذف استبدال ➖", callback_data="delete_replacement")
 
@@ -698,13 +2025,15 @@ def create_replacements_keyboard():
 
     btn_back = types.InlineKeyboardButton("العودة للوحة التحكم ↩️", callback_data="back_to_main")
 
-    markup.add(btn_add_replacement, btn_list_replacements)
-    markup.add(btn_delete_replacement, btn_toggle)
+    markup.add(btn_add_replacement, btn_add_regex)
+    markup.add(btn_list_replacements, btn_delete_replacement)
+    markup.add(btn_toggle)
     markup.add(btn_back)
 
     return markup
 
 
+@cached_keyboard(lambda: (config["footer_enabled"],))
 def create_footers_keyboard():
     """إنشاء لوحة مفاتيح تفاعلية لإدارة التذييلات"""
     markup = types.InlineKeyboardMarkup(row_width=2)
@@ -726,22 +2055,36 @@ def create_footers_keyboard():
     return markup
 
 
+@cached_keyboard(lambda: (
+    config["remove_links_enabled"], config["normalize_arabic_enabled"], config["trim_whitespace_enabled"]
+))
 def create_links_keyboard():
-    """إنشاء لوحة مفاتيح تفاعلية لإدارة حذف الروابط"""
+    """إنشاء لوحة مفاتيح تفاعلية لإدارة حذف الروابط وتنظيف النصوص"""
     markup = types.InlineKeyboardMarkup(row_width=2)
 
     # زر تفعيل/تعطيل ميزة حذف الروابط
     toggle_text = "تعطيل حذف الروابط ❌" if config["remove_links_enabled"] else "تفعيل حذف الروابط ✅"
     btn_toggle = types.InlineKeyboardButton(toggle_text, callback_data="toggle_links")
 
+    # أزرار خيارات تنظيف النصوص
+    option_buttons = []
+    for option_key, option_name in TEXT_CLEANING_OPTIONS.items():
+        option_text = f"{'تعطيل' if config[option_key] else 'تفعيل'} {option_name} {'❌' if config[option_key] else '✅'}"
+        option_buttons.append(
+            types.InlineKeyboardButton(option_text, callback_data=f"toggle_text_option:{option_key}")
+        )
+
     btn_back = types.InlineKeyboardButton("العودة للوحة التحكم ↩️", callback_data="back_to_main")
 
     markup.add(btn_toggle)
+    for btn in option_buttons:
+        markup.add(btn)
     markup.add(btn_back)
 
     return markup
 
 
+@cached_keyboard(lambda: (config["album_cover_enabled"],))
 def create_album_cover_keyboard():
     """إنشاء لوحة مفاتيح تفاعلية لإدارة صورة الألبوم"""
     markup = types.InlineKeyboardMarkup(row_width=2)
@@ -814,6 +2157,8 @@ def help_command(message):
         "/start - بدء المحادثة مع البوت\n"
         "/help - عرض رسالة المساعدة هذه\n"
         "/control - عرض لوحة التحكم الشفافة (للمشرفين فقط)\n"
+        "/stats - عرض إحصائيات الأداء (للمشرفين فقط)\n"
+        "/tags - عرض وسوم ملف صوتي دون تحميله (بالرد على الملف، للمشرفين فقط)\n"
     )
 
 
@@ -838,1241 +2183,1606 @@ def control_panel(message):
     )
 
 
-@bot.callback_query_handler(func=lambda call: True)
-def handle_callback_query(call):
-    """معالجة الضغط على الأزرار التفاعلية"""
-    global current_template_key, album_cover_path
+def build_stats_text():
+    """بناء نص إحصائيات الأداء المعروض للمشرف"""
+    lines = ["📊 *إحصائيات البوت*", ""]
 
-    user_id = call.from_user.id
+    # قائمة انتظار المعالجة
+    lines.append(f"🎵 المهام المنتظرة: {audio_jobs.qsize()} / {AUDIO_QUEUE_SIZE}")
+    lines.append(
+        f"🏷 كتابة الوسوم: في المكان {tag_write_stats['in_place']}، "
+        f"إعادة كتابة الملف {tag_write_stats['rewrite']}، "
+        f"مطابقة للقالب دون تعديل {tag_write_stats['unchanged']}"
+    )
+    spool = get_spool_stats()
+    lines.append(
+        f"💾 مجلد العمل: {spool['reserved'] / 1024 ** 2:.0f} / {spool['quota'] / 1024 ** 2:.0f} MB "
+        f"({spool['jobs']} مهام، بانتظار مساحة: {spool['waiting']}، "
+        f"ملفات متروكة محذوفة: {spool['reaped']})"
+    )
+    outbound = get_outbound_stats()
+    lines.append(
+        f"📤 طلبات بانتظار الإرسال: {outbound['waiting']} "
+        f"(أُرسلت: {outbound['sent']}، خطأ 429: {outbound['rate_limited']}، "
+        f"أطول انتظار: {outbound['max_wait']:.1f}s)"
+    )
+    if DEDUP_MAX_ENTRIES:
+        lines.append(
+            f"♻️ الملفات المعالجة مسبقاً: {len(dedup_index)} / {DEDUP_MAX_ENTRIES} "
+            f"(إعادة استخدام: {dedup_stats['hits']}، جديدة: {dedup_stats['misses']})"
+        )
+    job_counts = get_job_counts()
+    if job_counts:
+        lines.append("🗂 المهام المحفوظة: " + "، ".join(
+            f"{state}: {count}" for state, count in sorted(job_counts.items())
+        ))
+
+    # مجمع اتصالات قاعدة البيانات
+    if connection_pool:
+        db_stats = get_db_pool_stats()
+        lines.append(
+            f"🗄 الاتصالات المستخدمة: {db_stats['in_use']} / {db_stats['max_size']} "
+            f"(الأقصى: {db_stats['max_in_use']})"
+        )
+        lines.append(
+            f"⏱ انتظار الاتصال: متوسط {db_stats['wait_avg'] * 1000:.1f}ms، "
+            f"أقصى {db_stats['wait_max'] * 1000:.1f}ms"
+        )
+        lines.append(
+            f"⚠️ انتهاء المهلة: {db_stats['timeouts']} | إعادة الاتصال: {db_stats['reconnects']}"
+        )
+        if edit_log_queue is not None:
+            lines.append(f"📝 سجلات بانتظار الكتابة: {edit_log_queue.qsize()}")
+    else:
+        lines.append("🗄 قاعدة البيانات: غير متصلة")
+
+    # أبطأ إجراءات لوحة التحكم
+    slowest = get_callback_stats()[:5]
+    if slowest:
+        lines.append("")
+        lines.append("🎛 أبطأ إجراءات لوحة التحكم:")
+        for route_key, stats in slowest:
+            average = stats["total"] / stats["count"] * 1000
+            lines.append(f"• `{route_key}` ({stats['panel']}): {average:.0f}ms × {stats['count']}")
+
+    return "\n".join(lines)
+
+
+@bot.message_handler(commands=['stats'])
+def stats_command(message):
+    """عرض إحصائيات الأداء (للمشرفين فقط)"""
+    user_id = message.from_user.id
 
     # التحقق مما إذا كان المستخدم هو المشرف
     if user_id != ADMIN_ID:
-        bot.answer_callback_query(call.id, "⛔ هذا الإجراء متاح للمشرفين فقط.", show_alert=True)
+        bot.reply_to(message, "⛔ هذا الأمر متاح للمشرفين فقط.")
         return
 
-    # استخراج البيانات من زر الاتصال
-    action = call.data
-
-    # ==== إدارة القنوات ====
-    if action == "set_source":
-        # تعيين قناة المصدر
-        bot.edit_message_text(
-            "📥 *تعيين قناة المصدر*\n\n"
-            "الرجاء إرسال معرف قناة المصدر (على سبيل المثال: @channelname أو -100xxxxxxxxx)\n"
-            "أو يمكنك إعادة توجيه رسالة من القناة المطلوبة.",
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            parse_mode="Markdown"
-        )
-        # تعيين حالة المستخدم
-        user_states[user_id] = STATE_AWAITING_SOURCE_CHANNEL
+    bot.reply_to(message, build_stats_text(), parse_mode="Markdown")
 
-    elif action == "set_target":
-        # تعيين قناة الهدف
-        bot.edit_message_text(
-            "📤 *تعيين قناة الهدف*\n\n"
-            "الرجاء إرسال معرف قناة الهدف (على سبيل المثال: @channelname أو -100xxxxxxxxx)\n"
-            "أو يمكنك إعادة توجيه رسالة من القناة المطلوبة.",
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            parse_mode="Markdown"
-        )
-        # تعيين حالة المستخدم
-        user_states[user_id] = STATE_AWAITING_TARGET_CHANNEL
 
-    elif action == "view_channels":
-        # عرض القنوات الحالية
-        bot.edit_message_text(
-            "📋 *القنوات الحالية*\n\n"
-            f"📥 *قناة المصدر*: {SOURCE_CHANNEL or 'غير محدد'}\n"
-            f"📤 *قناة الهدف*: {TARGET_CHANNEL or 'غير محدد'}\n\n"
-            "يمكنك تعديل هذه القنوات باستخدام الأزرار أدناه:",
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=create_control_panel_keyboard(),
-            parse_mode="Markdown"
-        )
+@bot.message_handler(commands=['tags'])
+def tags_command(message):
+    """عرض وسوم ملف صوتي ومقارنتها بالقالب الحالي دون تحميله كاملاً (للمشرفين فقط)"""
+    user_id = message.from_user.id
 
-    # ==== إدارة القوالب ====
-    elif action == "manage_templates":
-        # عرض لوحة إدارة القوالب
-        bot.edit_message_text(
-            "🎛 *إدارة قوالب وسوم ID3*\n\n"
-            "يمكنك إدارة قوالب وسوم ID3 المستخدمة لتعديل الملفات الصوتية من خلال الأزرار أدناه:",
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=create_templates_keyboard(),
-            parse_mode="Markdown"
-        )
+    # التحقق مما إذا كان المستخدم هو المشرف
+    if user_id != ADMIN_ID:
+        bot.reply_to(message, "⛔ هذا الأمر متاح للمشرفين فقط.")
+        return
 
-    elif action == "current_template":
-        # عرض القالب الحالي
-        template = templates[current_template_key]
-
-        # بناء معلومات القالب مع كافة الوسوم
-        template_info = (
-            f"🎵 *الاسم*: {template['name']}\n"
-            f"👤 *الفنان*: {template['artist']}\n"
-            f"👥 *فنان الألبوم*: {template['album_artist']}\n"
-            f"💿 *الألبوم*: {template['album']}\n"
-            f"🏷️ *النوع*: {template['genre']}\n"
-            f"📅 *السنة*: {template['year']}\n"
-            f"🏢 *الناشر*: {template['publisher']}\n"
-            f"©️ *حقوق النشر*: {template['copyright']}\n"
-        )
+    target = message.reply_to_message
+    if not target or not target.audio:
+        bot.reply_to(message, "⚠️ استخدم هذا الأمر بالرد على ملف صوتي.")
+        return
 
-        # إضافة الوسوم الإضافية إذا كانت موجودة
-        if "comment" in template:
-            template_info += f"💬 *التعليق*: {template['comment']}\n"
+    file_path = None
+    try:
+        tags, file_path = probe_audio_tags(bot.get_file(target.audio.file_id))
+        if tags is None:
+            bot.reply_to(message, "⚠️ يمكن فحص وسوم ملفات MP3 فقط.")
+            return
 
-        if "website" in template:
-            template_info += f"🔗 *رابط الموقع*: {template['website']}\n"
+        lines = ["🏷 وسوم الملف الحالية:", ""]
+        for key, frame in sorted(tags.items()):
+            value = f"صورة ({len(frame.data)} بايت)" if key.startswith("APIC") else str(frame)
+            lines.append(f"• {key}: {value[:100]}")
+        if len(lines) == 2:
+            lines.append("لا توجد وسوم")
+
+        title = target.caption if target.caption else os.path.splitext(target.audio.file_name or "audio_file")[0]
+        lines.append("")
+        if id3_tags_match(tags, title):
+            lines.append("✅ الوسوم مطابقة للقالب الحالي، سيتم نشر الملف دون تعديل.")
+        else:
+            lines.append(f"✏️ سيتم تعديل الوسوم وفقاً للقالب: {current_template_key}")
+        if file_path:
+            lines.append("ℹ️ الخادم لا يدعم التحميل الجزئي، تم تحميل الملف كاملاً.")
 
-        if "composer" in template:
-            template_info += f"🎼 *الملحن*: {template['composer']}\n"
+        bot.reply_to(message, "\n".join(lines))
+    except Exception as e:
+        logger.error(f"خطأ في فحص وسوم الملف: {e}")
+        bot.reply_to(message, f"⚠️ حدث خطأ أثناء فحص وسوم الملف: {str(e)}")
+    finally:
+        cleanup_download(file_path)
 
-        if "description" in template:
-            template_info += f"📝 *الوصف*: {template['description']}\n"
 
-        # إضافة كلمات الأغنية مع تنسيق خاص (مختصرة إذا كانت طويلة)
-        if "lyrics" in template:
-            lyrics = template["lyrics"]
-            # إذا كانت كلمات الأغنية طويلة، نعرض جزء منها فقط
-            if len(lyrics) > 50:
-                lyrics_preview = lyrics[:50] + "..."
-                template_info += f"📄 *كلمات الأغنية*: {lyrics_preview}\n"
-            else:
-                template_info += f"📄 *كلمات الأغنية*: {lyrics}\n"
+# ==== موجّه أزرار لوحة التحكم ====
 
-        # إضافة سطر فارغ في النهاية
-        template_info += "\n"
+# الأزرار ذات القيمة الثابتة: الإجراء ← (اللوحة، الدالة)
+callback_routes = {}
 
-        # إنشاء لوحة مفاتيح للعودة
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_templates")
-        markup.add(btn_back)
+# الأزرار التي تحمل معرفاً بعد النقطتين (مثل edit_field:) تُبحث بالبادئة فقط
+callback_prefix_routes = {}
 
-        bot.edit_message_text(
-            f"📌 *القالب الحالي*: {template['name']}\n\n"
-            f"{template_info}"
-            "يمكنك تغيير القالب الحالي من خلال زر 'تبديل القالب'",
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=markup,
-            parse_mode="Markdown"
-        )
+# زمن تنفيذ كل إجراء: عدد المرات، المجموع، الأقصى
+callback_stats = {}
+callback_stats_lock = threading.Lock()
 
-    elif action == "switch_template":
-        # تبديل القالب الحالي
-        markup = types.InlineKeyboardMarkup(row_width=1)
 
-        # إضافة أزرار لجميع القوالب المتاحة
-        for key, template in templates.items():
-            if key != current_template_key:
-                btn = types.InlineKeyboardButton(
-                    f"{template['name']} ✅", 
-                    callback_data=f"set_current_template:{key}"
-                )
-                markup.add(btn)
+def callback_route(action, panel):
+    """تسجيل دالة لمعالجة زر ذي قيمة ثابتة ضمن لوحة معينة"""
+    def decorator(handler):
+        callback_routes[action] = (panel, handler)
+        return handler
+    return decorator
 
-        btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_templates")
-        markup.add(btn_back)
 
-        bot.edit_message_text(
-            "🔄 *تبديل القالب الحالي*\n\n"
-            f"القالب الحالي: *{templates[current_template_key]['name']}*\n\n"
-            "الرجاء اختيار القالب الجديد:",
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=markup,
-            parse_mode="Markdown"
-        )
+def callback_prefix_route(prefix, panel):
+    """تسجيل دالة لمعالجة الأزرار التي تبدأ ببادئة معينة (مثل delete_rule:)"""
+    def decorator(handler):
+        callback_prefix_routes[prefix] = (panel, handler)
+        return handler
+    return decorator
 
-    elif action.startswith("set_current_template:"):
-        # تعيين قالب محدد كقالب حالي
-        template_key = action.split(":", 1)[1]
 
-        if template_key in templates:
-            # تحديث القالب الحالي
-            current_template_key = template_key
+def resolve_callback_route(action):
+    """إيجاد الدالة المسؤولة عن الإجراء بعملية بحث واحدة في القاموس"""
+    route = callback_routes.get(action)
+    if route is not None:
+        return action, route
 
-            bot.edit_message_text(
-                f"✅ تم تعيين *{templates[current_template_key]['name']}* كالقالب الحالي بنجاح.\n\n"
-                "يمكنك العودة إلى لوحة إدارة القوالب:",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_templates_keyboard(),
-                parse_mode="Markdown"
-            )
+    if ":" in action:
+        prefix = action.split(":", 1)[0] + ":"
+        route = callback_prefix_routes.get(prefix)
+        if route is not None:
+            return prefix, route
 
-    elif action.startswith("new_template_field:"):
-        # تعديل حقل في قالب جديد
-        field_key = action.split(":", 1)[1]
+    return action, None
 
-        if user_id in temp_data and temp_data[user_id]["type"] == "template":
-            # الحصول على الاسم العربي للحقل
-            field_name = available_id3_tags.get(field_key, field_key)
 
-            # حفظ الحقل الحالي
-            temp_data[user_id]["current_field"] = field_key
+def record_callback_latency(panel, route_key, elapsed):
+    """تسجيل زمن تنفيذ إجراء من إجراءات لوحة التحكم"""
+    with callback_stats_lock:
+        stats = callback_stats.setdefault(route_key, {"panel": panel, "count": 0, "total": 0.0, "max": 0.0})
+        stats["count"] += 1
+        stats["total"] += elapsed
+        stats["max"] = max(stats["max"], elapsed)
 
-            # الحصول على القيمة الحالية للحقل
-            current_value = temp_data[user_id]["template"].get(field_key, "")
 
-            bot.edit_message_text(
-                f"✏️ *تعديل حقل {field_name} في القالب الجديد*\n\n"
-                f"القيمة الحالية: {current_value}\n\n"
-                "الرجاء إرسال القيمة الجديدة:",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                parse_mode="Markdown"
-            )
+def get_callback_stats():
+    """إحصائيات زمن تنفيذ الإجراءات مرتبة من الأبطأ إلى الأسرع"""
+    with callback_stats_lock:
+        items = [(key, dict(stats)) for key, stats in callback_stats.items()]
+    return sorted(items, key=lambda item: item[1]["total"] / item[1]["count"], reverse=True)
 
-            # تعيين حالة المستخدم
-            user_states[user_id] = STATE_AWAITING_TEMPLATE_FIELD
-        else:
-            bot.answer_callback_query(call.id, "⚠️ حدث خطأ في العملية. الرجاء المحاولة مرة أخرى.", show_alert=True)
 
-    elif action == "save_new_template":
-        # حفظ قالب جديد
-        if user_id in temp_data and temp_data[user_id]["type"] == "template" and "template" in temp_data[user_id]:
-            # إنشاء معرف فريد للقالب الجديد
-            template_key = temp_data[user_id]["template"]["name"]
+def answer_callback(call, text=None, show_alert=False):
+    """الإجابة على ضغطة الزر مرة واحدة فقط (تلجرام يرفض الإجابة الثانية)."""
+    call.answered = True
+    bot.answer_callback_query(call.id, text, show_alert=show_alert)
 
-            # تحويل المعرف إلى نص عربي مناسب وتجنب التكرار
-            counter = 0
-            original_key = template_key
-            while template_key in templates:
-                counter += 1
-                template_key = f"{original_key}_{counter}"
 
-            # إضافة القالب الجديد
-            templates[template_key] = temp_data[user_id]["template"]
+@bot.callback_query_handler(func=lambda call: True)
+def handle_callback_query(call):
+    """معالجة الضغط على الأزرار التفاعلية"""
+    user_id = call.from_user.id
 
-            # تنظيف البيانات المؤقتة
-            del temp_data[user_id]
+    # التحقق مما إذا كان المستخدم هو المشرف
+    if user_id != ADMIN_ID:
+        answer_callback(call, "⛔ هذا الإجراء متاح للمشرفين فقط.", show_alert=True)
+        return
 
-            bot.edit_message_text(
-                f"✅ تم إضافة القالب الجديد *{templates[template_key]['name']}* بنجاح.\n\n"
-                "يمكنك العودة إلى لوحة إدارة القوالب:",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_templates_keyboard(),
-                parse_mode="Markdown"
-            )
-        else:
-            bot.answer_callback_query(call.id, "⚠️ حدث خطأ في العملية. الرجاء المحاولة مرة أخرى.", show_alert=True)
+    # استخراج البيانات من زر الاتصال
+    action = call.data
+    route_key, route = resolve_callback_route(action)
 
-    elif action == "cancel_new_template":
-        # إلغاء إنشاء قالب جديد
-        if user_id in temp_data:
-            del temp_data[user_id]
+    if route is None:
+        logger.warning(f"إجراء غير معروف في لوحة التحكم: {action}")
+    else:
+        panel, handler = route
+        started = time.perf_counter()
+        try:
+            handler(call, user_id, action)
+        finally:
+            record_callback_latency(panel, route_key, time.perf_counter() - started)
 
-        bot.edit_message_text(
-            "❌ تم إلغاء إنشاء القالب الجديد.\n\n"
-            "يمكنك العودة إلى لوحة إدارة القوالب:",
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=create_templates_keyboard(),
-            parse_mode="Markdown"
-        )
+    # إخفاء مؤشر التحميل إذا لم تُجب الدالة مسبقاً برسالة تنبيه
+    if getattr(call, "answered", False):
+        return
+    try:
+        answer_callback(call)
+    except Exception as e:
+        logger.debug(f"تعذر إخفاء مؤشر التحميل: {e}")
 
-    elif action.startswith("edit_template:"):
-        # تحرير قالب محدد
-        template_key = action.split(":", 1)[1]
 
-        if template_key in templates:
-            # إنشاء لوحة مفاتيح لحقول القالب لتعديلها
-            markup = types.InlineKeyboardMarkup(row_width=2)
+# ==== إدارة القنوات ====
+
+@callback_route("set_source", panel="channels")
+def cb_set_source(call, user_id, action):
+    """تعيين قناة المصدر"""
+    bot.edit_message_text(
+        "📥 *تعيين قناة المصدر*\n\n"
+        "الرجاء إرسال معرف قناة المصدر (على سبيل المثال: @channelname أو -100xxxxxxxxx)\n"
+        "ويمكن إدخال عدة قنوات مفصولة بفواصل، أو إعادة توجيه رسالة من القناة المطلوبة.\n"
+        "يجب أن يكون البوت مشرفاً في قناة المصدر ليستلم منشوراتها.",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        parse_mode="Markdown"
+    )
+    # تعيين حالة المستخدم
+    user_states[user_id] = STATE_AWAITING_SOURCE_CHANNEL
+
+
+@callback_route("set_target", panel="channels")
+def cb_set_target(call, user_id, action):
+    """تعيين قناة الهدف"""
+    bot.edit_message_text(
+        "📤 *تعيين قناة الهدف*\n\n"
+        "الرجاء إرسال معرف قناة الهدف (على سبيل المثال: @channelname أو -100xxxxxxxxx)\n"
+        "أو يمكنك إعادة توجيه رسالة من القناة المطلوبة.",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        parse_mode="Markdown"
+    )
+    # تعيين حالة المستخدم
+    user_states[user_id] = STATE_AWAITING_TARGET_CHANNEL
+
+
+@callback_route("view_channels", panel="channels")
+def cb_view_channels(call, user_id, action):
+    """عرض القنوات الحالية"""
+    bot.edit_message_text(
+        "📋 *القنوات الحالية*\n\n"
+        f"📥 *قناة المصدر*: {SOURCE_CHANNEL or 'غير محدد'}\n"
+        f"📤 *قناة الهدف*: {TARGET_CHANNEL or 'غير محدد'}\n"
+        f"➕ *قنوات هدف إضافية*: {', '.join(EXTRA_TARGET_CHANNELS) or 'لا يوجد'}\n\n"
+        "يمكنك تعديل هذه القنوات باستخدام الأزرار أدناه:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=create_control_panel_keyboard(),
+        parse_mode="Markdown"
+    )
 
-            # إضافة أزرار للحقول الأساسية
-            btn_name = types.InlineKeyboardButton("الاسم ✏️", callback_data=f"edit_field:{template_key}:name")
-            btn_artist = types.InlineKeyboardButton("الفنان ✏️", callback_data=f"edit_field:{template_key}:artist")
-            btn_album_artist = types.InlineKeyboardButton("فنان الألبوم ✏️", callback_data=f"edit_field:{template_key}:album_artist")
-            btn_album = types.InlineKeyboardButton("الألبوم ✏️", callback_data=f"edit_field:{template_key}:album")
-            btn_genre = types.InlineKeyboardButton("النوع ✏️", callback_data=f"edit_field:{template_key}:genre")
-            btn_year = types.InlineKeyboardButton("السنة ✏️", callback_data=f"edit_field:{template_key}:year")
-            btn_publisher = types.InlineKeyboardButton("الناشر ✏️", callback_data=f"edit_field:{template_key}:publisher")
-            btn_copyright = types.InlineKeyboardButton("حقوق النشر ✏️", callback_data=f"edit_field:{template_key}:copyright")
-
-            # إضافة أزرار للحقول الإضافية
-            btn_comment = types.InlineKeyboardButton("التعليق ✏️", callback_data=f"edit_field:{template_key}:comment")
-            btn_website = types.InlineKeyboardButton("الموقع ✏️", callback_data=f"edit_field:{template_key}:website")
-            btn_composer = types.InlineKeyboardButton("الملحن ✏️", callback_data=f"edit_field:{template_key}:composer")
-            btn_lyrics = types.InlineKeyboardButton("كلمات الأغنية ✏️", callback_data=f"edit_field:{template_key}:lyrics")
-            btn_description = types.InlineKeyboardButton("الوصف ✏️", callback_data=f"edit_field:{template_key}:description")
-
-            btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="edit_template")
-
-            # إضافة الأزرار إلى لوحة المفاتيح
-            markup.add(btn_name)
-            markup.add(btn_artist, btn_album_artist)
-            markup.add(btn_album, btn_genre)
-            markup.add(btn_year, btn_publisher)
-            markup.add(btn_copyright)
-            markup.add(btn_comment, btn_website)
-            markup.add(btn_composer, btn_lyrics)
-            markup.add(btn_description)
-            markup.add(btn_back)
-
-            template = templates[template_key]
-            template_info = f"*تعديل قالب: {template['name']}*\n\n"
-            template_info += "اختر الحقل الذي ترغب في تعديله:"
 
-            bot.edit_message_text(
-                template_info,
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=markup,
-                parse_mode="Markdown"
-            )
-        else:
-            bot.edit_message_text(
-                "⚠️ *القالب غير موجود*\n\n"
-                "تعذر العثور على القالب المحدد.\n\n"
-                "يمكنك العودة إلى لوحة إدارة القوالب:",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_templates_keyboard(),
-                parse_mode="Markdown"
-            )
+# ==== إدارة القوالب ====
 
-    elif action.startswith("edit_field:"):
-        # تعديل حقل معين في قالب محدد
-        _, template_key, field_key = action.split(":", 2)
+@callback_route("manage_templates", panel="templates")
+def cb_manage_templates(call, user_id, action):
+    """عرض لوحة إدارة القوالب"""
+    bot.edit_message_text(
+        "🎛 *إدارة قوالب وسوم ID3*\n\n"
+        "يمكنك إدارة قوالب وسوم ID3 المستخدمة لتعديل الملفات الصوتية من خلال الأزرار أدناه:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=create_templates_keyboard(),
+        parse_mode="Markdown"
+    )
 
-        if template_key in templates:
-            # حفظ البيانات المؤقتة
-            temp_data[user_id] = {
-                "type": "template_edit",
-                "template_key": template_key,
-                "field_key": field_key
-            }
 
-            # الحصول على الاسم العربي للحقل
-            field_name = available_id3_tags.get(field_key, field_key)
+@callback_route("current_template", panel="templates")
+def cb_current_template(call, user_id, action):
+    """عرض القالب الحالي"""
+    template = templates[current_template_key]
+
+    # بناء معلومات القالب مع كافة الوسوم
+    template_info = (
+        f"🎵 *الاسم*: {template['name']}\n"
+        f"👤 *الفنان*: {template['artist']}\n"
+        f"👥 *فنان الألبوم*: {template['album_artist']}\n"
+        f"💿 *الألبوم*: {template['album']}\n"
+        f"🏷️ *النوع*: {template['genre']}\n"
+        f"📅 *السنة*: {template['year']}\n"
+        f"🏢 *الناشر*: {template['publisher']}\n"
+        f"©️ *حقوق النشر*: {template['copyright']}\n"
+    )
 
-            # الحصول على القيمة الحالية للحقل
-            current_value = templates[template_key].get(field_key, "")
+    # إضافة الوسوم الإضافية إذا كانت موجودة
+    if "comment" in template:
+        template_info += f"💬 *التعليق*: {template['comment']}\n"
 
-            bot.edit_message_text(
-                f"✏️ *تعديل حقل {field_name}*\n\n"
-                f"القيمة الحالية: {current_value}\n\n"
-                "الرجاء إرسال القيمة الجديدة:",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                parse_mode="Markdown"
-            )
+    if "website" in template:
+        template_info += f"🔗 *رابط الموقع*: {template['website']}\n"
+
+    if "composer" in template:
+        template_info += f"🎼 *الملحن*: {template['composer']}\n"
 
-            # تعيين حالة المستخدم
-            user_states[user_id] = STATE_AWAITING_TEMPLATE_FIELD
+    if "description" in template:
+        template_info += f"📝 *الوصف*: {template['description']}\n"
+
+    # إضافة كلمات الأغنية مع تنسيق خاص (مختصرة إذا كانت طويلة)
+    if "lyrics" in template:
+        lyrics = template["lyrics"]
+        # إذا كانت كلمات الأغنية طويلة، نعرض جزء منها فقط
+        if len(lyrics) > 50:
+            lyrics_preview = lyrics[:50] + "..."
+            template_info += f"📄 *كلمات الأغنية*: {lyrics_preview}\n"
         else:
-            bot.edit_message_text(
-                "⚠️ *القالب غير موجود*\n\n"
-                "تعذر العثور على القالب المحدد.\n\n"
-                "يمكنك العودة إلى لوحة إدارة القوالب:",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_templates_keyboard(),
-                parse_mode="Markdown"
-            )
+            template_info += f"📄 *كلمات الأغنية*: {lyrics}\n"
 
-    elif action == "list_templates":
-        # عرض قائمة بجميع القوالب المتوفرة
-        if not templates:
-            bot.edit_message_text(
-                "⚠️ *لا توجد قوالب متاحة*\n\n"
-                "يمكنك العودة إلى لوحة إدارة القوالب:",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_templates_keyboard(),
-                parse_mode="Markdown"
+    # إضافة سطر فارغ في النهاية
+    template_info += "\n"
+
+    # إنشاء لوحة مفاتيح للعودة
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_templates")
+    markup.add(btn_back)
+
+    bot.edit_message_text(
+        f"📌 *القالب الحالي*: {template['name']}\n\n"
+        f"{template_info}"
+        "يمكنك تغيير القالب الحالي من خلال زر 'تبديل القالب'",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=markup,
+        parse_mode="Markdown"
+    )
+
+
+@callback_route("switch_template", panel="templates")
+def cb_switch_template(call, user_id, action):
+    """تبديل القالب الحالي"""
+    markup = types.InlineKeyboardMarkup(row_width=1)
+
+    # إضافة أزرار لجميع القوالب المتاحة
+    for key, template in templates.items():
+        if key != current_template_key:
+            btn = types.InlineKeyboardButton(
+                f"{template['name']} ✅", 
+                callback_data=f"set_current_template:{key}"
             )
-            return
+            markup.add(btn)
+
+    btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_templates")
+    markup.add(btn_back)
+
+    bot.edit_message_text(
+        "🔄 *تبديل القالب الحالي*\n\n"
+        f"القالب الحالي: *{templates[current_template_key]['name']}*\n\n"
+        "الرجاء اختيار القالب الجديد:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=markup,
+        parse_mode="Markdown"
+    )
 
-        # إنشاء قائمة بالقوالب
-        templates_list = "📋 *قائمة القوالب المتاحة*:\n\n"
-
-        for key, template in templates.items():
-            current_mark = "✅ " if key == current_template_key else ""
-            templates_list += f"{current_mark}*{template['name']}*\n"
-            templates_list += f"👤 الفنان: {template['artist']}\n"
-            templates_list += f"💿 الألبوم: {template['album']}\n"
-            templates_list += f"🏷️ النوع: {template['genre']}\n"
-
-            # إضافة الوسوم الجديدة إذا كانت موجودة
-            if "comment" in template:
-                templates_list += f"💬 التعليق: {template['comment']}\n"
-            if "website" in template:
-                templates_list += f"🔗 الموقع: {template['website']}\n"
-            if "composer" in template:
-                templates_list += f"🎼 الملحن: {template['composer']}\n"
-            if "lyrics" in template:
-                lyrics_preview = template['lyrics'][:30] + "..." if len(template['lyrics']) > 30 else template['lyrics']
-                templates_list += f"📝 كلمات: {lyrics_preview}\n"
-
-            templates_list += "\n"
-
-        # إنشاء لوحة مفاتيح للعودة
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_templates")
-        markup.add(btn_back)
+
+@callback_prefix_route("set_current_template:", panel="templates")
+def cb_set_current_template(call, user_id, action):
+    """تعيين قالب محدد كقالب حالي"""
+    global current_template_key
+
+    template_key = action.split(":", 1)[1]
+
+    if template_key in templates:
+        # تحديث القالب الحالي
+        current_template_key = template_key
+        save_data()
 
         bot.edit_message_text(
-            templates_list,
+            f"✅ تم تعيين *{templates[current_template_key]['name']}* كالقالب الحالي بنجاح.\n\n"
+            "يمكنك العودة إلى لوحة إدارة القوالب:",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            reply_markup=markup,
+            reply_markup=create_templates_keyboard(),
             parse_mode="Markdown"
         )
 
-    elif action == "add_template":
-        # بدء عملية إضافة قالب جديد
-        temp_data[user_id] = {
-            "type": "template",
-            "template": {},
-            "current_field": None
-        }
+
+@callback_prefix_route("new_template_field:", panel="templates")
+def cb_new_template_field(call, user_id, action):
+    """تعديل حقل في قالب جديد"""
+    field_key = action.split(":", 1)[1]
+
+    if user_id in temp_data and temp_data[user_id]["type"] == "template":
+        # الحصول على الاسم العربي للحقل
+        field_name = available_id3_tags.get(field_key, field_key)
+
+        # حفظ الحقل الحالي
+        temp_data[user_id]["current_field"] = field_key
+
+        # الحصول على القيمة الحالية للحقل
+        current_value = temp_data[user_id]["template"].get(field_key, "")
 
         bot.edit_message_text(
-            "➕ *إضافة قالب جديد*\n\n"
-            "الرجاء إرسال اسم القالب الجديد:",
+            f"✏️ *تعديل حقل {field_name} في القالب الجديد*\n\n"
+            f"القيمة الحالية: {current_value}\n\n"
+            "الرجاء إرسال القيمة الجديدة:",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
             parse_mode="Markdown"
         )
 
         # تعيين حالة المستخدم
-        user_states[user_id] = STATE_AWAITING_TEMPLATE_NAME
+        user_states[user_id] = STATE_AWAITING_TEMPLATE_FIELD
+    else:
+        answer_callback(call, "⚠️ حدث خطأ في العملية. الرجاء المحاولة مرة أخرى.", show_alert=True)
 
-    elif action == "delete_template":
-        # عرض قائمة القوالب لاختيار قالب لحذفه
-        if len(templates) <= 1:
-            bot.edit_message_text(
-                "⚠️ *لا يمكن حذف جميع القوالب*\n\n"
-                "يجب أن يبقى قالب واحد على الأقل متاحاً.",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_templates_keyboard(),
-                parse_mode="Markdown"
-            )
-            return
 
-        # إنشاء لوحة مفاتيح للقوالب المتاحة للحذف
-        markup = types.InlineKeyboardMarkup(row_width=1)
+@callback_route("save_new_template", panel="templates")
+def cb_save_new_template(call, user_id, action):
+    """حفظ قالب جديد"""
+    if user_id in temp_data and temp_data[user_id]["type"] == "template" and "template" in temp_data[user_id]:
+        # إنشاء معرف فريد للقالب الجديد
+        template_key = temp_data[user_id]["template"]["name"]
 
-        for key, template in templates.items():
-            # لا نسمح بحذف القالب الحالي المستخدم
-            if key != current_template_key:
-                btn = types.InlineKeyboardButton(
-                    f"حذف: {template['name']} 🗑️", 
-                    callback_data=f"delete_template:{key}"
-                )
-                markup.add(btn)
+        # تحويل المعرف إلى نص عربي مناسب وتجنب التكرار
+        counter = 0
+        original_key = template_key
+        while template_key in templates:
+            counter += 1
+            template_key = f"{original_key}_{counter}"
 
-        btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_templates")
-        markup.add(btn_back)
+        # إضافة القالب الجديد
+        templates[template_key] = temp_data[user_id]["template"]
+        save_data()
+
+        # تنظيف البيانات المؤقتة
+        del temp_data[user_id]
 
         bot.edit_message_text(
-            "🗑️ *حذف قالب*\n\n"
-            "الرجاء اختيار القالب الذي ترغب في حذفه:",
+            f"✅ تم إضافة القالب الجديد *{templates[template_key]['name']}* بنجاح.\n\n"
+            "يمكنك العودة إلى لوحة إدارة القوالب:",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            reply_markup=markup,
+            reply_markup=create_templates_keyboard(),
             parse_mode="Markdown"
         )
+    else:
+        answer_callback(call, "⚠️ حدث خطأ في العملية. الرجاء المحاولة مرة أخرى.", show_alert=True)
 
-    elif action.startswith("delete_template:"):
-        # حذف قالب محدد
-        template_key = action.split(":", 1)[1]
-
-        if template_key in templates:
-            template_name = templates[template_key]["name"]
-            del templates[template_key]
 
-            bot.edit_message_text(
-                f"✅ تم حذف القالب *{template_name}* بنجاح.\n\n"
-                "يمكنك العودة إلى لوحة إدارة القوالب:",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_templates_keyboard(),
-                parse_mode="Markdown"
-            )
-        else:
-            bot.edit_message_text(
-                "⚠️ *القالب غير موجود*\n\n"
-                "تعذر العثور على القالب المحدد.\n\n"
-                "يمكنك العودة إلى لوحة إدارة القوالب:",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_templates_keyboard(),
-                parse_mode="Markdown"
-            )
+@callback_route("cancel_new_template", panel="templates")
+def cb_cancel_new_template(call, user_id, action):
+    """إلغاء إنشاء قالب جديد"""
+    if user_id in temp_data:
+        del temp_data[user_id]
+
+    bot.edit_message_text(
+        "❌ تم إلغاء إنشاء القالب الجديد.\n\n"
+        "يمكنك العودة إلى لوحة إدارة القوالب:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=create_templates_keyboard(),
+        parse_mode="Markdown"
+    )
 
-    elif action == "edit_template":
-        # عرض قائمة القوالب لاختيار قالب لتعديله
-        if not templates:
-            bot.edit_message_text(
-                "⚠️ *لا توجد قوالب متاحة للتعديل*\n\n"
-                "يمكنك إضافة قالب جديد باستخدام زر 'إضافة قالب جديد'.",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_templates_keyboard(),
-                parse_mode="Markdown"
-            )
-            return
 
-        # إنشاء لوحة مفاتيح للقوالب المتاحة للتعديل
-        markup = types.InlineKeyboardMarkup(row_width=1)
+@callback_prefix_route("edit_template:", panel="templates")
+def cb_edit_template_item(call, user_id, action):
+    """تحرير قالب محدد"""
+    template_key = action.split(":", 1)[1]
 
-        for key, template in templates.items():
-            btn = types.InlineKeyboardButton(
-                f"تعديل: {template['name']} ✏️", 
-                callback_data=f"edit_template:{key}"
-            )
-            markup.add(btn)
+    if template_key in templates:
+        # إنشاء لوحة مفاتيح لحقول القالب لتعديلها
+        markup = types.InlineKeyboardMarkup(row_width=2)
 
-        btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_templates")
+        # إضافة أزرار للحقول الأساسية
+        btn_name = types.InlineKeyboardButton("الاسم ✏️", callback_data=f"edit_field:{template_key}:name")
+        btn_artist = types.InlineKeyboardButton("الفنان ✏️", callback_data=f"edit_field:{template_key}:artist")
+        btn_album_artist = types.InlineKeyboardButton("فنان الألبوم ✏️", callback_data=f"edit_field:{template_key}:album_artist")
+        btn_album = types.InlineKeyboardButton("الألبوم ✏️", callback_data=f"edit_field:{template_key}:album")
+        btn_genre = types.InlineKeyboardButton("النوع ✏️", callback_data=f"edit_field:{template_key}:genre")
+        btn_year = types.InlineKeyboardButton("السنة ✏️", callback_data=f"edit_field:{template_key}:year")
+        btn_publisher = types.InlineKeyboardButton("الناشر ✏️", callback_data=f"edit_field:{template_key}:publisher")
+        btn_copyright = types.InlineKeyboardButton("حقوق النشر ✏️", callback_data=f"edit_field:{template_key}:copyright")
+
+        # إضافة أزرار للحقول الإضافية
+        btn_comment = types.InlineKeyboardButton("التعليق ✏️", callback_data=f"edit_field:{template_key}:comment")
+        btn_website = types.InlineKeyboardButton("الموقع ✏️", callback_data=f"edit_field:{template_key}:website")
+        btn_composer = types.InlineKeyboardButton("الملحن ✏️", callback_data=f"edit_field:{template_key}:composer")
+        btn_lyrics = types.InlineKeyboardButton("كلمات الأغنية ✏️", callback_data=f"edit_field:{template_key}:lyrics")
+        btn_description = types.InlineKeyboardButton("الوصف ✏️", callback_data=f"edit_field:{template_key}:description")
+
+        btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="edit_template")
+
+        # إضافة الأزرار إلى لوحة المفاتيح
+        markup.add(btn_name)
+        markup.add(btn_artist, btn_album_artist)
+        markup.add(btn_album, btn_genre)
+        markup.add(btn_year, btn_publisher)
+        markup.add(btn_copyright)
+        markup.add(btn_comment, btn_website)
+        markup.add(btn_composer, btn_lyrics)
+        markup.add(btn_description)
         markup.add(btn_back)
 
+        template = templates[template_key]
+        template_info = f"*تعديل قالب: {template['name']}*\n\n"
+        template_info += "اختر الحقل الذي ترغب في تعديله:"
+
         bot.edit_message_text(
-            "✏️ *تعديل قالب*\n\n"
-            "الرجاء اختيار القالب الذي ترغب في تعديله:",
+            template_info,
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
             reply_markup=markup,
             parse_mode="Markdown"
         )
+    else:
+        bot.edit_message_text(
+            "⚠️ *القالب غير موجود*\n\n"
+            "تعذر العثور على القالب المحدد.\n\n"
+            "يمكنك العودة إلى لوحة إدارة القوالب:",
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            reply_markup=create_templates_keyboard(),
+            parse_mode="Markdown"
+        )
+
+
+@callback_prefix_route("edit_field:", panel="templates")
+def cb_edit_field(call, user_id, action):
+    """تعديل حقل معين في قالب محدد"""
+    _, template_key, field_key = action.split(":", 2)
+
+    if template_key in templates:
+        # حفظ البيانات المؤقتة
+        temp_data[user_id] = {
+            "type": "template_edit",
+            "template_key": template_key,
+            "field_key": field_key
+        }
 
-    # ==== إدارة الاستبدالات ====
-    elif action == "manage_replacements":
-        # عرض لوحة إدارة الاستبدالات
-        status = "✅ مفعّل" if config["replacement_enabled"] else "❌ معطّل"
+        # الحصول على الاسم العربي للحقل
+        field_name = available_id3_tags.get(field_key, field_key)
+
+        # الحصول على القيمة الحالية للحقل
+        current_value = templates[template_key].get(field_key, "")
 
         bot.edit_message_text(
-            f"🔄 *إدارة الاستبدالات*\n\n"
-            f"حالة ميزة الاستبدال: {status}\n\n"
-            "يمكنك إدارة قواعد الاستبدال من خلال الأزرار أدناه:",
+            f"✏️ *تعديل حقل {field_name}*\n\n"
+            f"القيمة الحالية: {current_value}\n\n"
+            "الرجاء إرسال القيمة الجديدة:",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            reply_markup=create_replacements_keyboard(),
             parse_mode="Markdown"
         )
 
-    elif action == "add_replacement":
-        # بدء عملية إضافة قاعدة استبدال جديدة
-        temp_data[user_id] = {"type": "replacement"}
+        # تعيين حالة المستخدم
+        user_states[user_id] = STATE_AWAITING_TEMPLATE_FIELD
+    else:
+        bot.edit_message_text(
+            "⚠️ *القالب غير موجود*\n\n"
+            "تعذر العثور على القالب المحدد.\n\n"
+            "يمكنك العودة إلى لوحة إدارة القوالب:",
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            reply_markup=create_templates_keyboard(),
+            parse_mode="Markdown"
+        )
+
 
+@callback_route("list_templates", panel="templates")
+def cb_list_templates(call, user_id, action):
+    """عرض قائمة بجميع القوالب المتوفرة"""
+    if not templates:
         bot.edit_message_text(
-            "➕ *إضافة قاعدة استبدال جديدة*\n\n"
-            "الرجاء إرسال اسم قاعدة الاستبدال الجديدة:",
+            "⚠️ *لا توجد قوالب متاحة*\n\n"
+            "يمكنك العودة إلى لوحة إدارة القوالب:",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
+            reply_markup=create_templates_keyboard(),
             parse_mode="Markdown"
         )
+        return
 
-        # تعيين حالة المستخدم
-        user_states[user_id] = STATE_AWAITING_REPLACEMENT_NAME
+    # إنشاء قائمة بالقوالب
+    templates_list = "📋 *قائمة القوالب المتاحة*:\n\n"
 
-    elif action == "list_replacements":
-        # عرض قائمة بجميع قواعد الاستبدال المتوفرة
-        if not replacements:
-            bot.edit_message_text(
-                "⚠️ *لا توجد قواعد استبدال متاحة*\n\n"
-                "يمكنك إضافة قاعدة جديدة باستخدام زر 'إضافة استبدال'.",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_replacements_keyboard(),
-                parse_mode="Markdown"
-            )
-            return
+    for key, template in templates.items():
+        current_mark = "✅ " if key == current_template_key else ""
+        templates_list += f"{current_mark}*{template['name']}*\n"
+        templates_list += f"👤 الفنان: {template['artist']}\n"
+        templates_list += f"💿 الألبوم: {template['album']}\n"
+        templates_list += f"🏷️ النوع: {template['genre']}\n"
 
-        # إنشاء قائمة بقواعد الاستبدال
-        replacements_list = "📋 *قائمة قواعد الاستبدال المتاحة*:\n\n"
+        # إضافة الوسوم الجديدة إذا كانت موجودة
+        if "comment" in template:
+            templates_list += f"💬 التعليق: {template['comment']}\n"
+        if "website" in template:
+            templates_list += f"🔗 الموقع: {template['website']}\n"
+        if "composer" in template:
+            templates_list += f"🎼 الملحن: {template['composer']}\n"
+        if "lyrics" in template:
+            lyrics_preview = template['lyrics'][:30] + "..." if len(template['lyrics']) > 30 else template['lyrics']
+            templates_list += f"📝 كلمات: {lyrics_preview}\n"
 
-        for key, rule in replacements.items():
-            replacements_list += f"*{rule['name']}*\n"
-            replacements_list += f"النص الأصلي: {rule['original']}\n"
-            replacements_list += f"النص البديل: {rule['replacement']}\n"
+        templates_list += "\n"
 
-            # تحويل أسماء الوسوم إلى أسماء مفهومة بالعربية
-            tag_names = []
-            for tag in rule["tags"]:
-                arabic_name = available_id3_tags.get(tag, tag)
-                tag_names.append(arabic_name)
+    # إنشاء لوحة مفاتيح للعودة
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_templates")
+    markup.add(btn_back)
+
+    bot.edit_message_text(
+        templates_list,
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=markup,
+        parse_mode="Markdown"
+    )
 
-            replacements_list += f"الوسوم المطبقة: {', '.join(tag_names)}\n\n"
 
-        # إنشاء لوحة مفاتيح للعودة
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_replacements")
-        markup.add(btn_back)
+@callback_route("add_template", panel="templates")
+def cb_add_template(call, user_id, action):
+    """بدء عملية إضافة قالب جديد"""
+    temp_data[user_id] = {
+        "type": "template",
+        "template": {},
+        "current_field": None
+    }
 
+    bot.edit_message_text(
+        "➕ *إضافة قالب جديد*\n\n"
+        "الرجاء إرسال اسم القالب الجديد:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        parse_mode="Markdown"
+    )
+
+    # تعيين حالة المستخدم
+    user_states[user_id] = STATE_AWAITING_TEMPLATE_NAME
+
+
+@callback_route("delete_template", panel="templates")
+def cb_delete_template(call, user_id, action):
+    """عرض قائمة القوالب لاختيار قالب لحذفه"""
+    if len(templates) <= 1:
         bot.edit_message_text(
-            replacements_list,
+            "⚠️ *لا يمكن حذف جميع القوالب*\n\n"
+            "يجب أن يبقى قالب واحد على الأقل متاحاً.",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            reply_markup=markup,
+            reply_markup=create_templates_keyboard(),
             parse_mode="Markdown"
         )
+        return
 
-    elif action == "delete_replacement":
-        # عرض قائمة قواعد الاستبدال لاختيار قاعدة لحذفها
-        if not replacements:
-            bot.edit_message_text(
-                "⚠️ *لا توجد قواعد استبدال متاحة للحذف*\n\n"
-                "يمكنك إضافة قاعدة جديدة باستخدام زر 'إضافة استبدال'.",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_replacements_keyboard(),
-                parse_mode="Markdown"
-            )
-            return
-
-        # إنشاء لوحة مفاتيح لقواعد الاستبدال المتاحة للحذف
-        markup = types.InlineKeyboardMarkup(row_width=1)
+    # إنشاء لوحة مفاتيح للقوالب المتاحة للحذف
+    markup = types.InlineKeyboardMarkup(row_width=1)
 
-        for key, rule in replacements.items():
+    for key, template in templates.items():
+        # لا نسمح بحذف القالب الحالي المستخدم
+        if key != current_template_key:
             btn = types.InlineKeyboardButton(
-                f"حذف: {rule['name']} 🗑️", 
-                callback_data=f"delete_rule:{key}"
+                f"حذف: {template['name']} 🗑️", 
+                callback_data=f"delete_template:{key}"
             )
             markup.add(btn)
 
-        btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_replacements")
-        markup.add(btn_back)
-
-        bot.edit_message_text(
-            "🗑️ *حذف قاعدة استبدال*\n\n"
-            "الرجاء اختيار القاعدة التي ترغب في حذفها:",
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=markup,
-            parse_mode="Markdown"
-        )
-
-    elif action.startswith("delete_rule:"):
-        # حذف قاعدة استبدال محددة
-        rule_key = action.split(":", 1)[1]
+    btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_templates")
+    markup.add(btn_back)
 
-        if rule_key in replacements:
-            rule_name = replacements[rule_key]["name"]
-            del replacements[rule_key]
+    bot.edit_message_text(
+        "🗑️ *حذف قالب*\n\n"
+        "الرجاء اختيار القالب الذي ترغب في حذفه:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=markup,
+        parse_mode="Markdown"
+    )
 
-            bot.edit_message_text(
-                f"✅ تم حذف قاعدة الاستبدال *{rule_name}* بنجاح.\n\n"
-                "يمكنك العودة إلى لوحة إدارة الاستبدالات:",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_replacements_keyboard(),
-                parse_mode="Markdown"
-            )
-        else:
-            bot.edit_message_text(
-                "⚠️ *القاعدة غير موجودة*\n\n"
-                "تعذر العثور على قاعدة الاستبدال المحددة.\n\n"
-                "يمكنك العودة إلى لوحة إدارة الاستبدالات:",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_replacements_keyboard(),
-                parse_mode="Markdown"
-            )
 
-    elif action == "toggle_replacement":
-        # تفعيل أو تعطيل ميزة الاستبدال
-        config["replacement_enabled"] = not config["replacement_enabled"]
+@callback_prefix_route("delete_template:", panel="templates")
+def cb_delete_template_item(call, user_id, action):
+    """حذف قالب محدد"""
+    template_key = action.split(":", 1)[1]
 
-        status = "✅ مفعّل" if config["replacement_enabled"] else "❌ معطّل"
+    if template_key in templates:
+        template_name = templates[template_key]["name"]
+        del templates[template_key]
+        save_data()
 
         bot.edit_message_text(
-            f"🔄 *إدارة الاستبدالات*\n\n"
-            f"تم {('تفعيل' if config['replacement_enabled'] else 'تعطيل')} ميزة الاستبدال بنجاح.\n"
-            f"الحالة الحالية: {status}\n\n"
-            "يمكنك إدارة قواعد الاستبدال من خلال الأزرار أدناه:",
+            f"✅ تم حذف القالب *{template_name}* بنجاح.\n\n"
+            "يمكنك العودة إلى لوحة إدارة القوالب:",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            reply_markup=create_replacements_keyboard(),
+            reply_markup=create_templates_keyboard(),
             parse_mode="Markdown"
         )
-
-    # ==== إدارة التذييل ====
-    elif action == "manage_footers":
-        # عرض لوحة إدارة التذييلات
-        status = "✅ مفعّل" if config["footer_enabled"] else "❌ معطّل"
-
+    else:
         bot.edit_message_text(
-            f"📝 *إدارة التذييل*\n\n"
-            f"حالة ميزة التذييل: {status}\n\n"
-            "يمكنك إدارة التذييلات من خلال الأزرار أدناه:",
+            "⚠️ *القالب غير موجود*\n\n"
+            "تعذر العثور على القالب المحدد.\n\n"
+            "يمكنك العودة إلى لوحة إدارة القوالب:",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            reply_markup=create_footers_keyboard(),
+            reply_markup=create_templates_keyboard(),
             parse_mode="Markdown"
         )
 
-    elif action == "add_footer":
-        # بدء عملية إضافة تذييل جديد
-        temp_data[user_id] = {"type": "footer"}
 
+@callback_route("edit_template", panel="templates")
+def cb_edit_template(call, user_id, action):
+    """عرض قائمة القوالب لاختيار قالب لتعديله"""
+    if not templates:
         bot.edit_message_text(
-            "➕ *إضافة تذييل جديد*\n\n"
-            "الرجاء إرسال اسم التذييل الجديد:",
+            "⚠️ *لا توجد قوالب متاحة للتعديل*\n\n"
+            "يمكنك إضافة قالب جديد باستخدام زر 'إضافة قالب جديد'.",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
+            reply_markup=create_templates_keyboard(),
             parse_mode="Markdown"
         )
+        return
 
-        # تعيين حالة المستخدم
-        user_states[user_id] = STATE_AWAITING_FOOTER_NAME
+    # إنشاء لوحة مفاتيح للقوالب المتاحة للتعديل
+    markup = types.InlineKeyboardMarkup(row_width=1)
 
-    elif action == "list_footers":
-        # عرض قائمة بجميع التذييلات المتوفرة
-        if not footers:
-            bot.edit_message_text(
-                "⚠️ *لا توجد تذييلات متاحة*\n\n"
-                "يمكنك إضافة تذييل جديد باستخدام زر 'إضافة تذييل'.",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_footers_keyboard(),
-                parse_mode="Markdown"
-            )
-            return
+    for key, template in templates.items():
+        btn = types.InlineKeyboardButton(
+            f"تعديل: {template['name']} ✏️", 
+            callback_data=f"edit_template:{key}"
+        )
+        markup.add(btn)
 
-        # إنشاء قائمة بالتذييلات
-        footers_list = "📋 *قائمة التذييلات المتاحة*:\n\n"
+    btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_templates")
+    markup.add(btn_back)
 
-        for key, footer in footers.items():
-            footers_list += f"*{footer['name']}*\n"
-            footers_list += f"النص: {footer['text']}\n"
+    bot.edit_message_text(
+        "✏️ *تعديل قالب*\n\n"
+        "الرجاء اختيار القالب الذي ترغب في تعديله:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=markup,
+        parse_mode="Markdown"
+    )
 
-            # تحويل أسماء الوسوم إلى أسماء مفهومة بالعربية
-            tag_names = []
-            for tag in footer["tags"]:
-                arabic_name = available_id3_tags.get(tag, tag)
-                tag_names.append(arabic_name)
 
-            footers_list += f"الوسوم المطبقة: {', '.join(tag_names)}\n\n"
+# ==== إدارة الاستبدالات ====
 
-        # إنشاء لوحة مفاتيح للعودة
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_footers")
-        markup.add(btn_back)
+@callback_route("manage_replacements", panel="replacements")
+def cb_manage_replacements(call, user_id, action):
+    """عرض لوحة إدارة الاستبدالات"""
+    status = "✅ مفعّل" if config["replacement_enabled"] else "❌ معطّل"
 
-        bot.edit_message_text(
-            footers_list,
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=markup,
-            parse_mode="Markdown"
-        )
+    bot.edit_message_text(
+        f"🔄 *إدارة الاستبدالات*\n\n"
+        f"حالة ميزة الاستبدال: {status}\n\n"
+        "يمكنك إدارة قواعد الاستبدال من خلال الأزرار أدناه:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=create_replacements_keyboard(),
+        parse_mode="Markdown"
+    )
 
-    elif action == "delete_footer":
-        # عرض قائمة التذييلات لاختيار تذييل لحذفه
-        if not footers:
-            bot.edit_message_text(
-                "⚠️ *لا توجد تذييلات متاحة للحذف*\n\n"
-                "يمكنك إضافة تذييل جديد باستخدام زر 'إضافة تذييل'.",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_footers_keyboard(),
-                parse_mode="Markdown"
-            )
-            return
 
-        # إنشاء لوحة مفاتيح للتذييلات المتاحة للحذف
-        markup = types.InlineKeyboardMarkup(row_width=1)
+@callback_route("add_replacement", panel="replacements")
+@callback_route("add_regex_replacement", panel="replacements")
+def cb_add_replacement(call, user_id, action):
+    """بدء عملية إضافة قاعدة استبدال جديدة (نص عادي أو تعبير نمطي حسب الزر)"""
+    regex = action == "add_regex_replacement"
+    temp_data[user_id] = {"type": "replacement", "regex": regex}
 
-        for key, footer in footers.items():
-            btn = types.InlineKeyboardButton(
-                f"حذف: {footer['name']} 🗑️", 
-                callback_data=f"delete_footer:{key}"
-            )
-            markup.add(btn)
+    bot.edit_message_text(
+        f"➕ *إضافة قاعدة استبدال جديدة{' بتعبير نمطي' if regex else ''}*\n\n"
+        "الرجاء إرسال اسم قاعدة الاستبدال الجديدة:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        parse_mode="Markdown"
+    )
 
-        btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_footers")
-        markup.add(btn_back)
+    # تعيين حالة المستخدم
+    user_states[user_id] = STATE_AWAITING_REPLACEMENT_NAME
 
+
+@callback_route("list_replacements", panel="replacements")
+def cb_list_replacements(call, user_id, action):
+    """عرض قائمة بجميع قواعد الاستبدال المتوفرة"""
+    if not replacements:
         bot.edit_message_text(
-            "🗑️ *حذف تذييل*\n\n"
-            "الرجاء اختيار التذييل الذي ترغب في حذفه:",
+            "⚠️ *لا توجد قواعد استبدال متاحة*\n\n"
+            "يمكنك إضافة قاعدة جديدة باستخدام زر 'إضافة استبدال'.",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            reply_markup=markup,
+            reply_markup=create_replacements_keyboard(),
             parse_mode="Markdown"
         )
+        return
 
-    elif action.startswith("delete_footer:"):
-        # حذف تذييل محدد
-        footer_key = action.split(":", 1)[1]
+    # إنشاء قائمة بقواعد الاستبدال
+    replacements_list = "📋 *قائمة قواعد الاستبدال المتاحة*:\n\n"
 
-        if footer_key in footers:
-            footer_name = footers[footer_key]["name"]
-            del footers[footer_key]
+    for key, rule in replacements.items():
+        replacements_list += f"*{rule['name']}*\n"
+        replacements_list += f"{'التعبير النمطي' if rule.get('regex') else 'النص الأصلي'}: {rule['original']}\n"
+        replacements_list += f"النص البديل: {rule['replacement']}\n"
 
-            bot.edit_message_text(
-                f"✅ تم حذف التذييل *{footer_name}* بنجاح.\n\n"
-                "يمكنك العودة إلى لوحة إدارة التذييلات:",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_footers_keyboard(),
-                parse_mode="Markdown"
-            )
-        else:
-            bot.edit_message_text(
-                "⚠️ *التذييل غير موجود*\n\n"
-                "تعذر العثور على التذييل المحدد.\n\n"
-                "يمكنك العودة إلى لوحة إدارة التذييلات:",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_footers_keyboard(),
-                parse_mode="Markdown"
-            )
+        # تحويل أسماء الوسوم إلى أسماء مفهومة بالعربية
+        tag_names = []
+        for tag in rule["tags"]:
+            arabic_name = available_id3_tags.get(tag, tag)
+            tag_names.append(arabic_name)
+
+        replacements_list += f"الوسوم المطبقة: {', '.join(tag_names)}\n\n"
+
+    # إنشاء لوحة مفاتيح للعودة
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_replacements")
+    markup.add(btn_back)
 
-    elif action == "toggle_footer":
-        # تفعيل أو تعطيل ميزة التذييل
-        config["footer_enabled"] = not config["footer_enabled"]
+    bot.edit_message_text(
+        replacements_list,
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=markup,
+        parse_mode="Markdown"
+    )
 
-        status = "✅ مفعّل" if config["footer_enabled"] else "❌ معطّل"
 
+@callback_route("delete_replacement", panel="replacements")
+def cb_delete_replacement(call, user_id, action):
+    """عرض قائمة قواعد الاستبدال لاختيار قاعدة لحذفها"""
+    if not replacements:
         bot.edit_message_text(
-            f"📝 *إدارة التذييل*\n\n"
-            f"تم {('تفعيل' if config['footer_enabled'] else 'تعطيل')} ميزة التذييل بنجاح.\n"
-            f"الحالة الحالية: {status}\n\n"
-            "يمكنك إدارة التذييلات من خلال الأزرار أدناه:",
+            "⚠️ *لا توجد قواعد استبدال متاحة للحذف*\n\n"
+            "يمكنك إضافة قاعدة جديدة باستخدام زر 'إضافة استبدال'.",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            reply_markup=create_footers_keyboard(),
+            reply_markup=create_replacements_keyboard(),
             parse_mode="Markdown"
         )
+        return
 
-    # ==== إدارة حذف الروابط ====
-    elif action == "manage_links":
-        # عرض لوحة إدارة حذف الروابط
-        status = "✅ مفعّل" if config["remove_links_enabled"] else "❌ معطّل"
+    # إنشاء لوحة مفاتيح لقواعد الاستبدال المتاحة للحذف
+    markup = types.InlineKeyboardMarkup(row_width=1)
 
-        bot.edit_message_text(
-            f"🔗 *إدارة حذف الروابط*\n\n"
-            f"حالة ميزة حذف الروابط: {status}\n\n"
-            "يمكنك التحكم في ميزة حذف الروابط من خلال الأزرار أدناه:",
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=create_links_keyboard(),
-            parse_mode="Markdown"
+    for key, rule in replacements.items():
+        btn = types.InlineKeyboardButton(
+            f"حذف: {rule['name']} 🗑️", 
+            callback_data=f"delete_rule:{key}"
         )
+        markup.add(btn)
 
-    elif action == "toggle_links":
-        # تفعيل أو تعطيل ميزة حذف الروابط
-        config["remove_links_enabled"] = not config["remove_links_enabled"]
+    btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_replacements")
+    markup.add(btn_back)
+
+    bot.edit_message_text(
+        "🗑️ *حذف قاعدة استبدال*\n\n"
+        "الرجاء اختيار القاعدة التي ترغب في حذفها:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=markup,
+        parse_mode="Markdown"
+    )
 
-        status = "✅ مفعّل" if config["remove_links_enabled"] else "❌ معطّل"
 
-        bot.edit_message_text(
-            f"🔗 *إدارة حذف الروابط*\n\n"
-            f"تم {('تفعيل' if config['remove_links_enabled'] else 'تعطيل')} ميزة حذف الروابط بنجاح.\n"
-            f"الحالة الحالية: {status}\n\n"
-            "يمكنك التحكم في ميزة حذف الروابط من خلال الأزرار أدناه:",
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=create_links_keyboard(),
-            parse_mode="Markdown"
-        )
+@callback_prefix_route("delete_rule:", panel="replacements")
+def cb_delete_rule(call, user_id, action):
+    """حذف قاعدة استبدال محددة"""
+    rule_key = action.split(":", 1)[1]
 
-    # ==== إدارة صورة الألبوم ====
-    elif action == "manage_album_cover":
-        # عرض لوحة إدارة صورة الألبوم
-        status = "✅ مفعّل" if config["album_cover_enabled"] else "❌ معطّل"
+    if rule_key in replacements:
+        rule_name = replacements[rule_key]["name"]
+        rule_tags = replacements[rule_key]["tags"]
+        del replacements[rule_key]
+        invalidate_replacement_matchers(rule_tags)
+        save_data()
 
         bot.edit_message_text(
-            f"🖼️ *إدارة صورة الألبوم*\n\n"
-            f"حالة ميزة صورة الألبوم: {status}\n"
-            f"صورة الألبوم: {('✅ تم تعيينها' if album_cover_path else '❌ غير معينة')}\n\n"
-            "يمكنك إدارة صورة الألبوم من خلال الأزرار أدناه:",
+            f"✅ تم حذف قاعدة الاستبدال *{rule_name}* بنجاح.\n\n"
+            "يمكنك العودة إلى لوحة إدارة الاستبدالات:",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            reply_markup=create_album_cover_keyboard(),
+            reply_markup=create_replacements_keyboard(),
             parse_mode="Markdown"
         )
-
-    elif action == "set_album_cover":
-        # تعيين صورة الألبوم
+    else:
         bot.edit_message_text(
-            "🖼️ *تعيين صورة الألبوم*\n\n"
-            "الرجاء إرسال صورة لاستخدامها كصورة ألبوم.\n"
-            "يجب أن تكون الصورة بتنسيق JPG أو PNG.",
+            "⚠️ *القاعدة غير موجودة*\n\n"
+            "تعذر العثور على قاعدة الاستبدال المحددة.\n\n"
+            "يمكنك العودة إلى لوحة إدارة الاستبدالات:",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
+            reply_markup=create_replacements_keyboard(),
             parse_mode="Markdown"
         )
 
-        # تعيين حالة المستخدم
-        user_states[user_id] = STATE_AWAITING_ALBUM_COVER
 
-    elif action == "view_album_cover":
-        # عرض صورة الألبوم الحالية
-        if not album_cover_path:
-            bot.edit_message_text(
-                "⚠️ *لا توجد صورة ألبوم معينة*\n\n"
-                "يمكنك تعيين صورة جديدة باستخدام زر 'تعيين صورة'.",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_album_cover_keyboard(),
-                parse_mode="Markdown"
-            )
-            return
+@callback_route("toggle_replacement", panel="replacements")
+def cb_toggle_replacement(call, user_id, action):
+    """تفعيل أو تعطيل ميزة الاستبدال"""
+    config["replacement_enabled"] = not config["replacement_enabled"]
+    save_data()
 
-        try:
-            # إرسال الصورة الحالية
-            with open(album_cover_path, 'rb') as photo:
-                bot.send_photo(
-                    call.message.chat.id,
-                    photo,
-                    caption="🖼️ صورة الألبوم الحالية"
-                )
+    status = "✅ مفعّل" if config["replacement_enabled"] else "❌ معطّل"
 
-            # إعادة عرض لوحة التحكم
-            markup = types.InlineKeyboardMarkup(row_width=1)
-            btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_album_cover")
-            markup.add(btn_back)
+    bot.edit_message_text(
+        f"🔄 *إدارة الاستبدالات*\n\n"
+        f"تم {('تفعيل' if config['replacement_enabled'] else 'تعطيل')} ميزة الاستبدال بنجاح.\n"
+        f"الحالة الحالية: {status}\n\n"
+        "يمكنك إدارة قواعد الاستبدال من خلال الأزرار أدناه:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=create_replacements_keyboard(),
+        parse_mode="Markdown"
+    )
 
-            bot.send_message(
-                call.message.chat.id,
-                "يمكنك العودة إلى لوحة إدارة صورة الألبوم:",
-                reply_markup=markup
-            )
-        except Exception as e:
-            bot.edit_message_text(
-                f"⚠️ *خطأ في عرض الصورة*\n\n"
-                f"تعذر عرض صورة الألبوم: {str(e)}\n\n"
-                "يمكنك تعيين صورة جديدة باستخدام زر 'تعيين صورة'.",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_album_cover_keyboard(),
-                parse_mode="Markdown"
-            )
 
-    elif action == "delete_album_cover":
-        # حذف صورة الألبوم الحالية
-        if not album_cover_path:
-            bot.edit_message_text(
-                "⚠️ *لا توجد صورة ألبوم لحذفها*\n\n"
-                "يمكنك تعيين صورة جديدة باستخدام زر 'تعيين صورة'.",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_album_cover_keyboard(),
-                parse_mode="Markdown"
-            )
-            return
+# ==== إدارة التذييل ====
 
-        try:
-            # حذف الملف إذا كان موجودًا
-            if os.path.exists(album_cover_path):
-                os.remove(album_cover_path)
+@callback_route("manage_footers", panel="footers")
+def cb_manage_footers(call, user_id, action):
+    """عرض لوحة إدارة التذييلات"""
+    status = "✅ مفعّل" if config["footer_enabled"] else "❌ معطّل"
 
-            album_cover_path = None
+    bot.edit_message_text(
+        f"📝 *إدارة التذييل*\n\n"
+        f"حالة ميزة التذييل: {status}\n\n"
+        "يمكنك إدارة التذييلات من خلال الأزرار أدناه:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=create_footers_keyboard(),
+        parse_mode="Markdown"
+    )
 
-            bot.edit_message_text(
-                "✅ *تم حذف صورة الألبوم بنجاح*\n\n"
-                "يمكنك تعيين صورة جديدة باستخدام زر 'تعيين صورة'.",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_album_cover_keyboard(),
-                parse_mode="Markdown"
-            )
-        except Exception as e:
-            bot.edit_message_text(
-                f"⚠️ *خطأ في حذف الصورة*\n\n"
-                f"تعذر حذف صورة الألبوم: {str(e)}\n\n"
-                "يمكنك المحاولة مرة أخرى لاحقًا.",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=create_album_cover_keyboard(),
-                parse_mode="Markdown"
-            )
 
-    elif action == "toggle_album_cover":
-        # تفعيل أو تعطيل ميزة صورة الألبوم
-        config["album_cover_enabled"] = not config["album_cover_enabled"]
+@callback_route("add_footer", panel="footers")
+def cb_add_footer(call, user_id, action):
+    """بدء عملية إضافة تذييل جديد"""
+    temp_data[user_id] = {"type": "footer"}
+
+    bot.edit_message_text(
+        "➕ *إضافة تذييل جديد*\n\n"
+        "الرجاء إرسال اسم التذييل الجديد:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        parse_mode="Markdown"
+    )
+
+    # تعيين حالة المستخدم
+    user_states[user_id] = STATE_AWAITING_FOOTER_NAME
 
-        status = "✅ مفعّل" if config["album_cover_enabled"] else "❌ معطّل"
 
+@callback_route("list_footers", panel="footers")
+def cb_list_footers(call, user_id, action):
+    """عرض قائمة بجميع التذييلات المتوفرة"""
+    if not footers:
         bot.edit_message_text(
-            f"🖼️ *إدارة صورة الألبوم*\n\n"
-            f"تم {('تفعيل' if config['album_cover_enabled'] else 'تعطيل')} ميزة صورة الألبوم بنجاح.\n"
-            f"الحالة الحالية: {status}\n\n"
-            "يمكنك إدارة صورة الألبوم من خلال الأزرار أدناه:",
+            "⚠️ *لا توجد تذييلات متاحة*\n\n"
+            "يمكنك إضافة تذييل جديد باستخدام زر 'إضافة تذييل'.",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            reply_markup=create_album_cover_keyboard(),
+            reply_markup=create_footers_keyboard(),
             parse_mode="Markdown"
         )
+        return
 
-    # ==== تأكيد حذف البيانات ====
-    elif action == "confirm_reset":
-        # حذف جميع البيانات
-        reset_data()
-        
+    # إنشاء قائمة بالتذييلات
+    footers_list = "📋 *قائمة التذييلات المتاحة*:\n\n"
+
+    for key, footer in footers.items():
+        footers_list += f"*{footer['name']}*\n"
+        footers_list += f"النص: {footer['text']}\n"
+
+        # تحويل أسماء الوسوم إلى أسماء مفهومة بالعربية
+        tag_names = []
+        for tag in footer["tags"]:
+            arabic_name = available_id3_tags.get(tag, tag)
+            tag_names.append(arabic_name)
+
+        footers_list += f"الوسوم المطبقة: {', '.join(tag_names)}\n\n"
+
+    # إنشاء لوحة مفاتيح للعودة
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_footers")
+    markup.add(btn_back)
+
+    bot.edit_message_text(
+        footers_list,
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=markup,
+        parse_mode="Markdown"
+    )
+
+
+@callback_route("delete_footer", panel="footers")
+def cb_delete_footer(call, user_id, action):
+    """عرض قائمة التذييلات لاختيار تذييل لحذفه"""
+    if not footers:
         bot.edit_message_text(
-            "✅ تم حذف جميع البيانات وإعادة تعيينها إلى القيم الافتراضية بنجاح.\n"
-            "يمكنك الآن بدء إعداد البوت من جديد باستخدام /control",
+            "⚠️ *لا توجد تذييلات متاحة للحذف*\n\n"
+            "يمكنك إضافة تذييل جديد باستخدام زر 'إضافة تذييل'.",
             chat_id=call.message.chat.id,
-            message_id=call.message.message_id
+            message_id=call.message.message_id,
+            reply_markup=create_footers_keyboard(),
+            parse_mode="Markdown"
         )
-        
-    elif action == "cancel_reset":
-        # إلغاء عملية الحذف
-        bot.edit_message_text(
-            "❌ تم إلغاء عملية حذف البيانات.\n"
-            "لم يتم إجراء أي تغييرات على البيانات المخزنة.",
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id
+        return
+
+    # إنشاء لوحة مفاتيح للتذييلات المتاحة للحذف
+    markup = types.InlineKeyboardMarkup(row_width=1)
+
+    for key, footer in footers.items():
+        btn = types.InlineKeyboardButton(
+            f"حذف: {footer['name']} 🗑️", 
+            callback_data=f"delete_footer:{key}"
         )
+        markup.add(btn)
+
+    btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_footers")
+    markup.add(btn_back)
+
+    bot.edit_message_text(
+        "🗑️ *حذف تذييل*\n\n"
+        "الرجاء اختيار التذييل الذي ترغب في حذفه:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=markup,
+        parse_mode="Markdown"
+    )
 
-    # ==== تفعيل/تعطيل البوت ====
-    elif action == "toggle_bot":
-        # تفعيل أو تعطيل البوت بالكامل
-        config["bot_enabled"] = not config["bot_enabled"]
 
-        status = "✅ مفعّل" if config["bot_enabled"] else "❌ معطّل"
+@callback_prefix_route("delete_footer:", panel="footers")
+def cb_delete_footer_item(call, user_id, action):
+    """حذف تذييل محدد"""
+    footer_key = action.split(":", 1)[1]
+
+    if footer_key in footers:
+        footer_name = footers[footer_key]["name"]
+        del footers[footer_key]
+        save_data()
 
         bot.edit_message_text(
-            f"🤖 *حالة البوت*\n\n"
-            f"تم {('تفعيل' if config['bot_enabled'] else 'تعطيل')} البوت بنجاح.\n"
-            f"الحالة الحالية: {status}\n\n"
-            f"{'سيقوم البوت الآن بتنفيذ جميع عمليات التعديل على الملفات الصوتية.' if config['bot_enabled'] else 'لن يقوم البوت بتنفيذ أي عمليات تعديل على الملفات الصوتية. سيتم نقل الملفات فقط.'}\n\n"
-            "يمكنك العودة إلى لوحة التحكم الرئيسية:",
+            f"✅ تم حذف التذييل *{footer_name}* بنجاح.\n\n"
+            "يمكنك العودة إلى لوحة إدارة التذييلات:",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            reply_markup=create_control_panel_keyboard(),
+            reply_markup=create_footers_keyboard(),
             parse_mode="Markdown"
         )
-
-    elif action == "back_to_main":
-        # العودة إلى لوحة التحكم الرئيسية
+    else:
         bot.edit_message_text(
-            "🎛 *لوحة تحكم البوت*\n\n"
-            "يمكنك إدارة الإعدادات من خلال الأزرار أدناه:",
+            "⚠️ *التذييل غير موجود*\n\n"
+            "تعذر العثور على التذييل المحدد.\n\n"
+            "يمكنك العودة إلى لوحة إدارة التذييلات:",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            reply_markup=create_control_panel_keyboard(),
+            reply_markup=create_footers_keyboard(),
             parse_mode="Markdown"
         )
 
-    # ==== تبديل حالة اختيار الوسوم للاستبدال والتذييل ====
-    elif action.startswith("toggle_tag:"):
-        # تبديل حالة اختيار الوسم للاستبدال
-        tag_key = action.split(":", 1)[1]
 
-        # التحقق من وجود بيانات مؤقتة
-        if user_id in temp_data and "tags" in temp_data[user_id]:
-            # تبديل حالة الاختيار
-            if tag_key in temp_data[user_id]["tags"]:
-                temp_data[user_id]["tags"].remove(tag_key)
-            else:
-                temp_data[user_id]["tags"].append(tag_key)
+@callback_route("toggle_footer", panel="footers")
+def cb_toggle_footer(call, user_id, action):
+    """تفعيل أو تعطيل ميزة التذييل"""
+    config["footer_enabled"] = not config["footer_enabled"]
+    save_data()
 
-            # تحديث لوحة المفاتيح
-            markup = types.InlineKeyboardMarkup(row_width=2)
+    status = "✅ مفعّل" if config["footer_enabled"] else "❌ معطّل"
 
-            # إضافة أزرار لكل وسم
-            for tag_key_item, tag_name in available_id3_tags.items():
-                # تحديد حالة الزر (محدد أو غير محدد)
-                is_selected = tag_key_item in temp_data[user_id]["tags"]
-                status = "✅" if is_selected else "⬜"
+    bot.edit_message_text(
+        f"📝 *إدارة التذييل*\n\n"
+        f"تم {('تفعيل' if config['footer_enabled'] else 'تعطيل')} ميزة التذييل بنجاح.\n"
+        f"الحالة الحالية: {status}\n\n"
+        "يمكنك إدارة التذييلات من خلال الأزرار أدناه:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=create_footers_keyboard(),
+        parse_mode="Markdown"
+    )
 
-                btn = types.InlineKeyboardButton(
-                    f"{tag_name} {status}",
-                    callback_data=f"toggle_tag:{tag_key_item}"
-                )
-                markup.add(btn)
 
-            # إضافة أزرار الحفظ والإلغاء
-            btn_save = types.InlineKeyboardButton("حفظ قاعدة الاستبدال ✅", callback_data="save_replacement")
-            btn_cancel = types.InlineKeyboardButton("إلغاء ❌", callback_data="cancel_replacement")
-            markup.add(btn_save, btn_cancel)
+# ==== إدارة حذف الروابط ====
 
-            # تحديث الرسالة
-            bot.edit_message_reply_markup(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=markup
-            )
+def text_cleaning_status():
+    """حالة خيارات تنظيف النصوص كسطور تُعرض في لوحة حذف الروابط."""
+    return "".join(
+        f"{option_name}: {'✅ مفعّل' if config[option_key] else '❌ معطّل'}\n"
+        for option_key, option_name in TEXT_CLEANING_OPTIONS.items()
+    )
 
-    elif action.startswith("toggle_footer_tag:"):
-        # تبديل حالة اختيار الوسم للتذييل
-        tag_key = action.split(":", 1)[1]
 
-        # التحقق من وجود بيانات مؤقتة
-        if user_id in temp_data and "tags" in temp_data[user_id]:
-            # تبديل حالة الاختيار
-            if tag_key in temp_data[user_id]["tags"]:
-                temp_data[user_id]["tags"].remove(tag_key)
-            else:
-                temp_data[user_id]["tags"].append(tag_key)
+@callback_route("manage_links", panel="links")
+def cb_manage_links(call, user_id, action):
+    """عرض لوحة إدارة حذف الروابط"""
+    status = "✅ مفعّل" if config["remove_links_enabled"] else "❌ معطّل"
 
-            # تحديث لوحة المفاتيح
-            markup = types.InlineKeyboardMarkup(row_width=2)
+    bot.edit_message_text(
+        f"🔗 *إدارة حذف الروابط*\n\n"
+        f"حالة ميزة حذف الروابط: {status}\n"
+        f"{text_cleaning_status()}\n"
+        "يمكنك التحكم في ميزة حذف الروابط من خلال الأزرار أدناه:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=create_links_keyboard(),
+        parse_mode="Markdown"
+    )
 
-            # إضافة أزرار لكل وسم
-            for tag_key_item, tag_name in available_id3_tags.items():
-                # تحديد حالة الزر (محدد أو غير محدد)
-                is_selected = tag_key_item in temp_data[user_id]["tags"]
-                status = "✅" if is_selected else "⬜"
 
-                btn = types.InlineKeyboardButton(
-                    f"{tag_name} {status}",
-                    callback_data=f"toggle_footer_tag:{tag_key_item}"
-                )
-                markup.add(btn)
+@callback_route("toggle_links", panel="links")
+def cb_toggle_links(call, user_id, action):
+    """تفعيل أو تعطيل ميزة حذف الروابط"""
+    config["remove_links_enabled"] = not config["remove_links_enabled"]
+    save_data()
 
-            # إضافة أزرار الحفظ والإلغاء
-            btn_save = types.InlineKeyboardButton("حفظ التذييل ✅", callback_data="save_footer")
-            btn_cancel = types.InlineKeyboardButton("إلغاء ❌", callback_data="cancel_footer")
-            markup.add(btn_save, btn_cancel)
+    status = "✅ مفعّل" if config["remove_links_enabled"] else "❌ معطّل"
 
-            # تحديث الرسالة
-            bot.edit_message_reply_markup(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=markup
-            )
+    bot.edit_message_text(
+        f"🔗 *إدارة حذف الروابط*\n\n"
+        f"تم {('تفعيل' if config['remove_links_enabled'] else 'تعطيل')} ميزة حذف الروابط بنجاح.\n"
+        f"الحالة الحالية: {status}\n\n"
+        "يمكنك التحكم في ميزة حذف الروابط من خلال الأزرار أدناه:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=create_links_keyboard(),
+        parse_mode="Markdown"
+    )
 
-    # ==== حفظ وإلغاء الاستبدال والتذييل ====
-    elif action == "save_replacement":
-        # حفظ قاعدة الاستبدال الجديدة
-        # التحقق من وجود بيانات مؤقتة
-        if user_id in temp_data and "name" in temp_data[user_id] and "original" in temp_data[user_id] and "replacement" in temp_data[user_id]:
-            # التحقق من اختيار وسم واحد على الأقل
-            if "tags" in temp_data[user_id] and temp_data[user_id]["tags"]:
-                # إنشاء معرف فريد للقاعدة الجديدة
-                new_rule_id = str(len(replacements) + 1)
-                while new_rule_id in replacements:
-                    new_rule_id = str(int(new_rule_id) + 1)
-
-                # إنشاء قاعدة الاستبدال الجديدة
-                new_rule = {
-                    "name": temp_data[user_id]["name"],
-                    "original": temp_data[user_id]["original"],
-                    "replacement": temp_data[user_id]["replacement"],
-                    "tags": temp_data[user_id]["tags"]
-                }
-
-                # إضافة القاعدة إلى قواعد الاستبدال
-                replacements[new_rule_id] = new_rule
-
-                # تنظيف البيانات المؤقتة
-                del temp_data[user_id]
-
-                # إنشاء قائمة بأسماء الوسوم المحددة
-                tag_names = []
-                for tag in new_rule["tags"]:
-                    arabic_name = available_id3_tags.get(tag, tag)
-                    tag_names.append(arabic_name)
 
-                # إرسال رسالة تأكيد
-                bot.edit_message_text(
-                    f"✅ تم إضافة قاعدة الاستبدال بنجاح.\n\n"
-                    f"*الاسم*: {new_rule['name']}\n"
-                    f"*النص الأصلي*: {new_rule['original']}\n"
-                    f"*النص البديل*: {new_rule['replacement']}\n"
-                    f"*الوسوم المطبقة*: {', '.join(tag_names)}\n\n"
-                    "يمكنك العودة إلى لوحة إدارة الاستبدالات:",
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    reply_markup=create_replacements_keyboard(),
-                    parse_mode="Markdown"
-                )
-            else:
-                bot.answer_callback_query(call.id, "⚠️ الرجاء اختيار وسم واحد على الأقل.", show_alert=True)
-        else:
-            bot.answer_callback_query(call.id, "⚠️ البيانات غير مكتملة. الرجاء المحاولة مرة أخرى.", show_alert=True)
+@callback_prefix_route("toggle_text_option:", panel="links")
+def cb_toggle_text_option(call, user_id, action):
+    """تفعيل أو تعطيل أحد خيارات تنظيف النصوص"""
+    option_key = action.split(":", 1)[1]
+    if option_key not in TEXT_CLEANING_OPTIONS:
+        return
 
-    elif action == "cancel_replacement":
-        # إلغاء عملية إضافة قاعدة الاستبدال
-        if user_id in temp_data:
-            del temp_data[user_id]
+    config[option_key] = not config[option_key]
+    save_data()
+
+    bot.edit_message_text(
+        f"🔗 *إدارة حذف الروابط*\n\n"
+        f"تم {('تفعيل' if config[option_key] else 'تعطيل')} {TEXT_CLEANING_OPTIONS[option_key]} بنجاح.\n\n"
+        f"{text_cleaning_status()}\n"
+        "يمكنك التحكم في ميزة حذف الروابط من خلال الأزرار أدناه:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=create_links_keyboard(),
+        parse_mode="Markdown"
+    )
+
+
+# ==== إدارة صورة الألبوم ====
+
+@callback_route("manage_album_cover", panel="album_cover")
+def cb_manage_album_cover(call, user_id, action):
+    """عرض لوحة إدارة صورة الألبوم"""
+    status = "✅ مفعّل" if config["album_cover_enabled"] else "❌ معطّل"
+
+    bot.edit_message_text(
+        f"🖼️ *إدارة صورة الألبوم*\n\n"
+        f"حالة ميزة صورة الألبوم: {status}\n"
+        f"صورة الألبوم: {('✅ تم تعيينها' if album_cover_path else '❌ غير معينة')}\n\n"
+        "يمكنك إدارة صورة الألبوم من خلال الأزرار أدناه:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=create_album_cover_keyboard(),
+        parse_mode="Markdown"
+    )
+
+
+@callback_route("set_album_cover", panel="album_cover")
+def cb_set_album_cover(call, user_id, action):
+    """تعيين صورة الألبوم"""
+    bot.edit_message_text(
+        "🖼️ *تعيين صورة الألبوم*\n\n"
+        "الرجاء إرسال صورة لاستخدامها كصورة ألبوم.\n"
+        "يجب أن تكون الصورة بتنسيق JPG أو PNG.",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        parse_mode="Markdown"
+    )
+
+    # تعيين حالة المستخدم
+    user_states[user_id] = STATE_AWAITING_ALBUM_COVER
 
-        # إرسال رسالة تأكيد
+
+@callback_route("view_album_cover", panel="album_cover")
+def cb_view_album_cover(call, user_id, action):
+    """عرض صورة الألبوم الحالية"""
+    if not album_cover_path:
         bot.edit_message_text(
-            "❌ تم إلغاء عملية إضافة قاعدة الاستبدال.\n\n"
-            "يمكنك العودة إلى لوحة إدارة الاستبدالات:",
+            "⚠️ *لا توجد صورة ألبوم معينة*\n\n"
+            "يمكنك تعيين صورة جديدة باستخدام زر 'تعيين صورة'.",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            reply_markup=create_replacements_keyboard(),
+            reply_markup=create_album_cover_keyboard(),
             parse_mode="Markdown"
         )
+        return
 
-    elif action == "save_footer":
-        # حفظ التذييل الجديد
-        # التحقق من وجود بيانات مؤقتة
-        if user_id in temp_data and "name" in temp_data[user_id] and "text" in temp_data[user_id]:
-            # التحقق من اختيار وسم واحد على الأقل
-            if "tags" in temp_data[user_id] and temp_data[user_id]["tags"]:
-                # إنشاء معرف فريد للتذييل الجديد
-                new_footer_id = str(len(footers) + 1)
-                while new_footer_id in footers:
-                    new_footer_id = str(int(new_footer_id) + 1)
-
-                # إنشاء التذييل الجديد
-                new_footer = {
-                    "name": temp_data[user_id]["name"],
-                    "text": temp_data[user_id]["text"],
-                    "tags": temp_data[user_id]["tags"]
-                }
-
-                # إضافة التذييل إلى قائمة التذييلات
-                footers[new_footer_id] = new_footer
-
-                # تنظيف البيانات المؤقتة
-                del temp_data[user_id]
-
-                # إنشاء قائمة بأسماء الوسوم المحددة
-                tag_names = []
-                for tag in new_footer["tags"]:
-                    arabic_name = available_id3_tags.get(tag, tag)
-                    tag_names.append(arabic_name)
-
-                # إرسال رسالة تأكيد
-                bot.edit_message_text(
-                    f"✅ تم إضافة التذييل بنجاح.\n\n"
-                    f"*الاسم*: {new_footer['name']}\n"
-                    f"*النص*: {new_footer['text']}\n"
-                    f"*الوسوم المطبقة*: {', '.join(tag_names)}\n\n"
-                    "يمكنك العودة إلى لوحة إدارة التذييلات:",
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    reply_markup=create_footers_keyboard(),
-                    parse_mode="Markdown"
-                )
-            else:
-                bot.answer_callback_query(call.id, "⚠️ الرجاء اختيار وسم واحد على الأقل.", show_alert=True)
-        else:
-            bot.answer_callback_query(call.id, "⚠️ البيانات غير مكتملة. الرجاء المحاولة مرة أخرى.", show_alert=True)
+    try:
+        # إرسال الصورة الحالية
+        with open(album_cover_path, 'rb') as photo:
+            bot.send_photo(
+                call.message.chat.id,
+                photo,
+                caption="🖼️ صورة الألبوم الحالية"
+            )
 
-    elif action == "cancel_footer":
-        # إلغاء عملية إضافة التذييل
-        if user_id in temp_data:
-            del temp_data[user_id]
+        # إعادة عرض لوحة التحكم
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        btn_back = types.InlineKeyboardButton("العودة ↩️", callback_data="manage_album_cover")
+        markup.add(btn_back)
 
-        # إرسال رسالة تأكيد
+        bot.send_message(
+            call.message.chat.id,
+            "يمكنك العودة إلى لوحة إدارة صورة الألبوم:",
+            reply_markup=markup
+        )
+    except Exception as e:
         bot.edit_message_text(
-            "❌ تم إلغاء عملية إضافة التذييل.\n\n"
-            "يمكنك العودة إلى لوحة إدارة التذييلات:",
+            f"⚠️ *خطأ في عرض الصورة*\n\n"
+            f"تعذر عرض صورة الألبوم: {str(e)}\n\n"
+            "يمكنك تعيين صورة جديدة باستخدام زر 'تعيين صورة'.",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            reply_markup=create_footers_keyboard(),
+            reply_markup=create_album_cover_keyboard(),
             parse_mode="Markdown"
         )
 
-    # إخفاء مؤشر التحميل
-    bot.answer_callback_query(call.id)
-
 
-@bot.message_handler(func=lambda message: user_states.get(message.from_user.id) == STATE_AWAITING_SOURCE_CHANNEL)
-def process_source_channel(message):
-    """معالجة إدخال قناة المصدر"""
-    global SOURCE_CHANNEL
+@callback_route("delete_album_cover", panel="album_cover")
+def cb_delete_album_cover(call, user_id, action):
+    """حذف صورة الألبوم الحالية"""
+    global album_cover_path
 
-    user_id = message.from_user.id
+    if not album_cover_path:
+        bot.edit_message_text(
+            "⚠️ *لا توجد صورة ألبوم لحذفها*\n\n"
+            "يمكنك تعيين صورة جديدة باستخدام زر 'تعيين صورة'.",
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            reply_markup=create_album_cover_keyboard(),
+            parse_mode="Markdown"
+        )
+        return
+
+    try:
+        # حذف الملف إذا كان موجودًا
+        if os.path.exists(album_cover_path):
+            os.remove(album_cover_path)
+
+        invalidate_cover_cache(album_cover_path)
+        album_cover_path = None
+        save_data()
+
+        bot.edit_message_text(
+            "✅ *تم حذف صورة الألبوم بنجاح*\n\n"
+            "يمكنك تعيين صورة جديدة باستخدام زر 'تعيين صورة'.",
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            reply_markup=create_album_cover_keyboard(),
+            parse_mode="Markdown"
+        )
+    except Exception as e:
+        bot.edit_message_text(
+            f"⚠️ *خطأ في حذف الصورة*\n\n"
+            f"تعذر حذف صورة الألبوم: {str(e)}\n\n"
+            "يمكنك المحاولة مرة أخرى لاحقًا.",
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            reply_markup=create_album_cover_keyboard(),
+            parse_mode="Markdown"
+        )
+
+
+@callback_route("toggle_album_cover", panel="album_cover")
+def cb_toggle_album_cover(call, user_id, action):
+    """تفعيل أو تعطيل ميزة صورة الألبوم"""
+    config["album_cover_enabled"] = not config["album_cover_enabled"]
+    save_data()
+
+    status = "✅ مفعّل" if config["album_cover_enabled"] else "❌ معطّل"
+
+    bot.edit_message_text(
+        f"🖼️ *إدارة صورة الألبوم*\n\n"
+        f"تم {('تفعيل' if config['album_cover_enabled'] else 'تعطيل')} ميزة صورة الألبوم بنجاح.\n"
+        f"الحالة الحالية: {status}\n\n"
+        "يمكنك إدارة صورة الألبوم من خلال الأزرار أدناه:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=create_album_cover_keyboard(),
+        parse_mode="Markdown"
+    )
+
+
+# ==== تأكيد حذف البيانات ====
+
+@callback_route("confirm_reset", panel="main")
+def cb_confirm_reset(call, user_id, action):
+    """حذف جميع البيانات"""
+    reset_data()
+    save_data()
+
+    bot.edit_message_text(
+        "✅ تم حذف جميع البيانات وإعادة تعيينها إلى القيم الافتراضية بنجاح.\n"
+        "يمكنك الآن بدء إعداد البوت من جديد باستخدام /control",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id
+    )
+
+
+@callback_route("cancel_reset", panel="main")
+def cb_cancel_reset(call, user_id, action):
+    """إلغاء عملية الحذف"""
+    bot.edit_message_text(
+        "❌ تم إلغاء عملية حذف البيانات.\n"
+        "لم يتم إجراء أي تغييرات على البيانات المخزنة.",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id
+    )
+
+
+# ==== تفعيل/تعطيل البوت ====
+
+@callback_route("toggle_bot", panel="main")
+def cb_toggle_bot(call, user_id, action):
+    """تفعيل أو تعطيل البوت بالكامل"""
+    config["bot_enabled"] = not config["bot_enabled"]
+    save_data()
+
+    status = "✅ مفعّل" if config["bot_enabled"] else "❌ معطّل"
+
+    bot.edit_message_text(
+        f"🤖 *حالة البوت*\n\n"
+        f"تم {('تفعيل' if config['bot_enabled'] else 'تعطيل')} البوت بنجاح.\n"
+        f"الحالة الحالية: {status}\n\n"
+        f"{'سيقوم البوت الآن بتنفيذ جميع عمليات التعديل على الملفات الصوتية.' if config['bot_enabled'] else 'لن يقوم البوت بتنفيذ أي عمليات تعديل على الملفات الصوتية. سيتم نقل الملفات فقط.'}\n\n"
+        "يمكنك العودة إلى لوحة التحكم الرئيسية:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=create_control_panel_keyboard(),
+        parse_mode="Markdown"
+    )
+
+
+@callback_route("back_to_main", panel="main")
+def cb_back_to_main(call, user_id, action):
+    """العودة إلى لوحة التحكم الرئيسية"""
+    bot.edit_message_text(
+        "🎛 *لوحة تحكم البوت*\n\n"
+        "يمكنك إدارة الإعدادات من خلال الأزرار أدناه:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=create_control_panel_keyboard(),
+        parse_mode="Markdown"
+    )
+
+
+# ==== تبديل حالة اختيار الوسوم للاستبدال والتذييل ====
+
+@callback_prefix_route("toggle_tag:", panel="replacements")
+def cb_toggle_tag(call, user_id, action):
+    """تبديل حالة اختيار الوسم للاستبدال"""
+    tag_key = action.split(":", 1)[1]
+
+    # التحقق من وجود بيانات مؤقتة
+    if user_id in temp_data and "tags" in temp_data[user_id]:
+        # تبديل حالة الاختيار
+        if tag_key in temp_data[user_id]["tags"]:
+            temp_data[user_id]["tags"].remove(tag_key)
+        else:
+            temp_data[user_id]["tags"].append(tag_key)
+
+        # تحديث لوحة المفاتيح
+        markup = types.InlineKeyboardMarkup(row_width=2)
+
+        # إضافة أزرار لكل وسم
+        for tag_key_item, tag_name in available_id3_tags.items():
+            # تحديد حالة الزر (محدد أو غير محدد)
+            is_selected = tag_key_item in temp_data[user_id]["tags"]
+            status = "✅" if is_selected else "⬜"
+
+            btn = types.InlineKeyboardButton(
+                f"{tag_name} {status}",
+                callback_data=f"toggle_tag:{tag_key_item}"
+            )
+            markup.add(btn)
+
+        # إضافة أزرار الحفظ والإلغاء
+        btn_save = types.InlineKeyboardButton("حفظ قاعدة الاستبدال ✅", callback_data="save_replacement")
+        btn_cancel = types.InlineKeyboardButton("إلغاء ❌", callback_data="cancel_replacement")
+        markup.add(btn_save, btn_cancel)
+
+        # تحديث الرسالة
+        bot.edit_message_reply_markup(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            reply_markup=markup
+        )
+
+
+@callback_prefix_route("toggle_footer_tag:", panel="footers")
+def cb_toggle_footer_tag(call, user_id, action):
+    """تبديل حالة اختيار الوسم للتذييل"""
+    tag_key = action.split(":", 1)[1]
+
+    # التحقق من وجود بيانات مؤقتة
+    if user_id in temp_data and "tags" in temp_data[user_id]:
+        # تبديل حالة الاختيار
+        if tag_key in temp_data[user_id]["tags"]:
+            temp_data[user_id]["tags"].remove(tag_key)
+        else:
+            temp_data[user_id]["tags"].append(tag_key)
+
+        # تحديث لوحة المفاتيح
+        markup = types.InlineKeyboardMarkup(row_width=2)
+
+        # إضافة أزرار لكل وسم
+        for tag_key_item, tag_name in available_id3_tags.items():
+            # تحديد حالة الزر (محدد أو غير محدد)
+            is_selected = tag_key_item in temp_data[user_id]["tags"]
+            status = "✅" if is_selected else "⬜"
+
+            btn = types.InlineKeyboardButton(
+                f"{tag_name} {status}",
+                callback_data=f"toggle_footer_tag:{tag_key_item}"
+            )
+            markup.add(btn)
+
+        # إضافة أزرار الحفظ والإلغاء
+        btn_save = types.InlineKeyboardButton("حفظ التذييل ✅", callback_data="save_footer")
+        btn_cancel = types.InlineKeyboardButton("إلغاء ❌", callback_data="cancel_footer")
+        markup.add(btn_save, btn_cancel)
+
+        # تحديث الرسالة
+        bot.edit_message_reply_markup(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            reply_markup=markup
+        )
+
+
+# ==== حفظ وإلغاء الاستبدال والتذييل ====
+
+@callback_route("save_replacement", panel="replacements")
+def cb_save_replacement(call, user_id, action):
+    """حفظ قاعدة الاستبدال الجديدة"""
+    # التحقق من وجود بيانات مؤقتة
+    if user_id in temp_data and "name" in temp_data[user_id] and "original" in temp_data[user_id] and "replacement" in temp_data[user_id]:
+        # التحقق من اختيار وسم واحد على الأقل
+        if "tags" in temp_data[user_id] and temp_data[user_id]["tags"]:
+            # إنشاء معرف فريد للقاعدة الجديدة
+            new_rule_id = str(len(replacements) + 1)
+            while new_rule_id in replacements:
+                new_rule_id = str(int(new_rule_id) + 1)
+
+            # إنشاء قاعدة الاستبدال الجديدة
+            new_rule = {
+                "name": temp_data[user_id]["name"],
+                "original": temp_data[user_id]["original"],
+                "replacement": temp_data[user_id]["replacement"],
+                "tags": temp_data[user_id]["tags"]
+            }
+            if temp_data[user_id].get("regex"):
+                new_rule["regex"] = True
+
+            # إضافة القاعدة إلى قواعد الاستبدال
+            replacements[new_rule_id] = new_rule
+            invalidate_replacement_matchers(new_rule["tags"])
+            save_data()
+
+            # تنظيف البيانات المؤقتة
+            del temp_data[user_id]
+
+            # إنشاء قائمة بأسماء الوسوم المحددة
+            tag_names = []
+            for tag in new_rule["tags"]:
+                arabic_name = available_id3_tags.get(tag, tag)
+                tag_names.append(arabic_name)
+
+            # إرسال رسالة تأكيد
+            bot.edit_message_text(
+                f"✅ تم إضافة قاعدة الاستبدال بنجاح.\n\n"
+                f"*الاسم*: {new_rule['name']}\n"
+                f"*النص الأصلي*: {new_rule['original']}\n"
+                f"*النص البديل*: {new_rule['replacement']}\n"
+                f"*الوسوم المطبقة*: {', '.join(tag_names)}\n\n"
+                "يمكنك العودة إلى لوحة إدارة الاستبدالات:",
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                reply_markup=create_replacements_keyboard(),
+                parse_mode="Markdown"
+            )
+        else:
+            answer_callback(call, "⚠️ الرجاء اختيار وسم واحد على الأقل.", show_alert=True)
+    else:
+        answer_callback(call, "⚠️ البيانات غير مكتملة. الرجاء المحاولة مرة أخرى.", show_alert=True)
+
+
+@callback_route("cancel_replacement", panel="replacements")
+def cb_cancel_replacement(call, user_id, action):
+    """إلغاء عملية إضافة قاعدة الاستبدال"""
+    if user_id in temp_data:
+        del temp_data[user_id]
+
+    # إرسال رسالة تأكيد
+    bot.edit_message_text(
+        "❌ تم إلغاء عملية إضافة قاعدة الاستبدال.\n\n"
+        "يمكنك العودة إلى لوحة إدارة الاستبدالات:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=create_replacements_keyboard(),
+        parse_mode="Markdown"
+    )
+
+
+@callback_route("save_footer", panel="footers")
+def cb_save_footer(call, user_id, action):
+    """حفظ التذييل الجديد"""
+    # التحقق من وجود بيانات مؤقتة
+    if user_id in temp_data and "name" in temp_data[user_id] and "text" in temp_data[user_id]:
+        # التحقق من اختيار وسم واحد على الأقل
+        if "tags" in temp_data[user_id] and temp_data[user_id]["tags"]:
+            # إنشاء معرف فريد للتذييل الجديد
+            new_footer_id = str(len(footers) + 1)
+            while new_footer_id in footers:
+                new_footer_id = str(int(new_footer_id) + 1)
+
+            # إنشاء التذييل الجديد
+            new_footer = {
+                "name": temp_data[user_id]["name"],
+                "text": temp_data[user_id]["text"],
+                "tags": temp_data[user_id]["tags"]
+            }
+
+            # إضافة التذييل إلى قائمة التذييلات
+            footers[new_footer_id] = new_footer
+            save_data()
+
+            # تنظيف البيانات المؤقتة
+            del temp_data[user_id]
+
+            # إنشاء قائمة بأسماء الوسوم المحددة
+            tag_names = []
+            for tag in new_footer["tags"]:
+                arabic_name = available_id3_tags.get(tag, tag)
+                tag_names.append(arabic_name)
+
+            # إرسال رسالة تأكيد
+            bot.edit_message_text(
+                f"✅ تم إضافة التذييل بنجاح.\n\n"
+                f"*الاسم*: {new_footer['name']}\n"
+                f"*النص*: {new_footer['text']}\n"
+                f"*الوسوم المطبقة*: {', '.join(tag_names)}\n\n"
+                "يمكنك العودة إلى لوحة إدارة التذييلات:",
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                reply_markup=create_footers_keyboard(),
+                parse_mode="Markdown"
+            )
+        else:
+            answer_callback(call, "⚠️ الرجاء اختيار وسم واحد على الأقل.", show_alert=True)
+    else:
+        answer_callback(call, "⚠️ البيانات غير مكتملة. الرجاء المحاولة مرة أخرى.", show_alert=True)
+
+
+@callback_route("cancel_footer", panel="footers")
+def cb_cancel_footer(call, user_id, action):
+    """إلغاء عملية إضافة التذييل"""
+    if user_id in temp_data:
+        del temp_data[user_id]
+
+    # إرسال رسالة تأكيد
+    bot.edit_message_text(
+        "❌ تم إلغاء عملية إضافة التذييل.\n\n"
+        "يمكنك العودة إلى لوحة إدارة التذييلات:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=create_footers_keyboard(),
+        parse_mode="Markdown"
+    )
+
+
+@bot.message_handler(func=lambda message: user_states.get(message.from_user.id) == STATE_AWAITING_SOURCE_CHANNEL)
+def process_source_channel(message):
+    """معالجة إدخال قناة المصدر"""
+    global SOURCE_CHANNEL
+
+    user_id = message.from_user.id
 
     # التحقق مما إذا كان المستخدم هو المشرف
     if user_id != ADMIN_ID:
@@ -2100,12 +3810,17 @@ def process_source_channel(message):
     if channel_id not in user_channels[user_id]:
         user_channels[user_id].append(channel_id)
 
-    # تعيين قناة المصدر
+    # تعيين قناة المصدر (يمكن إدخال عدة قنوات مفصولة بفواصل)
     # إضافة @ للمعرف إذا لم يكن يبدأ بها وليس معرف رقمي
-    if not channel_id.startswith('@') and not channel_id.startswith('-100'):
-        channel_id = f"@{channel_id}"
-
-    SOURCE_CHANNEL = channel_id
+    channels = []
+    for channel in channel_id.split(","):
+        channel = channel.strip()
+        if channel and not channel.startswith('@') and not channel.startswith('-100'):
+            channel = f"@{channel}"
+        if channel:
+            channels.append(channel)
+
+    SOURCE_CHANNEL = ",".join(channels)
     save_data()
 
     # إعادة تعيين حالة المستخدم
@@ -2193,13 +3908,16 @@ def process_replacement_name(message):
         bot.reply_to(message, "⚠️ الرجاء إدخال اسم صالح لقاعدة الاستبدال.")
         return
 
-    # حفظ اسم القاعدة
+    # حفظ اسم القاعدة مع نوعها الذي اختاره المشرف من لوحة الاستبدالات
     replacement_name = message.text.strip()
-    temp_data[user_id] = {"name": replacement_name, "tags": []}
+    regex = temp_data.get(user_id, {}).get("regex", False)
+    temp_data[user_id] = {"name": replacement_name, "tags": [], "regex": regex}
 
     # طلب النص الأصلي
     bot.reply_to(
         message,
+        "تم حفظ اسم القاعدة. الآن الرجاء إرسال التعبير النمطي الذي ترغب في استبدال ما يطابقه:"
+        if regex else
         "تم حفظ اسم القاعدة. الآن الرجاء إرسال النص الأصلي الذي ترغب في استبداله:"
     )
 
@@ -2221,8 +3939,14 @@ def process_replacement_original(message):
         bot.reply_to(message, "⚠️ الرجاء إدخال نص أصلي صالح للاستبدال.")
         return
 
-    # حفظ النص الأصلي
+    # حفظ النص الأصلي (يُتحقق من صحته إذا كانت القاعدة تعبيراً نمطياً)
     original_text = message.text.strip()
+    if temp_data[user_id].get("regex"):
+        try:
+            re.compile(original_text)
+        except re.error as e:
+            bot.reply_to(message, f"⚠️ التعبير النمطي غير صالح: {e}\nالرجاء إرساله مرة أخرى.")
+            return
     temp_data[user_id]["original"] = original_text
 
     # طلب النص البديل
@@ -2249,8 +3973,14 @@ def process_replacement_new(message):
         bot.reply_to(message, "⚠️ الرجاء إدخال نص بديل صالح للاستبدال.")
         return
 
-    # حفظ النص البديل
+    # حفظ النص البديل (مع التعبير النمطي يجب أن تكون مراجع المجموعات مثل \1 صالحة)
     replacement_text = message.text.strip()
+    if temp_data[user_id].get("regex"):
+        try:
+            re.compile(temp_data[user_id]["original"]).sub(replacement_text, "")
+        except (re.error, IndexError) as e:
+            bot.reply_to(message, f"⚠️ النص البديل غير صالح لهذا التعبير النمطي: {e}\nالرجاء إرساله مرة أخرى.")
+            return
     temp_data[user_id]["replacement"] = replacement_text
 
     # إنشاء لوحة مفاتيح لاختيار الوسوم التي سيتم تطبيق الاستبدال عليها
@@ -2463,6 +4193,7 @@ def process_template_field(message):
             if template_key in templates:
                 # تحديث قيمة الحقل
                 templates[template_key][field_key] = field_value
+                save_data()
 
                 # الحصول على الاسم العربي للحقل
                 field_name = available_id3_tags.get(field_key, field_key)
@@ -2498,218 +4229,1399 @@ def process_template_field(message):
             field_key = temp_data[user_id]["current_field"]
             temp_data[user_id]["template"][field_key] = field_value
 
-            # الحصول على الاسم العربي للحقل
-            field_name = available_id3_tags.get(field_key, field_key)
+            # الحصول على الاسم العربي للحقل
+            field_name = available_id3_tags.get(field_key, field_key)
+
+            # إنشاء لوحة مفاتيح لاختيار الحقول للتعديل
+            markup = types.InlineKeyboardMarkup(row_width=2)
+
+            # إضافة أزرار لكل حقل
+            for field_key_item, field_name_item in available_id3_tags.items():
+                btn = types.InlineKeyboardButton(
+                    f"{field_name_item} ✏️",
+                    callback_data=f"new_template_field:{field_key_item}"
+                )
+                markup.add(btn)
+
+            # إضافة زر الحفظ والإلغاء
+            btn_save = types.InlineKeyboardButton("حفظ القالب ✅", callback_data="save_new_template")
+            btn_cancel = types.InlineKeyboardButton("إلغاء ❌", callback_data="cancel_new_template")
+            markup.add(btn_save, btn_cancel)
+
+            # تحديد نص الرسالة بناءً على ما إذا كانت القيمة فارغة
+            if is_empty_request:
+                confirmation_msg = (
+                    f"✅ تم إفراغ قيمة حقل {field_name} بنجاح.\n\n"
+                    "الآن سيتم الاحتفاظ بالقيمة الأصلية للوسم في الملفات الصوتية.\n\n"
+                    "يمكنك مواصلة تعديل حقول القالب أو حفظه:"
+                )
+            else:
+                confirmation_msg = (
+                    f"✅ تم تحديث حقل {field_name} بنجاح.\n\n"
+                    f"القيمة الجديدة: *{field_value}*\n\n"
+                    "يمكنك مواصلة تعديل حقول القالب أو حفظه:"
+                )
+
+            bot.send_message(
+                message.chat.id,
+                confirmation_msg,
+                reply_markup=markup,
+                parse_mode="Markdown"
+            )
+        else:
+            bot.reply_to(message, "⚠️ حدث خطأ في العملية. الرجاء المحاولة مرة أخرى.")
+    else:
+        bot.reply_to(message, "⚠️ لم يتم العثور على بيانات العملية. الرجاء بدء العملية من جديد.")
+
+    # إعادة تعيين حالة المستخدم
+    user_states.pop(user_id, None)
+
+
+@bot.message_handler(content_types=['photo'])
+def handle_photo(message):
+    """التعامل مع الصور المرسلة للبوت"""
+    global album_cover_path
+
+    user_id = message.from_user.id
+
+    # فحص الحالة الانتظار
+    if user_states.get(user_id) == STATE_AWAITING_ALBUM_COVER:
+        # التحقق مما إذا كان المستخدم هو المشرف
+        if user_id != ADMIN_ID:
+            bot.reply_to(message, "⛔ هذا الإجراء متاح للمشرفين فقط.")
+            return
+
+        # تحميل الصورة بأفضل جودة
+        file_id = message.photo[-1].file_id
+
+        try:
+            # تحميل الصورة من خادم تلجرام
+            file_info = bot.get_file(file_id)
+
+            # إنشاء دليل لحفظ الصور إذا لم يكن موجودًا
+            if not os.path.exists(ALBUM_COVERS_DIR):
+                os.makedirs(ALBUM_COVERS_DIR)
+
+            # تحديد مسار الملف واسمه
+            previous_cover_path = album_cover_path
+            album_cover_path = f"{ALBUM_COVERS_DIR}/album_cover_{int(time.time())}.jpg"
+
+            # تحميل الصورة وحفظها
+            fetch_telegram_file(file_info.file_path, album_cover_path)
+            invalidate_cover_cache()
+            save_data()
+
+            # حذف الصورة السابقة حتى لا يكبر مجلد الصور مع كل تغيير
+            if previous_cover_path and previous_cover_path != album_cover_path and os.path.exists(previous_cover_path):
+                os.remove(previous_cover_path)
+
+            # تأكيد نجاح العملية
+            bot.reply_to(
+                message,
+                f"✅ تم تعيين صورة الألبوم بنجاح!\n\n"
+                f"المسار: {album_cover_path}"
+            )
+
+            # عرض لوحة تحكم صورة الألبوم
+            markup = create_album_cover_keyboard()
+            bot.send_message(
+                message.chat.id,
+                "🖼️ *إدارة صورة الألبوم*\n\n"
+                "يمكنك إدارة صورة الألبوم من خلال الأزرار أدناه:",
+                reply_markup=markup,
+                parse_mode="Markdown"
+            )
+
+        except Exception as e:
+            bot.reply_to(
+                message, 
+                f"⚠️ حدث خطأ أثناء تحميل صورة الألبوم: {str(e)}"
+            )
+
+        # إعادة تعيين حالة المستخدم
+        user_states.pop(user_id, None)
+    else:
+        # في حالة عدم تحديد سياق معين، أخبر المستخدم أنك لا تعالج الصور بشكل عام
+        bot.reply_to(message, 
+            "هذا بوت لمعالجة الملفات الصوتية. لا يمكنني معالجة الصور إلا في سياق تعيين صورة للألبوم."
+        )
+
+
+# ==== معالجة الملفات الصوتية في الخلفية ====
+
+# قائمة انتظار محدودة الحجم للمهام، وحدود تزامن مستقلة لكل مرحلة
+audio_jobs = queue.Queue(maxsize=AUDIO_QUEUE_SIZE)
+download_slots = threading.BoundedSemaphore(DOWNLOAD_CONCURRENCY)
+tag_slots = threading.BoundedSemaphore(TAG_CONCURRENCY)
+upload_slots = threading.BoundedSemaphore(UPLOAD_CONCURRENCY)
+audio_workers = []
+
+
+# ==== حفظ المهام في قاعدة البيانات ====
+
+# تُحفظ المهام في Postgres إن وُجد، وإلا في ملف SQLite محلي
+jobs_sqlite = None
+jobs_sqlite_lock = threading.Lock()
+job_feeder_thread = None
+JOB_FEEDER_STOP = threading.Event()
+
+# الحقول الخاصة بالعملية الحالية ولا تُحفظ مع المهمة
+JOB_RUNTIME_KEYS = ("job_id", "attempt", "sequence", "album_recorded")
+
+# المهام المحجوزة لهذه العملية حالياً: معرف المهمة ← رقم المحاولة (يُحدث حجزها دورياً)
+held_jobs = {}
+held_jobs_lock = threading.Lock()
+
+
+def load_worker_id():
+    """قراءة معرف هذه النسخة من WORKER_ID_PATH، أو توليده وحفظه عند أول تشغيل.
+
+    اسم الجهاز يتغير مع كل إعادة تشغيل للحاوية، فلا يصلح لاستئناف مهام التشغيل السابق.
+    """
+    try:
+        with open(WORKER_ID_PATH, 'r', encoding='utf-8') as f:
+            worker_id = f.read().strip()
+        if worker_id:
+            return worker_id
+    except FileNotFoundError:
+        pass
+
+    worker_id = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+    try:
+        with open(WORKER_ID_PATH, 'w', encoding='utf-8') as f:
+            f.write(worker_id)
+        logger.info(f"تم توليد معرف جديد لهذه النسخة: {worker_id}")
+    except OSError as e:
+        logger.error(f"تعذر حفظ معرف النسخة في {WORKER_ID_PATH}، لن تُستأنف المهام بعد إعادة التشغيل: {e}")
+    return worker_id
+
+
+def init_worker_id():
+    """تحديد معرف هذه النسخة عند بدء التشغيل فقط، حتى لا يُنشئ استيراد الوحدة ملف المعرف."""
+    global WORKER_ID
+    if not WORKER_ID:
+        WORKER_ID = load_worker_id()
+        logger.info(f"معرف هذه النسخة: {WORKER_ID}")
+
+
+def hold_job(job):
+    """تسجيل أن المهمة محجوزة لهذه العملية حتى يستمر تحديث حجزها."""
+    with held_jobs_lock:
+        held_jobs[job["job_id"]] = job["attempt"]
+
+
+def drop_held_job(job):
+    """التوقف عن تحديث حجز المهمة بعد انتهائها أو إعادة جدولتها أو فقدان حجزها."""
+    if "job_id" not in job:
+        return
+    with held_jobs_lock:
+        if held_jobs.get(job["job_id"]) == job.get("attempt"):
+            held_jobs.pop(job["job_id"])
+
+
+def init_job_store():
+    """تجهيز ملف SQLite للمهام إذا لم تتوفر قاعدة بيانات Postgres."""
+    global jobs_sqlite
+
+    if connection_pool:
+        return
+
+    try:
+        jobs_sqlite = sqlite3.connect(JOBS_SQLITE_PATH, timeout=30, check_same_thread=False, isolation_level=None)
+        jobs_sqlite.execute("PRAGMA journal_mode=WAL")
+        jobs_sqlite.execute("""
+            CREATE TABLE IF NOT EXISTS audio_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                locked_by TEXT,
+                locked_at REAL,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        logger.info(f"سيتم حفظ المهام في الملف المحلي: {JOBS_SQLITE_PATH}")
+    except Exception as e:
+        logger.error(f"خطأ في تجهيز ملف المهام المحلي: {e}")
+        jobs_sqlite = None
+
+
+def job_store_available():
+    return bool(connection_pool) or jobs_sqlite is not None
+
+
+@contextmanager
+def job_store_cursor():
+    """مؤشر على مخزن المهام داخل معاملة واحدة (Postgres أو SQLite)."""
+    if connection_pool:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            try:
+                yield cur
+                conn.commit()
+            finally:
+                cur.close()
+    else:
+        with jobs_sqlite_lock:
+            cur = jobs_sqlite.cursor()
+            # BEGIN IMMEDIATE يحجز قفل الكتابة فوراً لمنع حجز نفس المهمة من عمليتين
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                yield cur
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+            finally:
+                cur.close()
+
+
+def job_sql(query):
+    """تحويل علامات المعاملات من صيغة psycopg2 إلى صيغة SQLite عند الحاجة."""
+    return query if connection_pool else query.replace("%s", "?")
+
+
+def insert_job(job, claim):
+    """حفظ مهمة جديدة. إذا كان claim صحيحاً تُحجز المهمة للعملية الحالية مباشرة."""
+    payload = json.dumps({key: value for key, value in job.items() if key not in JOB_RUNTIME_KEYS})
+    now = time.time()
+
+    with job_store_cursor() as cur:
+        cur.execute(job_sql("""
+            INSERT INTO audio_jobs (payload, attempts, next_attempt_at, locked_by, locked_at)
+            VALUES (%s, %s, %s, %s, %s)
+        """ + (" RETURNING id" if connection_pool else "")), (
+            payload,
+            1 if claim else 0,
+            now,
+            WORKER_ID if claim else None,
+            now if claim else None
+        ))
+        return cur.fetchone()[0] if connection_pool else cur.lastrowid
+
+
+def claim_next_job():
+    """حجز أقدم مهمة مستحقة (جديدة، أو موعد إعادة محاولتها، أو متروكة من عملية متوقفة)."""
+    now = time.time()
+    # مهام هذه العملية لا تُعتبر متروكة أبداً: المهام الجارية يُحدث حجزها باستمرار،
+    # وما تتركه العملية يُلغى حجزه في heartbeat_jobs
+    claimable = """
+        state NOT IN ('done', 'failed')
+        AND ((locked_by IS NULL AND next_attempt_at <= %s) OR (locked_at < %s AND locked_by <> %s))
+    """
+
+    with job_store_cursor() as cur:
+        if connection_pool:
+            # SKIP LOCKED يسمح لعدة نسخ من البوت بتقاسم المهام دون انتظار بعضها
+            cur.execute(f"""
+                UPDATE audio_jobs SET
+                    state = 'queued', attempts = attempts + 1,
+                    locked_by = %s, locked_at = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id FROM audio_jobs WHERE {claimable}
+                    ORDER BY next_attempt_at, id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, payload, attempts
+            """, (WORKER_ID, now, now, now - JOB_STALE_SECONDS, WORKER_ID))
+            row = cur.fetchone()
+        else:
+            cur.execute(job_sql(f"""
+                SELECT id, payload, attempts FROM audio_jobs WHERE {claimable}
+                ORDER BY next_attempt_at, id LIMIT 1
+            """), (now, now - JOB_STALE_SECONDS, WORKER_ID))
+            row = cur.fetchone()
+            if row:
+                cur.execute(job_sql("""
+                    UPDATE audio_jobs SET
+                        state = 'queued', attempts = attempts + 1,
+                        locked_by = %s, locked_at = %s, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                """), (WORKER_ID, now, row[0]))
+                row = (row[0], json.loads(row[1]), row[2] + 1)
+
+    if not row:
+        return None
+
+    job_id, payload, attempts = row
+    job = dict(payload)
+    job["job_id"] = job_id
+    job["attempt"] = attempts
+    hold_job(job)
+    return job
+
+
+def set_job_state(job, state):
+    """تحديث مرحلة المهمة. يعيد False إذا لم تعد هذه المحاولة مالكة للمهمة أو تعذر التحقق من ذلك."""
+    if "job_id" not in job:
+        return True
+
+    try:
+        with job_store_cursor() as cur:
+            cur.execute(job_sql("""
+                UPDATE audio_jobs SET state = %s, locked_at = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND locked_by = %s AND attempts = %s
+            """), (state, time.time(), job["job_id"], WORKER_ID, job["attempt"]))
+            return cur.rowcount == 1
+    except Exception as e:
+        # لا يمكن التأكد من الحجز، والمتابعة قد تنشر الملف مرتين
+        logger.error(f"خطأ في تحديث حالة المهمة {job['job_id']}: {e}")
+        return False
+
+
+def abandon_job(job):
+    """التوقف عن معالجة مهمة لم تعد محجوزة لهذه المحاولة.
+
+    إذا كان السبب خطأ في قاعدة البيانات يبقى الحجز باسم هذه النسخة، ويلغيه heartbeat_jobs
+    بعد JOB_STALE_SECONDS لتُعاد المحاولة.
+    """
+    logger.warning(f"تم إيقاف معالجة المهمة {job['job_id']} لأنها لم تعد محجوزة لهذه العملية")
+    drop_held_job(job)
+    add_album_item(job, None)
+
+
+def complete_job(job):
+    """تسجيل انتهاء المهمة بنجاح."""
+    if "job_id" not in job:
+        return
+
+    try:
+        with job_store_cursor() as cur:
+            cur.execute(job_sql("""
+                UPDATE audio_jobs SET state = 'done', locked_by = NULL, locked_at = NULL,
+                    last_error = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND locked_by = %s AND attempts = %s
+            """), (job["job_id"], WORKER_ID, job["attempt"]))
+    except Exception as e:
+        logger.error(f"خطأ في تسجيل انتهاء المهمة {job['job_id']}: {e}")
+    finally:
+        drop_held_job(job)
+
+
+def schedule_job_retry(job, error):
+    """جدولة إعادة المحاولة مع مضاعفة المهلة، أو تسجيل فشل المهمة نهائياً.
+
+    يعيد True إذا تمت جدولة إعادة المحاولة.
+    """
+    if "job_id" not in job:
+        return False
+
+    retry = job["attempt"] < JOB_MAX_ATTEMPTS
+    delay = min(JOB_RETRY_BASE * 2 ** (job["attempt"] - 1), JOB_RETRY_MAX)
+
+    try:
+        with job_store_cursor() as cur:
+            cur.execute(job_sql("""
+                UPDATE audio_jobs SET state = %s, next_attempt_at = %s, locked_by = NULL, locked_at = NULL,
+                    last_error = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND locked_by = %s AND attempts = %s
+            """), ("queued" if retry else "failed", time.time() + delay, str(error)[:1000],
+                   job["job_id"], WORKER_ID, job["attempt"]))
+    except Exception as e:
+        logger.error(f"خطأ في جدولة إعادة محاولة المهمة {job['job_id']}: {e}")
+        return False
+    finally:
+        drop_held_job(job)
+
+    if retry:
+        logger.info(f"ستتم إعادة محاولة المهمة {job['job_id']} بعد {delay:.0f} ثانية (المحاولة {job['attempt']})")
+    return retry
+
+
+def release_job(job):
+    """إلغاء حجز مهمة لم تبدأ معالجتها لتتمكن أي عملية من استلامها."""
+    try:
+        with job_store_cursor() as cur:
+            cur.execute(job_sql("""
+                UPDATE audio_jobs SET locked_by = NULL, locked_at = NULL, attempts = attempts - 1
+                WHERE id = %s AND locked_by = %s AND attempts = %s
+            """), (job["job_id"], WORKER_ID, job["attempt"]))
+    except Exception as e:
+        logger.error(f"خطأ في إلغاء حجز المهمة {job['job_id']}: {e}")
+    finally:
+        drop_held_job(job)
+
+
+def heartbeat_jobs():
+    """تحديث locked_at للمهام التي تحتفظ بها هذه العملية حتى لا تعتبرها النسخ الأخرى متروكة.
+
+    المهام المحجوزة باسم هذه النسخة ولم تعد العملية تحتفظ بها (مثلاً بعد خطأ في قاعدة
+    البيانات) يُلغى حجزها بعد JOB_STALE_SECONDS لتُعاد محاولتها.
+    """
+    now = time.time()
+    with held_jobs_lock:
+        held = list(held_jobs.items())
+
+    try:
+        with job_store_cursor() as cur:
+            if held:
+                cur.executemany(job_sql("""
+                    UPDATE audio_jobs SET locked_at = %s
+                    WHERE id = %s AND locked_by = %s AND attempts = %s
+                """), [(now, job_id, WORKER_ID, attempt) for job_id, attempt in held])
+
+            cur.execute(job_sql("""
+                UPDATE audio_jobs SET state = 'queued', locked_by = NULL, locked_at = NULL
+                WHERE locked_by = %s AND locked_at < %s AND state NOT IN ('done', 'failed')
+            """), (WORKER_ID, now - JOB_STALE_SECONDS))
+            if cur.rowcount:
+                logger.warning(f"تم إلغاء حجز {cur.rowcount} من المهام المتروكة في هذه النسخة")
+    except Exception as e:
+        logger.error(f"خطأ في تحديث حجز المهام الجارية: {e}")
+
+
+def recover_worker_jobs():
+    """إتاحة المهام التي توقفت معالجتها عند آخر إيقاف لهذه النسخة، وحذف المهام المنتهية القديمة."""
+    try:
+        with job_store_cursor() as cur:
+            cur.execute(job_sql("""
+                UPDATE audio_jobs SET state = 'queued', locked_by = NULL, locked_at = NULL
+                WHERE locked_by = %s AND state NOT IN ('done', 'failed')
+            """), (WORKER_ID,))
+            recovered = cur.rowcount
+
+            cur.execute(job_sql("""
+                DELETE FROM audio_jobs WHERE state IN ('done', 'failed') AND next_attempt_at < %s
+            """), (time.time() - JOB_RETENTION_DAYS * 86400,))
+
+        if recovered:
+            logger.info(f"تم استئناف {recovered} من المهام غير المكتملة")
+    except Exception as e:
+        logger.error(f"خطأ في استئناف المهام غير المكتملة: {e}")
+
+
+def get_job_counts():
+    """عدد المهام المحفوظة في كل حالة."""
+    if not job_store_available():
+        return {}
+
+    try:
+        with job_store_cursor() as cur:
+            cur.execute("SELECT state, COUNT(*) FROM audio_jobs GROUP BY state")
+            return dict(cur.fetchall())
+    except Exception as e:
+        logger.error(f"خطأ في قراءة إحصائيات المهام: {e}")
+        return {}
+
+
+def job_feeder():
+    """البحث دورياً عن المهام المستحقة وإضافتها لقائمة الانتظار المحلية، وتحديث حجز المهام الجارية."""
+    last_heartbeat = time.monotonic()
+    while True:
+        if time.monotonic() - last_heartbeat >= JOB_HEARTBEAT_INTERVAL:
+            heartbeat_jobs()
+            last_heartbeat = time.monotonic()
+
+        try:
+            # عدم حجز مهام أكثر مما تستطيع الخيوط معالجته قريباً
+            while audio_jobs.qsize() < AUDIO_WORKERS:
+                job = claim_next_job()
+                if job is None:
+                    break
+                # المهام المستأنفة لا تنتظر دور النشر الخاص بقناتها
+                audio_jobs.put(job)
+        except Exception as e:
+            logger.error(f"خطأ في البحث عن المهام المستحقة: {e}")
+
+        if JOB_FEEDER_STOP.wait(JOB_POLL_INTERVAL):
+            break
+
+
+def start_job_feeder():
+    """استئناف المهام غير المكتملة وتشغيل خيط البحث عن المهام المستحقة."""
+    global job_feeder_thread
+
+    init_worker_id()
+    init_job_store()
+    if not job_store_available():
+        logger.warning("لا يتوفر مخزن للمهام - لن يتم استئناف المهام بعد إعادة التشغيل")
+        return
+
+    recover_worker_jobs()
+    job_feeder_thread = threading.Thread(target=job_feeder, name="job-feeder", daemon=True)
+    job_feeder_thread.start()
+
+
+def stop_job_feeder(timeout=5):
+    JOB_FEEDER_STOP.set()
+    if job_feeder_thread:
+        job_feeder_thread.join(timeout)
+
+
+def enqueue_audio_job(job):
+    """حفظ المهمة وإضافتها إلى قائمة الانتظار. يعيد False إذا تعذر قبولها.
+
+    إذا كانت القائمة ممتلئة تبقى المهمة محفوظة دون حجز لتستلمها أي نسخة من البوت لاحقاً.
+    """
+    if job_store_available():
+        try:
+            job["job_id"] = insert_job(job, claim=True)
+            job["attempt"] = 1
+            hold_job(job)
+        except Exception as e:
+            logger.error(f"خطأ في حفظ المهمة: {e}")
+
+    try:
+        audio_jobs.put_nowait(job)
+        return True
+    except queue.Full:
+        # المهمة لن تُنشر بدورها في هذه العملية
+        finish_publish_turn(job)
+        if "job_id" in job:
+            release_job(job)
+            return True
+        return False
+
+
+# حالة كل رسالة حالة: النص المنتظر، آخر نص معروض، وقت آخر تعديل وآخر تحديث، ومؤقت التعديل التالي
+progress_states = {}
+progress_lock = threading.Lock()
+
+
+def report_progress(job, text, final=False):
+    """تحديث رسالة الحالة بحد أقصى تعديل واحد كل PROGRESS_EDIT_INTERVAL ثانية.
+
+    التحديثات المتتالية خلال الفاصل تُدمج ويُعرض آخرها فقط، والحالة النهائية تُرسل دائماً.
+    """
+    if not job.get("status_message_id"):
+        return
+
+    key = (job["chat_id"], job["status_message_id"])
+    with progress_lock:
+        state = progress_states.setdefault(key, {
+            "pending": None, "shown": None, "last_edit": 0.0, "updated": 0.0, "timer": None, "final": False
+        })
+        state["pending"] = text
+        state["updated"] = time.monotonic()
+        state["final"] = state["final"] or final
+        if state["timer"] is not None:
+            return
+
+        delay = max(0.0, state["last_edit"] + PROGRESS_EDIT_INTERVAL - time.monotonic())
+        state["timer"] = threading.Timer(delay, flush_progress, args=(key,))
+        state["timer"].daemon = True
+        state["timer"].start()
+
+
+def evict_stale_progress():
+    """حذف حالات الرسائل التي لن تصلها حالة نهائية (مهام متروكة أو فقدت ملكيتها) - يُستدعى مع progress_lock."""
+    cutoff = time.monotonic() - PROGRESS_STATE_TTL
+    for key in [key for key, state in progress_states.items() if state["timer"] is None and state["updated"] < cutoff]:
+        del progress_states[key]
+
+
+def flush_progress(key):
+    """تنفيذ التعديل المؤجل لرسالة الحالة."""
+    with progress_lock:
+        evict_stale_progress()
+        state = progress_states[key]
+        state["timer"] = None
+        text = state["pending"]
+
+        if state["final"]:
+            progress_states.pop(key)
+        elif chat_is_throttled(key[0]):
+            # الحالات المرحلية لا تستحق الانتظار، وستحل محلها الحالة التالية
+            return
+
+        if text == state["shown"]:
+            return
+        state["shown"] = text
+        state["last_edit"] = time.monotonic()
+
+    try:
+        send_telegram(key[0], PRIORITY_STATUS, bot.edit_message_text, text, chat_id=key[0], message_id=key[1])
+    except Exception as e:
+        logger.error(f"خطأ في تحديث رسالة الحالة: {e}")
+
+
+def update_job_status(job, text):
+    """عرض الحالة النهائية للمهمة في رسالة الحالة إن وجدت."""
+    report_progress(job, text, final=True)
+
+
+def acknowledge_job(job):
+    """إرسال رسالة الاستلام التي تُعرض فيها حالة المهمة (من خيط المعالجة وليس من معالج الرسالة)."""
+    if not job.pop("acknowledge", False) or job.get("status_message_id"):
+        return
+
+    try:
+        status = send_telegram(
+            job["chat_id"], PRIORITY_STATUS, bot.send_message,
+            job["chat_id"],
+            f"تم استلام الملف الصوتي: {job['file_name']}\n"
+            "جاري معالجة الملف...",
+            reply_to_message_id=job["message_id"]
+        )
+        job["status_message_id"] = status.message_id
+    except Exception as e:
+        logger.error(f"خطأ في إرسال رسالة استلام الملف: {e}")
+
+
+def notify_job_user(job, text):
+    """إرسال رسالة إلى المستخدم صاحب المهمة (لا شيء للمنشورات القادمة من القنوات)."""
+    if not job.get("user_id"):
+        return
+
+    try:
+        send_telegram(job["chat_id"], PRIORITY_STATUS, bot.send_message, job["chat_id"], text)
+    except Exception as e:
+        logger.error(f"خطأ في إرسال رسالة للمستخدم: {e}")
+
+
+def get_publish_destinations(job, title):
+    """قائمة الوجهات (المحادثة، الوصف) التي سيُنشر إليها الملف المعالج بالترتيب."""
+    destinations = []
+
+    # إعادة إرسال الملف للمستخدم صاحب الرسالة
+    if job["user_id"]:
+        destinations.append((job["chat_id"], f"تم معالجة الملف الصوتي: {job['file_name']}"))
+
+    # إعادة النشر في قنوات الهدف للمنشورات القادمة من القنوات أو من المشرف
+    if job["user_id"] is None or job["user_id"] == ADMIN_ID:
+        channel_caption = job["caption"] if job["caption"] else f"تم نشر الملف الصوتي: {title}"
+        for channel in [TARGET_CHANNEL] + EXTRA_TARGET_CHANNELS:
+            if channel and channel not in [dest for dest, _ in destinations]:
+                destinations.append((channel, channel_caption))
+
+    return destinations
+
+
+def publish_audio(job, file_path, title, performer, cached_file_id=None):
+    """رفع الملف المعالج مرة واحدة ثم إعادة إرساله لبقية الوجهات باستخدام file_id.
+
+    إذا مُرر cached_file_id يُرسل الملف المعالج مسبقاً مباشرة دون رفع.
+    يعيد file_id الخاص بالملف المرسل أو None إذا فشل الإرسال لجميع الوجهات.
+    """
+    uploaded_file_id = cached_file_id
+    delivered = False
+
+    for destination, caption in get_publish_destinations(job, title):
+        is_channel = destination != job["chat_id"]
+        priority = PRIORITY_PUBLISH if is_channel else PRIORITY_REPLY
+        try:
+            if uploaded_file_id is None:
+                # الرفع الفعلي يتم مرة واحدة فقط
+                with open(file_path, 'rb') as audio_file:
+                    sent = send_telegram(
+                        destination, priority, bot.send_audio,
+                        destination,
+                        audio_file,
+                        caption=caption,
+                        title=title,
+                        performer=performer,
+                    )
+                uploaded_file_id = sent.audio.file_id
+            else:
+                # بقية الوجهات تستخدم الملف المرفوع مسبقاً على خوادم تلجرام
+                send_telegram(destination, priority, bot.send_audio, destination, uploaded_file_id, caption=caption)
+            delivered = True
+
+            if is_channel:
+                logger.info(f"📢 تم إعادة نشر الملف الصوتي في القناة: {destination}")
+                notify_job_user(job, f"📢 تم إعادة نشر الملف الصوتي في القناة: {destination}")
+        except Exception as e:
+            if is_channel:
+                logger.error(f"خطأ في إعادة نشر الملف الصوتي إلى القناة {destination}: {e}")
+                notify_job_user(job, f"⚠️ حدث خطأ أثناء نشر الملف الصوتي في القناة: {str(e)}")
+            else:
+                logger.error(f"خطأ في إرسال الملف الصوتي المعالج: {e}")
+
+    return uploaded_file_id if delivered else None
+
+
+# ==== فهرس الملفات المعالجة مسبقاً ====
+
+# (file_unique_id، بصمة الإعدادات، العنوان) ← file_id للملف المعالج، الأقدم استخداماً أولاً
+dedup_index = OrderedDict()
+dedup_lock = threading.Lock()
+dedup_save_timer = None
+dedup_stats = {"hits": 0, "misses": 0}
+
+
+def get_dedup_key(job, title):
+    """مفتاح الفهرس: نفس الملف الأصلي بنفس الإعدادات ونفس العنوان ينتج نفس الملف."""
+    if not DEDUP_MAX_ENTRIES or not job.get("file_unique_id"):
+        return None
+
+    # رقم المسار جزء من الملف الناتج لملفات الألبومات
+    output_name = f"{title}\n{job.get('track_number') or ''}"
+    title_hash = hashlib.sha1(output_name.encode('utf-8')).hexdigest()[:12]
+    return f"{job['file_unique_id']}:{settings_fingerprint}:{title_hash}"
+
+
+def lookup_processed_file(key):
+    """البحث عن file_id لملف معالج مسبقاً بنفس المفتاح."""
+    if key is None:
+        return None
+
+    with dedup_lock:
+        file_id = dedup_index.get(key)
+        if file_id is None:
+            dedup_stats["misses"] += 1
+            return None
+        dedup_index.move_to_end(key)
+        dedup_stats["hits"] += 1
+        return file_id
+
+
+def remember_processed_file(key, file_id):
+    """إضافة ملف معالج إلى الفهرس مع حذف الأقدم استخداماً عند تجاوز الحد."""
+    if key is None or file_id is None:
+        return
+
+    with dedup_lock:
+        dedup_index[key] = file_id
+        dedup_index.move_to_end(key)
+        while len(dedup_index) > DEDUP_MAX_ENTRIES:
+            dedup_index.popitem(last=False)
+
+    schedule_dedup_save()
+
+
+def forget_processed_file(key):
+    """حذف مدخل لم يعد صالحاً (مثلاً إذا رفض تلجرام إعادة إرسال file_id)."""
+    if key is None:
+        return
+
+    with dedup_lock:
+        dedup_index.pop(key, None)
+
+    schedule_dedup_save()
+
+
+def schedule_dedup_save():
+    """جدولة حفظ الفهرس، مع دمج الإضافات المتتالية في عملية كتابة واحدة."""
+    global dedup_save_timer
+
+    with dedup_lock:
+        if dedup_save_timer is None:
+            dedup_save_timer = threading.Timer(DEDUP_SAVE_DEBOUNCE, save_dedup_index)
+            dedup_save_timer.daemon = True
+            dedup_save_timer.start()
+
+
+def save_dedup_index():
+    """كتابة الفهرس إلى الملف بشكل ذري."""
+    global dedup_save_timer
+
+    with dedup_lock:
+        dedup_save_timer = None
+        entries = list(dedup_index.items())
+
+    try:
+        temp_path = f"{DEDUP_INDEX_PATH}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(temp_path, DEDUP_INDEX_PATH)
+    except Exception as e:
+        logger.error(f"خطأ في حفظ فهرس الملفات المعالجة: {e}")
+
+
+def load_dedup_index():
+    """تحميل الفهرس المحفوظ من آخر تشغيل."""
+    if not DEDUP_MAX_ENTRIES:
+        return
+
+    try:
+        with open(DEDUP_INDEX_PATH, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        with dedup_lock:
+            dedup_index.clear()
+            dedup_index.update(entries[-DEDUP_MAX_ENTRIES:])
+        logger.info(f"تم تحميل {len(dedup_index)} من الملفات المعالجة مسبقاً")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"خطأ في تحميل فهرس الملفات المعالجة: {e}")
+
+
+# ==== استقبال الملفات من قنوات المصدر ====
+
+# حدود تزامن وترتيب النشر لكل قناة مصدر
+channel_slots = {}
+channel_sequences = {}
+channel_order = threading.Lock()
+# ناشر واحد لكل قناة في نفس الوقت، والقنوات المختلفة تُنشر بالتوازي
+channel_publishers = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix="channel-publisher")
+
+
+def get_source_channels():
+    """قائمة قنوات المصدر المعرفة في SOURCE_CHANNEL (يمكن فصل عدة قنوات بفواصل)."""
+    return [channel.strip() for channel in SOURCE_CHANNEL.split(",") if channel.strip()]
+
+
+def is_source_channel_post(message):
+    """التحقق من أن المنشور قادم من إحدى قنوات المصدر المعرفة.
+
+    لا يُتحقق من bot_enabled هنا: البوت المعطل ينقل منشورات القناة كما هي دون تعديل الوسوم.
+    """
+    chat = message.chat
+    identifiers = {str(chat.id)}
+    if chat.username:
+        identifiers.add(f"@{chat.username}".lower())
+
+    return any(channel.lower() in identifiers for channel in get_source_channels())
+
+
+def get_channel_slot(job):
+    """حد التزامن الخاص بقناة المصدر، أو سياق فارغ للملفات المرسلة مباشرة."""
+    channel_id = job.get("source_channel")
+    if channel_id is None:
+        return nullcontext()
+
+    with channel_order:
+        if channel_id not in channel_slots:
+            channel_slots[channel_id] = threading.BoundedSemaphore(CHANNEL_CONCURRENCY)
+        return channel_slots[channel_id]
+
+
+def assign_channel_sequence(channel_id):
+    """إعطاء المنشور رقماً تسلسلياً يحدد دوره في النشر داخل قناته."""
+    with channel_order:
+        state = channel_sequences.setdefault(channel_id, {
+            "next": 0, "turn": 0, "ready": {}, "draining": False, "timer": None
+        })
+        sequence = state["next"]
+        state["next"] += 1
+        return sequence
+
+
+def submit_for_publish(job, publish):
+    """تسليم مهمة جاهزة للنشر؛ publish دالة تنشر الملف وتحذف ملفاته المؤقتة.
+
+    منشورات قنوات المصدر تُضاف إلى قائمة النشر الخاصة بقناتها وتُنشر بترتيب وصولها،
+    فلا ينتظر خيط المعالجة دور المنشورات السابقة ويعود لاستلام المهمة التالية.
+    """
+    sequence = job.pop("sequence", None)
+    if sequence is None:
+        publish()
+        return
+
+    channel_id = job["source_channel"]
+    with channel_order:
+        state = channel_sequences[channel_id]
+        late = sequence < state["turn"]
+        if not late:
+            state["ready"][sequence] = publish
+
+    if late:
+        # تم تجاوز دور المنشور بعد انتهاء المهلة، فيُنشر فوراً خارج الترتيب
+        logger.warning(f"سيتم نشر الملف خارج الترتيب بعد تجاوز دوره: {job['file_name']}")
+        publish()
+        return
+
+    schedule_publish_queue(channel_id)
+
+
+def finish_publish_turn(job):
+    """تسجيل أن المنشور لن يُنشر بدوره (فشل أو نُشر ضمن ألبوم) ليتقدم دور المنشورات التالية."""
+    sequence = job.pop("sequence", None)
+    if sequence is None:
+        return
+
+    channel_id = job["source_channel"]
+    with channel_order:
+        state = channel_sequences[channel_id]
+        if sequence >= state["turn"]:
+            state["ready"][sequence] = None
+
+    schedule_publish_queue(channel_id)
+
+
+def schedule_publish_queue(channel_id):
+    """تشغيل ناشر القناة إذا كان دورها الحالي جاهزاً ولم يكن هناك ناشر يعمل عليها."""
+    with channel_order:
+        state = channel_sequences[channel_id]
+        if state["draining"] or state["turn"] not in state["ready"]:
+            arm_publish_timeout(channel_id, state)
+            return
+        state["draining"] = True
+
+    channel_publishers.submit(drain_publish_queue, channel_id)
+
+
+def arm_publish_timeout(channel_id, state):
+    """بدء مهلة تجاوز الدور إذا كانت هناك منشورات جاهزة تنتظر منشوراً سابقاً (يُستدعى مع channel_order)."""
+    if state["draining"] or not state["ready"] or state["timer"] is not None:
+        return
+    state["timer"] = threading.Timer(CHANNEL_ORDER_TIMEOUT, skip_publish_turn, args=(channel_id, state["turn"]))
+    state["timer"].daemon = True
+    state["timer"].start()
+
+
+def drain_publish_queue(channel_id):
+    """نشر المنشورات الجاهزة بالترتيب بدءاً من الدور الحالي حتى أول منشور لم يجهز بعد."""
+    while True:
+        with channel_order:
+            state = channel_sequences[channel_id]
+            if state["turn"] not in state["ready"]:
+                state["draining"] = False
+                arm_publish_timeout(channel_id, state)
+                return
+            publish = state["ready"].pop(state["turn"])
+            state["turn"] += 1
+            if state["timer"] is not None:
+                state["timer"].cancel()
+                state["timer"] = None
+
+        if publish is None:
+            continue
+        try:
+            publish()
+        except Exception as e:
+            logger.error(f"خطأ في نشر منشور القناة {channel_id}: {e}")
+
+
+def skip_publish_turn(channel_id, turn):
+    """تجاوز المنشورات المتأخرة أكثر من CHANNEL_ORDER_TIMEOUT حتى لا توقف نشر ما بعدها."""
+    with channel_order:
+        state = channel_sequences[channel_id]
+        state["timer"] = None
+        if state["draining"] or state["turn"] != turn or not state["ready"]:
+            return
+        state["turn"] = min(state["ready"])
+
+    logger.warning(f"انتهت مهلة انتظار دور النشر في القناة {channel_id}، سيتم نشر المنشورات المتأخرة خارج الترتيب")
+    schedule_publish_queue(channel_id)
+
+
+# ==== تجميع ملفات الألبومات ====
+
+# ملفات الألبوم التي لم يكتمل استلامها: (المحادثة:media_group_id) ← الملفات ومؤقت الانتظار
+media_group_buffers = {}
+# الألبومات قيد المعالجة: المفتاح ← عدد الملفات ونتيجة كل ملف ورسالة الحالة
+album_batches = {}
+media_group_lock = threading.Lock()
 
-            # إنشاء لوحة مفاتيح لاختيار الحقول للتعديل
-            markup = types.InlineKeyboardMarkup(row_width=2)
 
-            # إضافة أزرار لكل حقل
-            for field_key_item, field_name_item in available_id3_tags.items():
-                btn = types.InlineKeyboardButton(
-                    f"{field_name_item} ✏️",
-                    callback_data=f"new_template_field:{field_key_item}"
-                )
-                markup.add(btn)
+def buffer_media_group_job(job, media_group_id):
+    """تأجيل ملفات الألبوم حتى يكتمل استلامها (MEDIA_GROUP_WINDOW بعد آخر ملف)."""
+    key = f"{job['chat_id']}:{media_group_id}"
 
-            # إضافة زر الحفظ والإلغاء
-            btn_save = types.InlineKeyboardButton("حفظ القالب ✅", callback_data="save_new_template")
-            btn_cancel = types.InlineKeyboardButton("إلغاء ❌", callback_data="cancel_new_template")
-            markup.add(btn_save, btn_cancel)
+    with media_group_lock:
+        buffer = media_group_buffers.setdefault(key, {"jobs": [], "timer": None})
+        buffer["jobs"].append(job)
+        if buffer["timer"]:
+            buffer["timer"].cancel()
+        buffer["timer"] = threading.Timer(MEDIA_GROUP_WINDOW, flush_media_group, args=(key,))
+        buffer["timer"].daemon = True
+        buffer["timer"].start()
 
-            # تحديد نص الرسالة بناءً على ما إذا كانت القيمة فارغة
-            if is_empty_request:
-                confirmation_msg = (
-                    f"✅ تم إفراغ قيمة حقل {field_name} بنجاح.\n\n"
-                    "الآن سيتم الاحتفاظ بالقيمة الأصلية للوسم في الملفات الصوتية.\n\n"
-                    "يمكنك مواصلة تعديل حقول القالب أو حفظه:"
-                )
-            else:
-                confirmation_msg = (
-                    f"✅ تم تحديث حقل {field_name} بنجاح.\n\n"
-                    f"القيمة الجديدة: *{field_value}*\n\n"
-                    "يمكنك مواصلة تعديل حقول القالب أو حفظه:"
-                )
 
-            bot.send_message(
-                message.chat.id,
-                confirmation_msg,
-                reply_markup=markup,
-                parse_mode="Markdown"
+def flush_media_group(key):
+    """ترقيم ملفات الألبوم بترتيب إرسالها وإضافتها إلى قائمة المعالجة."""
+    with media_group_lock:
+        buffer = media_group_buffers.pop(key, None)
+    if not buffer:
+        return
+
+    jobs = sorted(buffer["jobs"], key=lambda job: job["message_id"])
+    total = len(jobs)
+    first = jobs[0]
+
+    # رسالة حالة واحدة للألبوم بدلاً من رسالة لكل ملف
+    status_message_id = None
+    if first["user_id"]:
+        try:
+            status = send_telegram(
+                first["chat_id"], PRIORITY_STATUS, bot.send_message,
+                first["chat_id"],
+                f"تم استلام ألبوم من {total} ملفات صوتية\nجاري معالجة الملفات...",
+                reply_to_message_id=first["message_id"]
             )
-        else:
-            bot.reply_to(message, "⚠️ حدث خطأ في العملية. الرجاء المحاولة مرة أخرى.")
-    else:
-        bot.reply_to(message, "⚠️ لم يتم العثور على بيانات العملية. الرجاء بدء العملية من جديد.")
+            status_message_id = status.message_id
+        except Exception as e:
+            logger.error(f"خطأ في إرسال رسالة حالة الألبوم: {e}")
 
-    # إعادة تعيين حالة المستخدم
-    user_states.pop(user_id, None)
+    logger.info(f"تم استلام ألبوم من {total} ملفات: {key}")
 
+    with media_group_lock:
+        album_batches[key] = {
+            "total": total,
+            "results": {},
+            "chat_id": first["chat_id"],
+            "status_message_id": status_message_id
+        }
 
-@bot.message_handler(content_types=['photo'])
-def handle_photo(message):
-    """التعامل مع الصور المرسلة للبوت"""
-    global album_cover_path
+    for index, job in enumerate(jobs, start=1):
+        job["media_group"] = key
+        job["album_index"] = index
+        job["track_number"] = f"{index}/{total}"
+        if not enqueue_audio_job(job):
+            logger.warning(f"قائمة انتظار المعالجة ممتلئة، تم رفض ملف الألبوم: {job['file_name']}")
+            add_album_item(job, None)
 
-    user_id = message.from_user.id
 
-    # فحص الحالة الانتظار
-    if user_states.get(user_id) == STATE_AWAITING_ALBUM_COVER:
-        # التحقق مما إذا كان المستخدم هو المشرف
-        if user_id != ADMIN_ID:
-            bot.reply_to(message, "⛔ هذا الإجراء متاح للمشرفين فقط.")
-            return
+def add_album_item(job, result):
+    """تسجيل نتيجة ملف من الألبوم (None عند الفشل)، ونشر الألبوم عند اكتمال جميع ملفاته.
 
-        # تحميل الصورة بأفضل جودة
-        file_id = message.photo[-1].file_id
+    يعيد False إذا لم تكن المهمة جزءاً من ألبوم قيد المعالجة في هذه العملية.
+    """
+    key = job.get("media_group")
+    if key is None or job.get("album_recorded"):
+        return False
 
-        try:
-            # تحميل الصورة من خادم تلجرام
-            file_info = bot.get_file(file_id)
-            file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file_info.file_path}"
+    with media_group_lock:
+        batch = album_batches.get(key)
+        if batch is None:
+            # ألبوم مستأنف بعد إعادة التشغيل: يُنشر كل ملف منفرداً
+            return False
+        job["album_recorded"] = True
+        batch["results"][job["album_index"]] = (job, result)
+        complete = len(batch["results"]) == batch["total"]
+        if complete:
+            album_batches.pop(key)
+
+    if complete:
+        # الألبوم يُنشر بدور آخر ملفاته اكتمالاً، وبقية ملفاته تتخلى عن أدوارها
+        submit_for_publish(job, lambda: publish_album(batch, job))
+    return True
+
+
+def send_album(items):
+    """رفع ملفات الألبوم كرسائل مجمعة ثم إعادة إرسالها لبقية الوجهات باستخدام file_id.
+
+    يعيد قائمة file_id لكل ملف، وقائمة بالملفات التي وصلت لوجهة واحدة على الأقل.
+    """
+    performer = templates[current_template_key]["artist"]
+    destinations = [get_publish_destinations(job, result["title"]) for job, result in items]
+    file_ids = [result.get("file_id") for _, result in items]
+    delivered = [False] * len(items)
+
+    for position, (destination, _) in enumerate(destinations[0]):
+        priority = PRIORITY_PUBLISH if destination != items[0][0]["chat_id"] else PRIORITY_REPLY
+        sent_here = False
+        for start in range(0, len(items), MEDIA_GROUP_MAX_ITEMS):
+            chunk = range(start, min(start + MEDIA_GROUP_MAX_ITEMS, len(items)))
+            try:
+                with ExitStack() as stack:
+                    media = []
+                    for index in chunk:
+                        source = file_ids[index] or stack.enter_context(open(items[index][1]["file_path"], 'rb'))
+                        media.append(types.InputMediaAudio(
+                            source,
+                            caption=destinations[index][position][1],
+                            title=items[index][1]["title"],
+                            performer=performer
+                        ))
+
+                    # الرسالة المجمعة تتطلب ملفين على الأقل
+                    if len(media) == 1:
+                        sent = [send_telegram(
+                            destination, priority, bot.send_audio,
+                            destination, media[0].media, caption=media[0].caption,
+                            title=media[0].title, performer=performer
+                        )]
+                    else:
+                        sent = send_telegram(destination, priority, bot.send_media_group, destination, media)
+
+                for index, message in zip(chunk, sent):
+                    file_ids[index] = message.audio.file_id
+                    delivered[index] = True
+                sent_here = True
+            except Exception as e:
+                logger.error(f"خطأ في نشر ملفات الألبوم إلى {destination}: {e}")
 
-            # إنشاء دليل لحفظ الصور إذا لم يكن موجودًا
-            if not os.path.exists("album_covers"):
-                os.makedirs("album_covers")
+        if sent_here and destination != items[0][0]["chat_id"]:
+            notify_job_user(items[0][0], f"📢 تم إعادة نشر الألبوم في القناة: {destination}")
 
-            # تحديد مسار الملف واسمه
-            album_cover_path = f"album_covers/album_cover_{int(time.time())}.jpg"
+    return file_ids, delivered
 
-            # تحميل الصورة وحفظها
-            response = requests.get(file_url)
-            with open(album_cover_path, 'wb') as file:
-                file.write(response.content)
 
-            # تأكيد نجاح العملية
-            bot.reply_to(
-                message,
-                f"✅ تم تعيين صورة الألبوم بنجاح!\n\n"
-                f"المسار: {album_cover_path}"
-            )
+def publish_album(batch, job):
+    """نشر ملفات الألبوم الناجحة معاً بترتيبها، وإعادة جدولة الملفات التي فشل نشرها."""
+    items = [(item_job, result) for _, (item_job, result) in sorted(batch["results"].items()) if result]
+    published = 0
+    pending = []
 
-            # عرض لوحة تحكم صورة الألبوم
-            markup = create_album_cover_keyboard()
-            bot.send_message(
-                message.chat.id,
-                "🖼️ *إدارة صورة الألبوم*\n\n"
-                "يمكنك إدارة صورة الألبوم من خلال الأزرار أدناه:",
-                reply_markup=markup,
-                parse_mode="Markdown"
-            )
+    try:
+        # الملفات التي استلمتها نسخة أخرى بعد اعتبارها متروكة لا تُنشر هنا
+        for item_job, result in items:
+            if set_job_state(item_job, "uploading"):
+                pending.append((item_job, result))
+            else:
+                abandon_job(item_job)
+
+        if pending:
+            with upload_slots:
+                file_ids, delivered = send_album(pending)
+
+            for (item_job, result), file_id, ok in zip(list(pending), file_ids, delivered):
+                pending.remove((item_job, result))
+                if not ok:
+                    if result.get("cached"):
+                        forget_processed_file(result["dedup_key"])
+                    schedule_job_retry(item_job, "فشل نشر ملف الألبوم")
+                    continue
+
+                published += 1
+                complete_job(item_job)
+                remember_processed_file(result["dedup_key"], file_id)
+                log_edit(item_job["file_name"], "audio_tags", {
+                    "title": result["title"],
+                    "template": current_template_key,
+                    "chat_id": item_job["chat_id"],
+                    "file_id": file_id,
+                    "track": item_job["track_number"]
+                }, item_job["user_id"])
+    except Exception as e:
+        logger.error(f"خطأ في نشر الألبوم: {e}")
+        # الملفات التي لم يُسجل نشرها تُعاد محاولتها بدلاً من بقائها محجوزة حتى انتهاء المهلة
+        for item_job, _ in pending:
+            schedule_job_retry(item_job, f"خطأ في نشر الألبوم: {e}")
+    finally:
+        for _, result in items:
+            cleanup_download(result.get("file_path"))
+
+    status_text = f"✅ تم معالجة الألبوم: {published} من {batch['total']} ملفات"
+    if published < batch["total"]:
+        status_text += "\n⚠️ سيتم إعادة محاولة الملفات التي فشلت معالجتها."
+    update_job_status({"chat_id": batch["chat_id"], "status_message_id": batch["status_message_id"]}, status_text)
+
+
+def fail_audio_job(job, status_text, error):
+    """تسجيل فشل المحاولة الحالية وجدولة إعادة المحاولة إن أمكن."""
+    logger.error(error)
+    if schedule_job_retry(job, error):
+        status_text += "\n🔄 ستتم إعادة المحاولة تلقائياً."
+    update_job_status(job, status_text)
+    add_album_item(job, None)
+
+
+def publish_processed_audio(job, file_path, title, dedup_key):
+    """رفع الملف بعد تعديل وسومه ونشره لجميع الوجهات، ثم حذف الملف المؤقت."""
+    file_name = job["file_name"]
+    current_template = templates[current_template_key]
 
-        except Exception as e:
-            bot.reply_to(
-                message, 
-                f"⚠️ حدث خطأ أثناء تحميل صورة الألبوم: {str(e)}"
-            )
+    try:
+        if not set_job_state(job, "uploading"):
+            abandon_job(job)
+            return
 
-        # إعادة تعيين حالة المستخدم
-        user_states.pop(user_id, None)
-    else:
-        # في حالة عدم تحديد سياق معين، أخبر المستخدم أنك لا تعالج الصور بشكل عام
-        bot.reply_to(message, 
-            "هذا بوت لمعالجة الملفات الصوتية. لا يمكنني معالجة الصور إلا في سياق تعيين صورة للألبوم."
+        report_progress(job, "⬆️ جاري رفع الملف الصوتي...")
+        with upload_slots:
+            uploaded_file_id = publish_audio(job, file_path, title, current_template["artist"])
+
+        if uploaded_file_id is None:
+            fail_audio_job(job, "⚠️ حدث خطأ أثناء رفع الملف الصوتي.",
+                           f"فشل رفع الملف الصوتي لجميع الوجهات: {file_name}")
+            return
+
+        complete_job(job)
+        remember_processed_file(dedup_key, uploaded_file_id)
+
+        log_edit(file_name, "audio_tags", {
+            "title": title,
+            "template": current_template_key,
+            "chat_id": job["chat_id"],
+            "file_id": uploaded_file_id
+        }, job["user_id"])
+
+        # إبلاغ المستخدم بالتعديلات التي تمت
+        update_job_status(
+            job,
+            f"✅ تم معالجة الملف الصوتي بنجاح!\n"
+            f"🎵 العنوان: {title}\n"
+            f"👤 الفنان: {current_template['artist']}\n"
+            f"💿 الألبوم: {current_template['album']}"
         )
+    except Exception as e:
+        fail_audio_job(job, f"⚠️ حدث خطأ أثناء رفع الملف الصوتي: {str(e)}",
+                       f"خطأ في رفع الملف الصوتي: {e}")
+    finally:
+        cleanup_download(file_path)
 
 
-@bot.message_handler(content_types=['audio'])
-def handle_audio(message):
-    """التعامل مع الملفات الصوتية المرسلة إلى البوت"""
-    audio = message.audio
-    user_id = message.from_user.id
-    first_name = message.from_user.first_name
+def publish_cached_audio(job, title, dedup_key, cached_file_id):
+    """نشر ملف معالج مسبقاً باستخدام file_id المحفوظ في الفهرس."""
+    current_template = templates[current_template_key]
+
+    # المهمة قد تكون استُلمت من نسخة أخرى بعد اعتبارها متروكة
+    if not set_job_state(job, "uploading"):
+        abandon_job(job)
+        return
+
+    uploaded_file_id = publish_audio(job, None, title, current_template["artist"], cached_file_id=cached_file_id)
 
-    logger.info(f"تم استلام ملف صوتي من {first_name} ({user_id}): {audio.file_name}")
+    if uploaded_file_id is None:
+        # المحاولة التالية ستعالج الملف من البداية
+        forget_processed_file(dedup_key)
+        fail_audio_job(job, "⚠️ حدث خطأ أثناء إرسال الملف الصوتي.",
+                       f"فشل إرسال الملف المعالج مسبقاً: {job['file_name']}")
+        return
 
-    # إخبار المستخدم بأننا نعالج الملف
-    processing_msg = bot.reply_to(message, 
-        f"تم استلام الملف الصوتي: {audio.file_name}\n"
-        "جاري معالجة الملف..."
+    complete_job(job)
+    log_edit(job["file_name"], "audio_tags", {
+        "title": title,
+        "template": current_template_key,
+        "chat_id": job["chat_id"],
+        "file_id": uploaded_file_id,
+        "cached": True
+    }, job["user_id"])
+
+    update_job_status(
+        job,
+        f"✅ تم إرسال الملف الصوتي المعالج مسبقاً!\n"
+        f"🎵 العنوان: {title}\n"
+        f"👤 الفنان: {current_template['artist']}\n"
+        f"💿 الألبوم: {current_template['album']}"
     )
 
+
+def publish_cached_job(job, title, dedup_key, cached_file_id):
+    """نشر ملف موجود على خوادم تلجرام دون رفعه: ضمن الألبوم أو بترتيب منشورات القناة."""
+    album_item = {"file_id": cached_file_id, "title": title, "dedup_key": dedup_key, "cached": True}
+    if not add_album_item(job, album_item):
+        submit_for_publish(job, lambda: publish_cached_audio(job, title, dedup_key, cached_file_id))
+
+
+def probe_job_tags(job, title, file_info):
+    """فحص وسوم الملف قبل تحميله. يعيد (مطابق للقالب، مسار الملف إن تم تحميله كاملاً).
+
+    يُستدعى بعد التحقق من ملكية المهمة وداخل حدود التزامن الخاصة بالقناة والتحميل.
+    """
+    extension = os.path.splitext(job["file_name"])[1].lower()
+    if not TAG_PROBE_ENABLED or not config["bot_enabled"] or extension not in ("", ".mp3"):
+        return False, None
+
     try:
-        # تحميل الملف الصوتي
-        file_path = download_file(audio.file_id)
+        tags, file_path = probe_audio_tags(file_info, job.get("media_group"))
+    except Exception as e:
+        logger.error(f"خطأ في فحص وسوم الملف: {e}")
+        return False, None
 
-        if not file_path:
-            bot.edit_message_text(
-                "⚠️ حدث خطأ أثناء تحميل الملف الصوتي.",
-                chat_id=message.chat.id,
-                message_id=processing_msg.message_id
-            )
-            return
+    if tags is not None and id3_tags_match(tags, title, job.get("track_number")):
+        cleanup_download(file_path)
+        with tag_write_lock:
+            tag_write_stats["unchanged"] += 1
+        logger.info(f"وسوم الملف مطابقة للقالب، سيتم نشره كما هو: {job['file_name']}")
+        return True, None
 
-        # استخراج العنوان من وصف الرسالة أو اسم الملف
-        title = message.caption if message.caption else os.path.splitext(audio.file_name)[0]
+    return False, file_path
 
-        # معالجة وسوم الملف الصوتي
-        success = process_audio_tags(file_path, title)
 
-        if success:
-            # إعادة إرسال الملف مع الوسوم المعدلة
-            with open(file_path, 'rb') as audio_file:
-                current_template = templates[current_template_key]
-                bot.send_audio(
-                    message.chat.id,
-                    audio_file,
-                    caption=f"تم معالجة الملف الصوتي: {audio.file_name}",
-                    title=title,
-                    performer=current_template["artist"],
-                )
+def process_audio_job(job):
+    """تنفيذ مراحل المعالجة (تحميل ← تعديل الوسوم ← رفع) لمهمة واحدة."""
+    file_name = job["file_name"]
+    file_path = None
 
-            # إبلاغ المستخدم بالتعديلات التي تمت
-            bot.edit_message_text(
-                f"✅ تم معالجة الملف الصوتي بنجاح!\n"
-                f"🎵 العنوان: {title}\n"
-                f"👤 الفنان: {current_template['artist']}\n"
-                f"💿 الألبوم: {current_template['album']}",
-                chat_id=message.chat.id,
-                message_id=processing_msg.message_id
-            )
+    # استخراج العنوان من وصف الرسالة أو اسم الملف
+    title = job["caption"] if job["caption"] else os.path.splitext(file_name)[0]
 
-            # إذا كان المستخدم هو المشرف، إعادة نشر الملف إلى القناة المستهدفة
-            if user_id == ADMIN_ID and TARGET_CHANNEL:
-                try:
-                    with open(file_path, 'rb') as audio_file:
-                        bot.send_audio(
-                            TARGET_CHANNEL,
-                            audio_file,
-                            caption=message.caption if message.caption else f"تم نشر الملف الصوتي: {title}",
-                            title=title,
-                            performer=current_template["artist"],
-                        )
-                    bot.send_message(
-                        message.chat.id,
-                        f"📢 تم إعادة نشر الملف الصوتي في القناة: {TARGET_CHANNEL}"
-                    )
-                except Exception as e:
-                    logger.error(f"خطأ في إعادة نشر الملف الصوتي إلى القناة: {e}")
-                    bot.send_message(
-                        message.chat.id,
-                        f"⚠️ حدث خطأ أثناء نشر الملف الصوتي في القناة: {str(e)}"
+    try:
+        acknowledge_job(job)
+
+        # الملف نفسه عولج مسبقاً بنفس الإعدادات: إعادة إرساله مباشرة دون تحميل أو رفع
+        dedup_key = get_dedup_key(job, title)
+        cached_file_id = lookup_processed_file(dedup_key)
+
+        if cached_file_id:
+            publish_cached_job(job, title, dedup_key, cached_file_id)
+            return
+
+        # فحص الوسوم والتحميل وتعديل الوسوم ضمن حد التزامن الخاص بقناة المصدر
+        with get_channel_slot(job):
+            # المهمة قد تكون استُلمت من نسخة أخرى بعد اعتبارها متروكة
+            if not set_job_state(job, "downloading"):
+                abandon_job(job)
+                return
+
+            report_progress(job, "⬇️ جاري تحميل الملف الصوتي...")
+            with download_slots:
+                # طلب getFile واحد يُستخدم لفحص الوسوم ثم للتحميل
+                file_info = bot.get_file(job["file_id"])
+
+                # الملف يحمل وسوم القالب مسبقاً: يُنشر الملف الأصلي كما هو دون تحميل
+                unchanged, file_path = probe_job_tags(job, title, file_info)
+
+                # تحميل الملف الصوتي (إلا إذا تم تحميله كاملاً أثناء فحص الوسوم)
+                if not unchanged and not file_path:
+                    file_path = download_file(
+                        file_info,
+                        lambda done, total: report_progress(job, f"⬇️ جاري تحميل الملف الصوتي... {done * 100 // total}%"),
+                        job.get("media_group")
                     )
-        else:
-            bot.edit_message_text(
-                "⚠️ حدث خطأ أثناء معالجة وسوم الملف الصوتي.",
-                chat_id=message.chat.id,
-                message_id=processing_msg.message_id
-            )
+
+            if not unchanged:
+                if not file_path:
+                    fail_audio_job(job, "⚠️ حدث خطأ أثناء تحميل الملف الصوتي.",
+                                   f"حدث خطأ أثناء تحميل الملف الصوتي: {file_name}")
+                    return
+
+                # معالجة وسوم الملف الصوتي
+                set_job_state(job, "tagging")
+                report_progress(job, "🏷 جاري تعديل وسوم الملف الصوتي...")
+                with tag_slots:
+                    success = process_audio_tags(file_path, title, job.get("track_number"))
+
+                if not success:
+                    fail_audio_job(job, "⚠️ حدث خطأ أثناء معالجة وسوم الملف الصوتي.",
+                                   f"حدث خطأ أثناء معالجة وسوم الملف الصوتي: {file_name}")
+                    return
+
+        # النشر خارج حد تزامن القناة حتى لا يشغل الرفع مكان تحميل آخر
+        if unchanged:
+            publish_cached_job(job, title, dedup_key, job["file_id"])
+            return
+
+        # ملفات الألبوم تُنشر معاً بعد اكتمال معالجتها، والناشر يحذف ملفاتها المؤقتة
+        if add_album_item(job, {"file_path": file_path, "title": title, "dedup_key": dedup_key}):
+            file_path = None
+            return
+
+        # منشورات القناة الواحدة تُنشر بنفس ترتيب وصولها، والناشر يحذف الملف المؤقت
+        processed_path, file_path = file_path, None
+        submit_for_publish(job, lambda: publish_processed_audio(job, processed_path, title, dedup_key))
     except Exception as e:
-        logger.error(f"خطأ في معالجة الملف الصوتي: {e}")
-        bot.edit_message_text(
-            f"⚠️ حدث خطأ أثناء معالجة الملف الصوتي: {str(e)}",
-            chat_id=message.chat.id,
-            message_id=processing_msg.message_id
-        )
+        fail_audio_job(job, f"⚠️ حدث خطأ أثناء معالجة الملف الصوتي: {str(e)}",
+                       f"خطأ في معالجة الملف الصوتي: {e}")
+    finally:
+        finish_publish_turn(job)
+        # حذف الملف المؤقت بعد انتهاء المهمة
+        cleanup_download(file_path)
+
+
+def audio_worker():
+    """خيط معالجة يسحب المهام من قائمة الانتظار حتى يستلم إشارة الإيقاف."""
+    while True:
+        job = audio_jobs.get()
+        try:
+            if job is None:
+                break
+            process_audio_job(job)
+        except Exception as e:
+            logger.error(f"خطأ غير متوقع في خيط المعالجة: {e}")
+        finally:
+            audio_jobs.task_done()
+
+
+def start_audio_workers():
+    """تشغيل خيوط معالجة الملفات الصوتية."""
+    for index in range(AUDIO_WORKERS):
+        worker = threading.Thread(target=audio_worker, name=f"audio-worker-{index + 1}", daemon=True)
+        worker.start()
+        audio_workers.append(worker)
+
+    logger.info(f"تم تشغيل {AUDIO_WORKERS} من خيوط معالجة الملفات الصوتية")
+
+
+def stop_audio_workers(timeout=None):
+    """إيقاف خيوط المعالجة بعد إنهاء المهام الموجودة في قائمة الانتظار."""
+    for _ in audio_workers:
+        audio_jobs.put(None)
+    for worker in audio_workers:
+        worker.join(timeout)
+    audio_workers.clear()
 
 
-@bot.message_handler(func=lambda message: True)
-def echo_all(message):
-    """الرد على جميع الرسائل الأخرى"""
-    bot.reply_to(message, "هذا بوت لمعالجة الملفات الصوتية. أرسل /help للمساعدة.")
 @bot.message_handler(content_types=['audio'])
 def handle_audio(message):
-    """التعامل مع الملفات الصوتية المرسلة إلى البوت أو القناة"""
+    """استلام الملفات الصوتية المرسلة إلى البوت وإضافتها إلى قائمة المعالجة"""
     audio = message.audio
 
     # دعم channel_post (من القناة) حيث لا يوجد from_user
@@ -2720,102 +5632,84 @@ def handle_audio(message):
         user_id = None
         first_name = message.chat.title if hasattr(message.chat, 'title') else "قناة"
 
-    logger.info(f"تم استلام ملف صوتي من {first_name} ({user_id}): {audio.file_name}")
+    file_name = audio.file_name or "audio_file.mp3"
+    logger.info(f"تم استلام ملف صوتي من {first_name} ({user_id}): {file_name}")
+
+    job = {
+        "file_id": audio.file_id,
+        "file_unique_id": audio.file_unique_id,
+        "file_name": file_name,
+        "caption": message.caption,
+        "chat_id": message.chat.id,
+        "message_id": message.message_id,
+        "user_id": user_id,
+        "status_message_id": None
+    }
+
+    # ملفات الألبوم تُجمع وتُعالج معاً
+    if message.media_group_id:
+        buffer_media_group_job(job, message.media_group_id)
+        return
 
-    # إخبار المستخدم بأننا نعالج الملف، فقط إذا كانت رسالة خاصة أو جروب
+    # المعالج يضيف المهمة فقط، ورسالة الاستلام يرسلها خيط المعالجة حتى لا ينتظر حدود الإرسال
     if user_id:
-        processing_msg = bot.reply_to(message, 
-            f"تم استلام الملف الصوتي: {audio.file_name}\n"
-            "جاري معالجة الملف..."
-        )
-    else:
-        processing_msg = None
+        job["acknowledge"] = True
 
-    try:
-        # تحميل الملف الصوتي
-        file_path = download_file(audio.file_id)
-
-        if not file_path:
-            if processing_msg:
-                bot.edit_message_text(
-                    "⚠️ حدث خطأ أثناء تحميل الملف الصوتي.",
-                    chat_id=message.chat.id,
-                    message_id=processing_msg.message_id
-                )
-            else:
-                logger.error("⚠️ حدث خطأ أثناء تحميل الملف الصوتي.")
-            return
+    if not enqueue_audio_job(job):
+        logger.warning(f"قائمة انتظار المعالجة ممتلئة، تم رفض الملف: {file_name}")
+        threading.Thread(
+            target=notify_job_user,
+            args=(job, "⚠️ قائمة انتظار المعالجة ممتلئة حالياً. الرجاء إعادة إرسال الملف لاحقاً."),
+            daemon=True
+        ).start()
 
-        # استخراج العنوان من وصف الرسالة أو اسم الملف
-        title = message.caption if message.caption else os.path.splitext(audio.file_name)[0]
 
-        # معالجة وسوم الملف الصوتي
-        success = process_audio_tags(file_path, title)
+@bot.channel_post_handler(content_types=['audio'], func=is_source_channel_post)
+def handle_channel_audio(message):
+    """استلام الملفات الصوتية المنشورة في قنوات المصدر وإعادة نشرها في قنوات الهدف"""
+    audio = message.audio
+    file_name = audio.file_name or "audio_file.mp3"
+    channel_id = message.chat.id
+
+    logger.info(f"تم استلام ملف صوتي من قناة المصدر {message.chat.title} ({channel_id}): {file_name}")
+
+    job = {
+        "file_id": audio.file_id,
+        "file_unique_id": audio.file_unique_id,
+        "file_name": file_name,
+        "caption": message.caption,
+        "chat_id": channel_id,
+        "message_id": message.message_id,
+        "user_id": None,
+        "status_message_id": None,
+        "source_channel": channel_id,
+        "sequence": assign_channel_sequence(channel_id)
+    }
+
+    # ملفات الألبوم تُجمع وتُعالج معاً
+    if message.media_group_id:
+        buffer_media_group_job(job, message.media_group_id)
+        return
+
+    if not enqueue_audio_job(job):
+        logger.warning(f"قائمة انتظار المعالجة ممتلئة، تم تجاهل منشور القناة: {file_name}")
+
+
+@bot.message_handler(func=lambda message: True)
+def echo_all(message):
+    """الرد على جميع الرسائل الأخرى"""
+    bot.reply_to(message, "هذا بوت لمعالجة الملفات الصوتية. أرسل /help للمساعدة.")
+
 
-        if success:
-            # إعادة إرسال الملف مع الوسوم المعدلة
-            with open(file_path, 'rb') as audio_file:
-                current_template = templates[current_template_key]
-                # إذا من قناة، أرسل للهدف فقط، إذا من مستخدم أرسل له وللقناة الهدف إن وجد
-                if user_id:
-                    bot.send_audio(
-                        message.chat.id,
-                        audio_file,
-                        caption=f"تم معالجة الملف الصوتي: {audio.file_name}",
-                        title=title,
-                        performer=current_template["artist"],
-                    )
-                # إعادة نشر في قناة الهدف إذا تم ضبطها
-                if TARGET_CHANNEL:
-                    with open(file_path, 'rb') as audio_file2:
-                        bot.send_audio(
-                            TARGET_CHANNEL,
-                            audio_file2,
-                            caption=message.caption if message.caption else f"تم نشر الملف الصوتي: {title}",
-                            title=title,
-                            performer=current_template["artist"],
-                        )
-                    logger.info(f"📢 تم إعادة نشر الملف الصوتي في القناة: {TARGET_CHANNEL}")
-                    if user_id:
-                        bot.send_message(
-                            message.chat.id,
-                            f"📢 تم إعادة نشر الملف الصوتي في القناة: {TARGET_CHANNEL}"
-                        )
-            # إبلاغ المستخدم بالتعديلات التي تمت
-            if processing_msg and user_id:
-                bot.edit_message_text(
-                    f"✅ تم معالجة الملف الصوتي بنجاح!\n"
-                    f"🎵 العنوان: {title}\n"
-                    f"👤 الفنان: {current_template['artist']}\n"
-                    f"💿 الألبوم: {current_template['album']}",
-                    chat_id=message.chat.id,
-                    message_id=processing_msg.message_id
-                )
-        else:
-            if processing_msg and user_id:
-                bot.edit_message_text(
-                    "⚠️ حدث خطأ أثناء معالجة وسوم الملف الصوتي.",
-                    chat_id=message.chat.id,
-                    message_id=processing_msg.message_id
-                )
-            else:
-                logger.error("⚠️ حدث خطأ أثناء معالجة وسوم الملف الصوتي.")
-    except Exception as e:
-        logger.error(f"خطأ في معالجة الملف الصوتي: {e}")
-        if processing_msg and user_id:
-            bot.edit_message_text(
-                f"⚠️ حدث خطأ أثناء معالجة الملف الصوتي: {str(e)}",
-                chat_id=message.chat.id,
-                message_id=processing_msg.message_id
-            )
 # وظائف حفظ واسترجاع البيانات
 def reset_data():
     """إعادة تعيين جميع البيانات إلى القيم الافتراضية"""
-    global SOURCE_CHANNEL, TARGET_CHANNEL, current_template_key, templates
+    global SOURCE_CHANNEL, TARGET_CHANNEL, EXTRA_TARGET_CHANNELS, current_template_key, templates
     global replacements, footers, config, album_cover_path
     
     SOURCE_CHANNEL = ""
     TARGET_CHANNEL = ""
+    EXTRA_TARGET_CHANNELS = list(DEFAULT_EXTRA_TARGET_CHANNELS)
     current_template_key = "افتراضي"
     templates = {
         "افتراضي": {
@@ -2841,33 +5735,33 @@ def reset_data():
         "replacement_enabled": True,
         "footer_enabled": True,
         "remove_links_enabled": True,
-        "album_cover_enabled": True
+        "album_cover_enabled": True,
+        "normalize_arabic_enabled": False,
+        "trim_whitespace_enabled": False
     }
     album_cover_path = None
+    invalidate_replacement_matchers()
+    invalidate_cover_cache()
     
     # حذف ملف البيانات إذا كان موجوداً
     if os.path.exists('bot_data.json'):
         os.remove('bot_data.json')
     
     # حذف صور الألبوم
-    if os.path.exists('album_covers'):
-        for file in os.listdir('album_covers'):
-            file_path = os.path.join('album_covers', file)
+    if os.path.exists(ALBUM_COVERS_DIR):
+        for file in os.listdir(ALBUM_COVERS_DIR):
+            file_path = os.path.join(ALBUM_COVERS_DIR, file)
             try:
                 os.remove(file_path)
             except Exception as e:
                 logger.error(f"خطأ في حذف الملف {file_path}: {e}")
-        os.rmdir('album_covers')
+        os.rmdir(ALBUM_COVERS_DIR)
     
     logger.info("تم إعادة تعيين جميع البيانات إلى القيم الافتراضية")
 
-def save_data():
-    """حفظ جميع البيانات في قاعدة البيانات وملف JSON كنسخة احتياطية"""
-    # حفظ في قاعدة البيانات
-    save_settings_to_db()
-    
-    # حفظ نسخة احتياطية في ملف
-    data = {
+def collect_settings():
+    """جمع أقسام الإعدادات القابلة للحفظ في قاموس واحد"""
+    return {
         'source_channel': SOURCE_CHANNEL,
         'target_channel': TARGET_CHANNEL,
         'current_template_key': current_template_key,
@@ -2877,12 +5771,74 @@ def save_data():
         'config': config,
         'album_cover_path': album_cover_path
     }
-    try:
-        with open('bot_data.json', 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        logger.info("تم حفظ النسخة الاحتياطية بنجاح")
-    except Exception as e:
-        logger.error(f"خطأ في حفظ النسخة الاحتياطية: {e}")
+
+
+def save_data():
+    """تسجيل تعديل في الإعدادات وجدولة حفظها في قاعدة البيانات وملف JSON.
+
+    التعديلات المتتالية خلال SETTINGS_SAVE_DEBOUNCE ثانية تُدمج في عملية حفظ واحدة.
+    """
+    # إعادة بناء خطة القالب ولوحات المفاتيح لتعكس التعديلات الجديدة
+    rebuild_template_plan()
+    invalidate_keyboard_cache()
+    schedule_settings_flush(SETTINGS_SAVE_DEBOUNCE)
+
+
+def schedule_settings_flush(delay):
+    """جدولة حفظ الإعدادات بعد delay ثانية إذا لم يكن هناك حفظ مجدول بالفعل."""
+    global settings_flush_timer
+
+    with settings_timer_lock:
+        if settings_flush_timer is None:
+            settings_flush_timer = threading.Timer(delay, flush_settings)
+            settings_flush_timer.daemon = True
+            settings_flush_timer.start()
+
+
+def flush_settings():
+    """حفظ أقسام الإعدادات التي تغيرت منذ آخر حفظ فقط."""
+    global settings_flush_timer
+
+    with settings_timer_lock:
+        if settings_flush_timer is not None:
+            settings_flush_timer.cancel()
+            settings_flush_timer = None
+
+    with settings_flush_lock:
+        try:
+            data = collect_settings()
+            serialized = {
+                name: json.dumps(value, ensure_ascii=False, sort_keys=True)
+                for name, value in data.items()
+            }
+            backup = json.dumps(data, ensure_ascii=False)
+        except RuntimeError as e:
+            # تم تعديل الإعدادات أثناء قراءتها، نعيد المحاولة بعد فترة قصيرة
+            logger.warning(f"تأجيل حفظ الإعدادات: {e}")
+            schedule_settings_flush(SETTINGS_SAVE_DEBOUNCE)
+            return
+
+        changed = {
+            name: value for name, value in serialized.items()
+            if persisted_settings.get(name) != value
+        }
+        if not changed:
+            return
+
+        # حفظ الأقسام المعدلة فقط في قاعدة البيانات، وإعادة المحاولة لاحقاً إذا فشل الحفظ
+        if save_settings_to_db(changed) or not connection_pool:
+            persisted_settings.update(changed)
+        else:
+            schedule_settings_flush(SETTINGS_SAVE_RETRY)
+
+        # حفظ نسخة احتياطية في ملف بشكل ذري
+        try:
+            with open('bot_data.json.tmp', 'w', encoding='utf-8') as f:
+                f.write(backup)
+            os.replace('bot_data.json.tmp', 'bot_data.json')
+            logger.info("تم حفظ النسخة الاحتياطية بنجاح")
+        except Exception as e:
+            logger.error(f"خطأ في حفظ النسخة الاحتياطية: {e}")
 
 def load_data():
     """استرجاع البيانات من قاعدة البيانات أو ملف JSON كنسخة احتياطية"""
@@ -2900,6 +5856,8 @@ def load_data():
         footers.update(db_data.get('footers', {}))
         config.update(db_data.get('config', {}))
         album_cover_path = db_data.get('album_cover_path')
+        invalidate_replacement_matchers()
+        rebuild_template_plan()
         logger.info("تم تحميل البيانات من قاعدة البيانات بنجاح")
         return
     
@@ -2921,24 +5879,159 @@ def load_data():
     except Exception as e:
         logger.error(f"خطأ في تحميل البيانات: {e}")
 
+    invalidate_replacement_matchers()
+    rebuild_template_plan()
+
 # تعديل الوظائف الأساسية لحفظ البيانات بعد كل تغيير
 def update_data(callback_query=None, success_message=None):
     """تحديث البيانات وإظهار رسالة نجاح اختيارية"""
     save_data()
     if callback_query and success_message:
-        bot.answer_callback_query(callback_query.id, success_message, show_alert=True)
+        answer_callback(callback_query, success_message, show_alert=True)
+
+# ==== استلام التحديثات عبر Webhook ====
+
+webhook_executor = None
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """استقبال التحديثات من تلجرام وتمريرها لمعالجات البوت في خيوط منفصلة."""
+
+    def _reply(self, status, body=b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        # فحص الحالة لموازن الأحمال
+        if self.path == "/health":
+            self._reply(200, b"ok")
+        else:
+            self._reply(404)
+
+    def do_POST(self):
+        if self.path != WEBHOOK_PATH:
+            self._reply(404)
+            return
+
+        # التحقق من الرمز السري قبل قراءة الطلب (المقارنة بالبايتات حتى لا تفشل مع ترويسة غير ASCII)
+        token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not WEBHOOK_SECRET or not hmac.compare_digest(
+            token.encode(), WEBHOOK_SECRET.encode()
+        ):
+            logger.warning(f"تم رفض طلب webhook برمز سري غير صحيح من {self.client_address[0]}")
+            self._reply(403)
+            return
+
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        if length <= 0 or length > WEBHOOK_MAX_BODY:
+            self._reply(413 if length > WEBHOOK_MAX_BODY else 400)
+            return
+
+        try:
+            update = types.Update.de_json(self.rfile.read(length).decode("utf-8"))
+        except Exception as e:
+            logger.error(f"خطأ في قراءة تحديث webhook: {e}")
+            self._reply(400)
+            return
+
+        # الرد فوراً على تلجرام ومعالجة التحديث في الخلفية
+        webhook_executor.submit(process_webhook_update, update)
+        self._reply(200)
+
+    def log_message(self, format, *args):
+        logger.debug(f"webhook {self.client_address[0]}: {format % args}")
+
+
+def process_webhook_update(update):
+    """تمرير تحديث واحد لمعالجات البوت."""
+    try:
+        bot.process_new_updates([update])
+    except Exception as e:
+        logger.error(f"خطأ في معالجة تحديث webhook: {e}")
+
+
+def create_webhook_server(listen=None, port=None):
+    """إنشاء خادم webhook ومجمع خيوط المعالجة دون تسجيل العنوان لدى تلجرام."""
+    global webhook_executor
+
+    # المعالجات تعمل مباشرة في خيوط المجمع بدلاً من مجمع telebot الداخلي
+    bot.threaded = False
+    webhook_executor = ThreadPoolExecutor(max_workers=WEBHOOK_WORKERS, thread_name_prefix="webhook")
+
+    server = ThreadingHTTPServer(
+        (listen if listen is not None else WEBHOOK_LISTEN, port if port is not None else WEBHOOK_PORT),
+        WebhookHandler
+    )
+    server.daemon_threads = True
+    return server
+
+
+def run_webhook():
+    """تشغيل البوت في وضع webhook حتى الإيقاف، مع إنهاء التحديثات الجارية قبل الخروج."""
+    server = create_webhook_server()
+
+    if WEBHOOK_URL:
+        bot.set_webhook(
+            url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES,
+            max_connections=WEBHOOK_WORKERS
+        )
+        logger.info(f"تم تسجيل webhook على العنوان: {WEBHOOK_URL}")
+    else:
+        logger.warning("WEBHOOK_URL غير معرف - يجب تسجيل webhook يدوياً أو عبر موازن الأحمال")
+
+    logger.info(f"خادم webhook يستمع على {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        webhook_executor.shutdown(wait=True)
+
 
 # بدء تشغيل البوت
 if __name__ == "__main__":
     logger.info("بدء تشغيل البوت...")
+
+    # وضع webhook بدون رمز سري يقبل تحديثات مزورة من أي مصدر
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_SECRET غير موجود في ملف .env وهو مطلوب في وضع webhook")
+
+    if Image is None:
+        logger.warning("مكتبة Pillow غير مثبتة: ستُضاف صورة الألبوم بحجمها الأصلي دون تصغير")
     
-    # تحميل البيانات المحفوظة
+    # تحميل البيانات المحفوظة ومعرف هذه النسخة (يُستخدم في مجلد العمل وحجز المهام)
     load_data()
+    load_dedup_index()
+    init_worker_id()
+
+    # تشغيل خيوط معالجة الملفات الصوتية وكتابة السجلات واستئناف المهام المحفوظة
+    start_spool_reaper()
+    start_edit_log_writer()
+    start_audio_workers()
+    start_job_feeder()
+
+    # حفظ أي تعديلات معلقة على الإعدادات عند إيقاف البوت
+    atexit.register(flush_settings)
+    atexit.register(save_dedup_index)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     
-    while True:
+    if BOT_MODE == "webhook":
+        run_webhook()
+    else:
+        # لا يمكن استخدام getUpdates أثناء وجود webhook مسجل
         try:
-            logger.info("محاولة تشغيل البوت...")
-            bot.infinity_polling(allowed_updates=["message", "channel_post", "callback_query"], timeout=20)
+            bot.remove_webhook()
         except Exception as e:
-            logger.error(f"خطأ في تشغيل البوت: {e}")
-            time.sleep(3)
+            logger.error(f"خطأ في إلغاء webhook: {e}")
+
+        while True:
+            try:
+                logger.info("محاولة تشغيل البوت...")
+                bot.infinity_polling(allowed_updates=ALLOWED_UPDATES, timeout=20)
+            except Exception as e:
+                logger.error(f"خطأ في تشغيل البوت: {e}")
+                time.sleep(3)
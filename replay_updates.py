@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+إعادة إرسال تحديثات تلجرام مسجلة إلى خادم webhook الخاص بالبوت
+
+يقبل ملف JSON يحتوي على قائمة تحديثات أو ملف JSONL (تحديث في كل سطر)،
+ويرسلها إلى العنوان المحدد مع الرمز السري، ثم يعرض رموز الاستجابة وزمنها.
+
+الاستخدام:
+    python replay_updates.py updates.jsonl [--url URL] [--secret SECRET] [--concurrency N] [--repeat N]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def load_updates(path):
+    """قراءة التحديثات المسجلة من ملف JSON أو JSONL."""
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read().strip()
+
+    if content.startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="إعادة إرسال تحديثات مسجلة إلى خادم webhook")
+    parser.add_argument("path", help="ملف التحديثات (JSON أو JSONL)")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{os.getenv('WEBHOOK_PORT', '8443')}{os.getenv('WEBHOOK_PATH', '/webhook')}")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    updates = load_updates(args.path) * args.repeat
+    session = requests.Session()
+    headers = {"Content-Type": "application/json"}
+    if args.secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = args.secret
+
+    def post(update):
+        started = time.perf_counter()
+        try:
+            response = session.post(args.url, data=json.dumps(update), headers=headers, timeout=10)
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        return status, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(post, updates))
+    elapsed = time.perf_counter() - started
+
+    statuses = Counter(status for status, _ in results)
+    latencies = sorted(latency for _, latency in results)
+
+    print(f"عدد التحديثات: {len(results)} خلال {elapsed:.2f} ثانية ({len(results) / elapsed:.1f} تحديث/ثانية)")
+    print(f"رموز الاستجابة: {dict(statuses)}")
+    if latencies:
+        print(f"زمن الاستجابة: الوسيط {latencies[len(latencies) // 2] * 1000:.1f}ms، "
+              f"الأقصى {latencies[-1] * 1000:.1f}ms")
+
+    # رمز خروج غير صفري إذا لم تُقبل جميع التحديثات
+    sys.exit(0 if statuses.get(200, 0) == len(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# البوت يتطلب رمزاً عند الاستيراد، ولا يتم الاتصال بتلجرام أثناء الاختبارات
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
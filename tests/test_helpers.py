@@ -0,0 +1,138 @@
+"""اختبارات الدوال الحتمية: محرك الاستبدال، حذف الروابط، مفتاح الفهرس، وتحديد صيغة الملف."""
+
+import pytest
+
+import new_bot
+
+
+def sequential_replace(text, rules):
+    """التطبيق المرجعي: str.replace لكل قاعدة بالترتيب."""
+    for original, replacement in rules:
+        text = text.replace(original, replacement)
+    return text
+
+
+@pytest.fixture
+def use_rules(monkeypatch):
+    """تفعيل قواعد استبدال للعنوان فقط وإعادة بناء المحركات المترجمة."""
+    def apply(rules):
+        monkeypatch.setattr(new_bot, "replacements", {
+            str(index): {"name": str(index), "original": original, "replacement": replacement, "tags": ["title"]}
+            for index, (original, replacement) in enumerate(rules, 1)
+        })
+        monkeypatch.setitem(new_bot.config, "replacement_enabled", True)
+        new_bot.invalidate_replacement_matchers()
+
+    yield apply
+    new_bot.invalidate_replacement_matchers()
+
+
+@pytest.mark.parametrize("rules, text", [
+    ([("قناة", ""), ("@sponsor", "")], "نشيد قناة جديد @sponsor"),
+    ([("ab", "x"), ("abc", "y")], "abcabc ab"),
+    ([("a", "b"), ("b", "c")], "aabb"),
+    ([("x", ""), ("ay", "Z")], "axy ay"),
+    ([("foo", "bar"), ("bar", "foo"), ("o", "0")], "foobar boo"),
+    ([("", "-"), ("a", "b")], "aa"),
+])
+def test_replacements_match_sequential_replace(use_rules, rules, text):
+    use_rules(rules)
+    assert new_bot.apply_replacements(text, "title") == sequential_replace(text, rules)
+
+
+def test_replacements_skip_other_tags(use_rules):
+    use_rules([("قناة", "")])
+    assert new_bot.apply_replacements("نشيد قناة", "artist") == "نشيد قناة"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("محاضرة https://example.com/x الأولى", "محاضرة  الأولى"),
+    ("تابعونا t.me/channel", "تابعونا "),
+    ("قناة 🎧@my_channel🎧 الرسمية", "قناة  الرسمية"),
+    ("www.example.com نشيد", " نشيد"),
+    ("نص عادي بدون روابط", "نص عادي بدون روابط"),
+])
+def test_strip_links(text, expected):
+    assert new_bot.strip_links(text) == expected
+
+
+def test_remove_links_respects_toggle(monkeypatch):
+    monkeypatch.setitem(new_bot.config, "remove_links_enabled", False)
+    assert new_bot.remove_links("https://example.com") == "https://example.com"
+
+
+def test_dedup_key_is_stable_for_same_input():
+    job = {"file_unique_id": "AQAD", "track_number": None}
+    assert new_bot.get_dedup_key(job, "عنوان") == new_bot.get_dedup_key(dict(job), "عنوان")
+
+
+def test_dedup_key_depends_on_title_and_track():
+    job = {"file_unique_id": "AQAD", "track_number": "1"}
+    keys = {
+        new_bot.get_dedup_key(job, "عنوان"),
+        new_bot.get_dedup_key(job, "عنوان آخر"),
+        new_bot.get_dedup_key(dict(job, track_number="2"), "عنوان"),
+        new_bot.get_dedup_key(dict(job, file_unique_id="AQAE"), "عنوان"),
+    }
+    assert len(keys) == 4
+
+
+def test_dedup_key_changes_with_settings(monkeypatch):
+    job = {"file_unique_id": "AQAD"}
+    before = new_bot.get_dedup_key(job, "عنوان")
+    monkeypatch.setitem(new_bot.config, "footer_enabled", not new_bot.config["footer_enabled"])
+    new_bot.rebuild_template_plan()
+    try:
+        assert new_bot.get_dedup_key(job, "عنوان") != before
+    finally:
+        monkeypatch.undo()
+        new_bot.rebuild_template_plan()
+    assert new_bot.get_dedup_key(job, "عنوان") == before
+
+
+def test_dedup_key_disabled(monkeypatch):
+    assert new_bot.get_dedup_key({"file_unique_id": None}, "عنوان") is None
+    monkeypatch.setattr(new_bot, "DEDUP_MAX_ENTRIES", 0)
+    assert new_bot.get_dedup_key({"file_unique_id": "AQAD"}, "عنوان") is None
+
+
+MPEG_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 60
+ADTS_FRAME = b"\xff\xf1\x50\x80" + b"\x00" * 60
+
+
+def id3_header(size):
+    """ترويسة ID3v2.4 فارغة بحجم syncsafe."""
+    return b"ID3\x04\x00\x00" + bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0)) + b"\x00" * size
+
+
+@pytest.mark.parametrize("data, adts, mpeg", [
+    (MPEG_FRAME, False, True),
+    (b"\xff\xf3\x90\x64", False, True),  # MPEG-2 Layer III
+    (ADTS_FRAME, True, False),
+    (b"\xff\xf9\x50\x80", True, False),  # ADTS لـ MPEG-2
+    (b"fLaC", False, False),
+    (b"\xff", False, False),
+])
+def test_frame_sync_classification(data, adts, mpeg):
+    assert new_bot.is_adts_frame(data) is adts
+    assert new_bot.is_mpeg_frame(data) is mpeg
+
+
+@pytest.mark.parametrize("data, expected", [
+    (MPEG_FRAME, "mp3"),
+    (ADTS_FRAME, None),
+    (id3_header(32) + MPEG_FRAME, "mp3"),
+    (id3_header(32) + b"\x00" * 16 + MPEG_FRAME, "mp3"),
+    (id3_header(32) + ADTS_FRAME, None),
+    (id3_header(32) + b"fLaC" + b"\x00" * 60, "flac"),
+    (id3_header(32) + b"garbage" * 10, None),
+    (b"fLaC" + b"\x00" * 60, "flac"),
+    (b"OggS" + b"\x00" * 24 + b"OpusHead" + b"\x00" * 32, "opus"),
+    (b"OggS" + b"\x00" * 24 + b"\x01vorbis" + b"\x00" * 32, "vorbis"),
+    (b"\x00\x00\x00\x20ftypM4A " + b"\x00" * 52, "mp4"),
+    (b"RIFF" + b"\x00" * 60, None),
+])
+def test_detect_audio_format(tmp_path, data, expected):
+    path = tmp_path / "audio.bin"
+    path.write_bytes(data)
+    assert new_bot.detect_audio_format(str(path)) == expected